@@ -2,6 +2,7 @@ import argparse
 
 
 from lib.augment_generation import citation_command, llm_summarizer_command, question_command, rag_command
+from lib.query_enhancer import ENHANCE_METHODS
 from lib.utils.constants import DEFAULT_K, DEFAULT_SEARCH_LIMIT
 
 
@@ -25,7 +26,7 @@ def main():
                             help="Limits the search results to set value")
 
     rag_parser.add_argument("--enhance", type=str,
-                            choices=["spell", "rewrite", "expand"], default="rewrite", help="Query enhancement method")
+                            choices=ENHANCE_METHODS, default="rewrite", help="Query enhancement method")
 
     rag_parser.add_argument("--rerank-method", type=str,
                             choices=["individual", "batch", "cross_encoder"], default="individual", help="Query re-rank method")
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+import argparse
+
+from lib.utils.benchmark_utils import (
+    benchmark_bm25_batch,
+    benchmark_encoders,
+    benchmark_hnsw,
+    benchmark_index_build,
+    benchmark_ivfpq,
+    benchmark_startup,
+)
+from lib.utils.constants import DEFAULT_SEARCH_LIMIT, HNSW_EF_CONSTRUCTION, HNSW_M, IVF_RERANK, PQ_SUBVECTORS
+from lib.utils.embedding_utils import EMBEDDING_ENCODERS
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark CLI")
+    subparsers = parser.add_subparsers(
+        dest="command", help="Available commands")
+
+    index_build_parser = subparsers.add_parser(
+        "index-build", help="Measure inverted index build throughput per worker count")
+    index_build_parser.add_argument(
+        "--workers", type=int, nargs="+", default=[1, 2, 4, 8], help="Worker counts to benchmark (default: 1 2 4 8)")
+
+    bm25_batch_parser = subparsers.add_parser(
+        "bm25-batch", help="Compare per-query BM25 search with vectorized batch scoring")
+    bm25_batch_parser.add_argument(
+        "--queries", type=int, default=1000, help="Number of queries, taken from movie titles (default: 1000)")
+    bm25_batch_parser.add_argument(
+        "--limit", type=int, default=10, help="Results per query (default: 10)")
+
+    hnsw_parser = subparsers.add_parser(
+        "hnsw", help="Recall@k vs latency of HNSW chunk search against the exact scan")
+    hnsw_parser.add_argument(
+        "--queries", type=int, default=200, help="Number of queries, taken from movie titles (default: 200)")
+    hnsw_parser.add_argument(
+        "-k", type=int, default=10, help="Nearest chunks per query (default: 10)")
+    hnsw_parser.add_argument(
+        "--ef-search", type=int, nargs="+", default=[16, 32, 64, 128, 256], help="Search widths to try (default: 16 32 64 128 256)")
+    hnsw_parser.add_argument(
+        "--m", type=int, default=HNSW_M, help=f"Graph degree (default: {HNSW_M})")
+    hnsw_parser.add_argument(
+        "--ef-construction", type=int, default=HNSW_EF_CONSTRUCTION, help=f"Build search width (default: {HNSW_EF_CONSTRUCTION})")
+
+    ivfpq_parser = subparsers.add_parser(
+        "ivfpq", help="Recall@k, latency and memory of IVF-PQ chunk search against the exact scan")
+    ivfpq_parser.add_argument(
+        "--queries", type=int, default=200, help="Number of queries, taken from movie titles (default: 200)")
+    ivfpq_parser.add_argument(
+        "-k", type=int, default=10, help="Nearest chunks per query (default: 10)")
+    ivfpq_parser.add_argument(
+        "--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32], help="Lists scanned per query to try (default: 1 4 8 16 32)")
+    ivfpq_parser.add_argument(
+        "--rerank", type=int, default=IVF_RERANK, help=f"Candidates re-scored exactly (default: {IVF_RERANK})")
+    ivfpq_parser.add_argument(
+        "--subvectors", type=int, default=PQ_SUBVECTORS, help=f"PQ bytes per vector (default: {PQ_SUBVECTORS})")
+
+    encoders_parser = subparsers.add_parser(
+        "encoders", help="Latency, throughput and golden dataset quality of the PyTorch and ONNX encoders")
+    encoders_parser.add_argument(
+        "--encoders", choices=EMBEDDING_ENCODERS, nargs="+", default=list(EMBEDDING_ENCODERS),
+        help=f"Encoders to compare, vectors are checked against the first (default: {' '.join(EMBEDDING_ENCODERS)})")
+    encoders_parser.add_argument(
+        "--limit", type=int, default=DEFAULT_SEARCH_LIMIT, help=f"Results per golden query (default: {DEFAULT_SEARCH_LIMIT})")
+
+    startup_parser = subparsers.add_parser(
+        "startup", help="Interpreter start plus import time of every CLI entry point")
+    startup_parser.add_argument(
+        "--runs", type=int, default=5, help="Fresh interpreters per entry point, the median is reported (default: 5)")
+
+    args = parser.parse_args()
+
+    match args.command:
+        case "index-build":
+            results = benchmark_index_build(args.workers)
+
+            baseline = results[0]["docs_per_sec"]
+            print(f"{'workers':>8} {'seconds':>9} {'docs/sec':>10} {'speedup':>8}")
+            for result in results:
+                print(
+                    f"{result['workers']:>8} {result['seconds']:>9.2f} {result['docs_per_sec']:>10.0f} {result['docs_per_sec'] / baseline:>7.2f}x")
+
+        case "bm25-batch":
+            result = benchmark_bm25_batch(args.queries, args.limit)
+
+            print(f"queries:           {result['queries']}")
+            print(f"matrix load/build: {result['matrix_seconds']:.2f}s")
+            print(f"bm25_search:       {result['single_qps']:.0f} queries/sec")
+            print(f"bm25_search_many:  {result['batch_qps']:.0f} queries/sec "
+                  f"({result['batch_qps'] / result['single_qps']:.1f}x)")
+
+        case "hnsw":
+            result = benchmark_hnsw(
+                args.queries, args.k, args.ef_search, args.m, args.ef_construction)
+
+            print(f"chunks:      {result['chunks']}")
+            print(f"queries:     {result['queries']}")
+            print(f"graph build: {result['build_seconds']:.1f}s")
+            print(f"exact scan:  {result['exact_ms_per_query']:.2f} ms/query")
+            print(f"{'ef_search':>9} {f'recall@{args.k}':>10} {'ms/query':>9}")
+            for run in result["runs"]:
+                print(
+                    f"{run['ef_search']:>9} {run['recall']:>10.3f} {run['ms_per_query']:>9.2f}")
+
+        case "ivfpq":
+            result = benchmark_ivfpq(
+                args.queries, args.k, args.nprobe, args.rerank, args.subvectors)
+
+            print(f"chunks:      {result['chunks']}")
+            print(f"queries:     {result['queries']}")
+            print(f"index build: {result['build_seconds']:.1f}s")
+            print(f"memory:      {result['index_bytes'] / 1e6:.1f} MB vs {result['vector_bytes'] / 1e6:.1f} MB float32 "
+                  f"({result['vector_bytes'] / result['index_bytes']:.1f}x)")
+            print(f"exact scan:  {result['exact_ms_per_query']:.2f} ms/query")
+            print(f"{'nprobe':>6} {'rerank':>6} {f'recall@{args.k}':>10} {'ms/query':>9}")
+            for run in result["runs"]:
+                print(
+                    f"{run['nprobe']:>6} {run['rerank']:>6} {run['recall']:>10.3f} {run['ms_per_query']:>9.2f}")
+
+        case "encoders":
+            results = benchmark_encoders(args.encoders, args.limit)
+
+            print(f"{'encoder':<10} {'load s':>7} {'query ms':>9} {'texts/sec':>10} "
+                  f"{f'P@{args.limit}':>6} {f'R@{args.limit}':>6} {'min cos':>8} {'mean cos':>9}")
+            for result in results:
+                print(f"{result['encoder']:<10} {result['load_seconds']:>7.1f} {result['query_ms']:>9.2f} "
+                      f"{result['texts_per_sec']:>10.0f} {result['precision']:>6.3f} {result['recall']:>6.3f} "
+                      f"{result['min_cosine']:>8.4f} {result['mean_cosine']:>9.4f}")
+
+        case "startup":
+            results = benchmark_startup(args.runs)
+
+            print(f"{'entry point':<24} {'ms':>7}  slowest imports (cumulative ms)")
+            for result in results:
+                if result["error"]:
+                    print(f"{result['entry_point']:<24} {'-':>7}  {result['error']}")
+                    continue
+                imports = ", ".join(f"{name} {us / 1000:.0f}" for name, us in result["slowest_imports"])
+                print(f"{result['entry_point']:<24} {result['ms']:>7.1f}  {imports}")
+
+        case _:
+            parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,7 @@ from lib.hybrid_search import get_hybrid_search
 from lib.llm_reranker import evaluate_results, llm_rerank_batch, llm_rerank_individual, re_rank
 from lib.utils.constants import DEFAULT_K, DEFAULT_SEARCH_LIMIT, DEFAULT_WEIGHT, SEARCH_LIMIT_MULTIPLIER
 from lib.utils.hybrid_search_utils import normalize_scores
-from lib.query_enhancer import query_enhancer
+from lib.query_enhancer import ENHANCE_METHODS, query_enhancer
 
 
 def main() -> None:
@@ -43,7 +43,7 @@ def main() -> None:
                             help="Limits the search results to set value")
 
     rrf_parser.add_argument("--enhance", type=str,
-                            choices=["spell", "rewrite", "expand"], default="spell", help="Query enhancement method")
+                            choices=ENHANCE_METHODS, default="local_spell", help="Query enhancement method")
 
     rrf_parser.add_argument("--rerank-method", type=str,
                             choices=["individual", "batch", "cross_encoder"], default="individual", help="Query re rank method")
@@ -2,15 +2,21 @@
 
 import argparse
 from lib.inverted_index import build_command
-from lib.utils.constants import BM25_B, BM25_K1
+from lib.utils.constants import BM25_B, BM25_K1, BM25F_WEIGHTS, INDEX_FIELDS
 from lib.utils.keyword_search_utils import (
+    autocomplete_command,
     bm25_idf_command,
     bm25_tf_command,
+    bm25f_search_command,
     bm25search,
+    boolean_search_command,
+    delete_command,
     idf_command,
+    query_cache_stats_command,
     search_command,
     tf_command,
     tf_idf_command,
+    upsert_command,
 )
 
 
@@ -19,12 +25,33 @@ def main() -> None:
     subparsers = parser.add_subparsers(
         dest="command", help="Available commands")
 
-    subparsers.add_parser("build", help="Build the inverted index")
+    build_parser = subparsers.add_parser(
+        "build", help="Build the inverted index")
+    build_parser.add_argument(
+        "--workers", "-w", type=int, default=1, help="Number of processes used to build the index (default: 1)")
+    build_parser.add_argument(
+        "--positions", action="store_true", help="Store token positions for phrase and proximity queries")
+
+    upsert_parser = subparsers.add_parser(
+        "upsert", help="Add or update movies in the index without a full rebuild")
+    upsert_parser.add_argument(
+        "path", type=str, help="JSON file with a 'movies' list like data/movies.json, or a .jsonl file with one movie per line")
+
+    delete_parser = subparsers.add_parser(
+        "delete", help="Remove a movie from the index")
+    delete_parser.add_argument("doc_id", type=int, help="Document Id")
 
     search_parser = subparsers.add_parser(
         "search", help="Search movies using BM25")
     search_parser.add_argument("query", type=str, help="Search query")
 
+    boolean_parser = subparsers.add_parser(
+        "boolean", help="Match movies with a boolean query, e.g. '(alien OR robot) AND NOT \"space station\"'")
+    boolean_parser.add_argument(
+        "query", type=str, help="Query using AND, OR, NOT, parentheses and \"quoted phrases\" (adjacent words are ANDed)")
+    boolean_parser.add_argument(
+        "--limit", "-l", type=int, default=5, help="Number of results to return (default: 5)")
+
     # TF
     tf_parser = subparsers.add_parser(
         "tf", help="Get frequency of a term in the document")
@@ -64,15 +91,55 @@ def main() -> None:
     # BM25 SEARCH
     bm25search_parser = subparsers.add_parser(
         "bm25search", help="Search movies using full BM25 scoring")
-    bm25search_parser.add_argument("query", type=str, help="Search query")
     bm25search_parser.add_argument(
+        "query", type=str, help='Search query, "quoted phrases" must match exactly')
+    bm25search_parser.add_argument(
+        "--limit", "-l", type=int, default=5,  help="Number of results to return (default: 5)")
+    bm25search_parser.add_argument(
+        "--proximity", action="store_true", help="Boost documents where the query terms appear close together")
+
+    # BM25F SEARCH
+    bm25f_parser = subparsers.add_parser(
+        "bm25fsearch", help="Search movies using field-weighted BM25F (title hits count more)")
+    bm25f_parser.add_argument("query", type=str, help="Search query")
+    bm25f_parser.add_argument(
         "--limit", "-l", type=int, default=5,  help="Number of results to return (default: 5)")
+    for field in INDEX_FIELDS:
+        bm25f_parser.add_argument(
+            f"--{field}-weight", type=float, default=BM25F_WEIGHTS[field],
+            help=f"Weight of {field} matches, greater than 0 (default: {BM25F_WEIGHTS[field]})")
+
+    # AUTOCOMPLETE
+    autocomplete_parser = subparsers.add_parser(
+        "autocomplete", help="Suggest completions for a partially typed query")
+    autocomplete_parser.add_argument(
+        "prefix", type=str, help="Text typed so far; a trailing space completes only titles")
+    autocomplete_parser.add_argument(
+        "--limit", "-l", type=int, default=5,  help="Number of suggestions of each kind (default: 5)")
+
+    subparsers.add_parser(
+        "cachestats", help="Show hit / miss counters of the keyword query cache")
 
     args = parser.parse_args()
 
     match args.command:
         case "build":
-            build_command()
+            build_command(args.workers, args.positions)
+
+        case "upsert":
+            try:
+                count = upsert_command(args.path)
+                print(f"Indexed {count} movies")
+            except FileNotFoundError as e:
+                print(f"Error: {e}")
+                print("Please run 'build' command first to create the index.")
+
+        case "delete":
+            try:
+                delete_command(args.doc_id)
+                print(f"Deleted movie {args.doc_id}")
+            except (FileNotFoundError, ValueError) as e:
+                print(f"Error: {e}")
 
         case "search":
             try:
@@ -83,6 +150,18 @@ def main() -> None:
             except FileNotFoundError as e:
                 print(f"Error: {e}")
                 print("Please run 'build' command first to create the index.")
+        case "boolean":
+            try:
+                print("Searching for:", args.query)
+                results = boolean_search_command(args.query, args.limit)
+                for i, res in enumerate(results, 1):
+                    print(f"{i}. ({res['id']}) {res['title']}")
+            except FileNotFoundError as e:
+                print(f"Error: {e}")
+                print("Please run 'build' command first to create the index.")
+            except ValueError as e:
+                print(f"Error: {e}")
+
         case "tf":
             try:
                 frequency = tf_command(args.doc_id, args.term)
@@ -141,7 +220,26 @@ def main() -> None:
             try:
                 print("Searching for:", args.query)
 
-                results = bm25search(args.query, args.limit)
+                results = bm25search(args.query, args.limit, args.proximity)
+
+                for i, res in enumerate(results, 1):
+                    print(
+                        f"{i}. ({res['id']}) {res['title']} - Score: {res['score']:.2f}")
+
+            except FileNotFoundError as e:
+                print(f"Error: {e}")
+                print("Please run 'build' command first to create the term frequencies.")
+            except ValueError as e:
+                print(f"Error: {e}")
+
+        case "bm25fsearch":
+            try:
+                print("Searching for:", args.query)
+
+                field_weights = {field: getattr(args, f"{field}_weight")
+                                 for field in INDEX_FIELDS}
+                results = bm25f_search_command(
+                    args.query, args.limit, field_weights)
 
                 for i, res in enumerate(results, 1):
                     print(
@@ -150,6 +248,35 @@ def main() -> None:
             except FileNotFoundError as e:
                 print(f"Error: {e}")
                 print("Please run 'build' command first to create the term frequencies.")
+            except ValueError as e:
+                print(f"Error: {e}")
+
+        case "autocomplete":
+            try:
+                completions = autocomplete_command(args.prefix, args.limit)
+
+                print("Words:")
+                for word, doc_freq in completions["words"]:
+                    print(f"  {word} ({doc_freq} movies)")
+                print("Titles:")
+                for title, count in completions["titles"]:
+                    print(f"  {title}" + (f" ({count} movies)" if count > 1 else ""))
+
+            except FileNotFoundError as e:
+                print(f"Error: {e}")
+                print("Please run 'build' command first to create the term frequencies.")
+
+        case "cachestats":
+            try:
+                stats = query_cache_stats_command()
+                print(f"Policy: {stats['policy']} ({stats['size']}/{stats['capacity']} entries, "
+                      f"generation {stats['generation']})")
+                print(f"Hits: {stats['hits']}  Misses: {stats['misses']}  "
+                      f"Hit rate: {stats['hit_rate']:.1%}")
+
+            except FileNotFoundError as e:
+                print(f"Error: {e}")
+                print("Please run 'build' command first to create the term frequencies.")
 
         case _:
             parser.exit(2, parser.format_help())
@@ -0,0 +1,108 @@
+from collections import OrderedDict
+import json
+import os
+import string
+from typing import Iterable
+
+from lib.utils.constants import STEM_CACHE_SIZE
+
+
+class Analyzer:
+    """Reusable text analysis pipeline: lowercase, strip punctuation, split,
+    drop stopwords and Porter-stem.
+
+    Stopwords are held in a frozenset, the punctuation table is built once and
+    stems are memoized in a bounded LRU that can be persisted next to the
+    index so query-time stemming is mostly a dict lookup.
+    """
+
+    def __init__(self, stopwords: Iterable[str], stem_cache_size: int = STEM_CACHE_SIZE) -> None:
+        self.stopwords = frozenset(stopwords)
+        self.punctuation_table = str.maketrans("", "", string.punctuation)
+        # nltk takes a few hundred ms to import, only pay for it on a stem cache miss
+        self.stemmer = None
+        self.stem_cache_size = stem_cache_size
+        self.stem_cache: OrderedDict[str, str] = OrderedDict()
+        # a saved stem table read on the first cache miss, see defer_stem_table
+        self.pending_stem_table: str | None = None
+
+    def tokenize(self, text: str) -> list[str]:
+        return text.lower().translate(self.punctuation_table).split()
+
+    def stem(self, token: str) -> str:
+        stem = self.stem_cache.get(token)
+        if stem is None and self.pending_stem_table is not None:
+            self.load_stem_table(self.pending_stem_table)
+            stem = self.stem_cache.get(token)
+        if stem is not None:
+            self.stem_cache.move_to_end(token)
+            return stem
+
+        if self.stemmer is None:
+            from nltk.stem import PorterStemmer
+
+            self.stemmer = PorterStemmer()
+        stem = self.stemmer.stem(token)
+        self.stem_cache[token] = stem
+        if len(self.stem_cache) > self.stem_cache_size:
+            self.stem_cache.popitem(last=False)
+        return stem
+
+    def filter_and_stem(self, tokens: list[str]) -> list[str]:
+        stopwords = self.stopwords
+        stem = self.stem
+        return [stem(token) for token in tokens if token not in stopwords]
+
+    def analyze(self, text: str) -> list[str]:
+        return self.filter_and_stem(self.tokenize(text))
+
+    def analyze_positions(self, text: str, start: int = 0) -> list[tuple[str, int]]:
+        """Analyze, keeping each token's position in the unfiltered token stream
+        so a dropped stopword still leaves a gap between its neighbours.
+        Positions are counted from `start`."""
+        stopwords = self.stopwords
+        stem = self.stem
+        return [(stem(token), position) for position, token in enumerate(self.tokenize(text), start)
+                if token not in stopwords]
+
+    def analyze_many(self, texts: Iterable[str]) -> list[list[str]]:
+        """Analyze a batch of documents, stemming each distinct surface form once."""
+        tokenized = [self.tokenize(text) for text in texts]
+
+        stopwords = self.stopwords
+        stems = {}
+        for tokens in tokenized:
+            for token in tokens:
+                if token not in stems and token not in stopwords:
+                    stems[token] = self.stem(token)
+
+        return [[stems[token] for token in tokens if token not in stopwords] for tokens in tokenized]
+
+    def save_stem_table(self, path: str) -> None:
+        if self.pending_stem_table is not None:
+            # never overwrite the saved table with the few stems seen so far
+            self.load_stem_table(self.pending_stem_table)
+        with open(path, "w") as f:
+            json.dump(self.stem_cache, f)
+
+    def defer_stem_table(self, path: str) -> None:
+        """Read the stem table at `path` only once a token isn't cached, so
+        opening an index doesn't parse it but a query still stems from it
+        rather than importing nltk."""
+        self.pending_stem_table = path
+
+    def load_stem_table(self, path: str) -> None:
+        self.pending_stem_table = None
+        if not os.path.exists(path):
+            return
+
+        with open(path, "r") as f:
+            table = json.load(f)
+
+        self.update_stems(table)
+
+    def update_stems(self, table: dict[str, str]) -> None:
+        for token, stem in list(table.items())[-self.stem_cache_size:]:
+            self.stem_cache[token] = stem
+        while len(self.stem_cache) > self.stem_cache_size:
+            self.stem_cache.popitem(last=False)
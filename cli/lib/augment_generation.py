@@ -1,25 +1,18 @@
 import json
-import os
 
-from dotenv import load_dotenv  # type: ignore
-from google import genai
-
-from lib.utils.common_utils import rate_limit
+from lib.utils.common_utils import get_genai_client, rate_limit
 from lib.query_enhancer import query_enhancer
 from lib.hybrid_search import get_hybrid_search
 from lib.utils.constants import DEFAULT_K, GEMINI_MODEL, SEARCH_LIMIT_MULTIPLIER
 
 
-load_dotenv()
-api_key = os.environ.get("GEMINI_API_KEY")
-client = genai.Client(api_key=api_key)
 model = GEMINI_MODEL
 
 
 def _generate_llm_response(prompt: str) -> str:
     """Common function to generate LLM response with rate limiting."""
     rate_limit()
-    response = client.models.generate_content(model=model, contents=prompt)
+    response = get_genai_client().models.generate_content(model=model, contents=prompt)
 
     if response.text:
         return response.text.strip()
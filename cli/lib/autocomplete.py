@@ -0,0 +1,145 @@
+from bisect import bisect_left
+from collections import Counter
+import heapq
+import os
+
+import numpy as np
+
+from lib.utils.search_utils import get_analyzer
+
+
+class PrefixCompleter:
+    """Top-k completions of a prefix over a weighted set of strings.
+
+    Keys are kept sorted, so the keys starting with a prefix are one
+    contiguous range found by binary search. A sparse table of range maxima
+    over the weights then yields the range's heaviest keys one by one: take
+    the maximum, split the range around it, repeat, so a query costs
+    O(log n + k log k) however many keys share the prefix.
+    """
+
+    def __init__(self, keys: list[str], weights: np.ndarray, texts: list[str] | None = None) -> None:
+        self.keys = keys
+        self.weights = weights.tolist()
+        self.texts = texts if texts is not None else keys
+        self.table = self.__range_max_table(weights)
+
+    @classmethod
+    def from_counts(cls, counts: dict[str, int], texts: dict[str, str] | None = None) -> "PrefixCompleter":
+        keys = sorted(counts)
+        weights = np.array([counts[key] for key in keys], dtype=np.int64)
+        return cls(keys, weights, [texts[key] for key in keys] if texts is not None else None)
+
+    @staticmethod
+    def __range_max_table(weights: np.ndarray) -> list[list[int]]:
+        """table[k][i]: position of the heaviest of weights[i:i + 2**k] (leftmost on ties)."""
+        level = np.arange(len(weights), dtype=np.int64)
+        table = [level.tolist()]
+        width = 1
+        while 2 * width <= len(weights):
+            left, right = level[:-width], level[width:]
+            level = np.where(weights[left] >= weights[right], left, right)
+            table.append(level.tolist())
+            width *= 2
+        return table
+
+    def __range_max(self, start: int, end: int) -> int:
+        level = (end - start).bit_length() - 1
+        left, right = self.table[level][start], self.table[level][end - (1 << level)]
+        return right if self.weights[right] > self.weights[left] else left
+
+    def complete(self, prefix: str, limit: int) -> list[tuple[str, int]]:
+        """(text, weight) of the `limit` heaviest keys starting with `prefix`,
+        alphabetical among equal weights."""
+        start = bisect_left(self.keys, prefix)
+        end = bisect_left(self.keys, prefix + "\U0010ffff", start)
+
+        completions = []
+        heap = []
+
+        def push(start: int, end: int) -> None:
+            if start < end:
+                best = self.__range_max(start, end)
+                heapq.heappush(heap, (-self.weights[best], best, start, end))
+
+        push(start, end)
+        while heap and len(completions) < limit:
+            weight, best, start, end = heapq.heappop(heap)
+            completions.append((self.texts[best], -weight))
+            push(start, best)
+            push(best + 1, end)
+        return completions
+
+    def arrays(self, name: str) -> dict[str, np.ndarray]:
+        """npz arrays; strings are stored as one NUL-separated UTF-8 blob,
+        fixed-width unicode arrays would pad every key to the longest."""
+        arrays = {
+            f"{name}_keys": _pack(self.keys),
+            f"{name}_weights": np.array(self.weights, dtype=np.int64),
+        }
+        if self.texts is not self.keys:
+            arrays[f"{name}_texts"] = _pack(self.texts)
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, data, name: str) -> "PrefixCompleter":
+        texts = _unpack(data[f"{name}_texts"]) if f"{name}_texts" in data else None
+        return cls(_unpack(data[f"{name}_keys"]), data[f"{name}_weights"], texts)
+
+
+def _pack(strings: list[str]) -> np.ndarray:
+    return np.frombuffer("\0".join(strings).encode(), dtype=np.uint8)
+
+
+def _unpack(blob: np.ndarray) -> list[str]:
+    text = blob.tobytes().decode()
+    return text.split("\0") if text else []
+
+
+class Autocomplete:
+    """Type-ahead over the index: the word being typed completes against the
+    indexed vocabulary (ranked by document frequency), the whole prefix
+    against normalized movie titles (ranked by how many movies share them)."""
+
+    def __init__(self, words: PrefixCompleter, titles: PrefixCompleter, generation: int) -> None:
+        self.words = words
+        self.titles = titles
+        self.generation = generation
+
+    @classmethod
+    def from_index(cls, index) -> "Autocomplete":
+        tokenize = get_analyzer().tokenize
+        title_counts = Counter()
+        title_texts = {}
+        for doc in index.docmap.values():
+            title = " ".join(tokenize(doc["title"]))
+            title_counts[title] += 1
+            title_texts.setdefault(title, doc["title"])
+
+        return cls(PrefixCompleter.from_counts(index.vocabulary_words()),
+                   PrefixCompleter.from_counts(title_counts, title_texts), index.generation)
+
+    def complete(self, prefix: str, limit: int) -> dict[str, list[tuple[str, int]]]:
+        """Completions of the last (partial) word and of the whole prefix as a title."""
+        tokens = get_analyzer().tokenize(prefix)
+        if not tokens:
+            return {"words": [], "titles": []}
+
+        typing_word = not prefix[-1].isspace()
+        title_prefix = " ".join(tokens) + ("" if typing_word else " ")
+        return {
+            "words": self.words.complete(tokens[-1], limit) if typing_word else [],
+            "titles": self.titles.complete(title_prefix, limit),
+        }
+
+    def save(self, path: str) -> None:
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, generation=self.generation,
+                 **self.words.arrays("words"), **self.titles.arrays("titles"))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "Autocomplete":
+        with np.load(path) as data:
+            return cls(PrefixCompleter.from_arrays(data, "words"),
+                       PrefixCompleter.from_arrays(data, "titles"), int(data["generation"]))
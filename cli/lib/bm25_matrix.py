@@ -0,0 +1,131 @@
+from collections import Counter
+import os
+
+import numpy as np
+
+from lib.utils.constants import BM25_B, BM25_BATCH_CELLS, BM25_K1
+
+
+class BM25Matrix:
+    """Precomputed BM25 weights of every (term, doc) pair for vectorized scoring.
+
+    The weights (idf * saturated tf, with k1 / b / avgdl applied) are kept
+    term-major: `indptr[t]:indptr[t + 1]` slices `rows` (doc rows) and
+    `weights` for term t, i.e. the CSR form of the term-doc matrix. A query
+    only touches its own terms, so a query vector times the matrix is a
+    `bincount` over the concatenated slices, and a batch of queries is one
+    `bincount` over (query, doc) cells.
+    """
+
+    def __init__(self, terms: np.ndarray, indptr: np.ndarray, rows: np.ndarray, weights: np.ndarray,
+                 doc_ids: np.ndarray, generation: int) -> None:
+        self.terms = terms
+        self.indptr = indptr
+        self.rows = rows
+        self.weights = weights
+        self.doc_ids = doc_ids
+        self.generation = generation
+        self.term_rows = {term: i for i, term in enumerate(terms.tolist())}
+
+    @classmethod
+    def from_index(cls, index, k1: float = BM25_K1, b: float = BM25_B) -> "BM25Matrix":
+        """Build from the live postings of an InvertedIndex."""
+        doc_ids = np.fromiter(index.docmap, dtype=np.int64)
+        doc_lengths = np.fromiter((index.doc_length[doc_id] for doc_id in doc_ids.tolist()),
+                                  dtype=np.float64, count=len(doc_ids))
+
+        terms = []
+        doc_counts = []
+        posting_docs = []
+        posting_tfs = []
+        for term in index.index:
+            docs, tfs = [], []
+            for doc_id, tf in index.index[term]:
+                docs.append(doc_id)
+                tfs.append(tf)
+            if docs:
+                terms.append(term)
+                doc_counts.append(len(docs))
+                posting_docs.extend(docs)
+                posting_tfs.extend(tfs)
+
+        doc_counts = np.array(doc_counts, dtype=np.int64)
+        rows = np.searchsorted(doc_ids, np.array(
+            posting_docs, dtype=np.int64)).astype(np.int32)
+        tfs = np.array(posting_tfs, dtype=np.float64)
+
+        doc_count = len(doc_ids)
+        idf = np.log((doc_count - doc_counts + 0.5) / (doc_counts + 0.5) + 1)
+        length_norm = 1 - b + b * (doc_lengths[rows] / index.avg_doc_length)
+        weights = np.repeat(idf, doc_counts) * \
+            (tfs * (k1 + 1)) / (tfs + k1 * length_norm)
+
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(doc_counts, out=indptr[1:])
+
+        return cls(np.array(terms, dtype=str), indptr, rows, weights, doc_ids, index.generation)
+
+    def save(self, path: str) -> None:
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, terms=self.terms, indptr=self.indptr, rows=self.rows, weights=self.weights,
+                 doc_ids=self.doc_ids, generation=self.generation)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Matrix":
+        with np.load(path) as data:
+            return cls(data["terms"], data["indptr"], data["rows"], data["weights"],
+                       data["doc_ids"], int(data["generation"]))
+
+    def __query_terms(self, tokens: list[str]) -> list[tuple[int, int]]:
+        """The sparse query vector: (term row, query tf) for tokens in the vocabulary."""
+        return [(self.term_rows[token], query_tf) for token, query_tf in Counter(tokens).items()
+                if token in self.term_rows]
+
+    def search(self, tokens: list[str], limit: int) -> list[tuple[int, float]]:
+        return self.search_many([tokens], limit)[0]
+
+    def search_many(self, queries: list[list[str]], limit: int) -> list[list[tuple[int, float]]]:
+        """Top `limit` (doc_id, score) per analyzed query.
+
+        Queries are scored in chunks of at most BM25_BATCH_CELLS (query, doc)
+        cells so the dense score block stays bounded.
+        """
+        doc_count = len(self.doc_ids)
+        chunk_size = max(1, BM25_BATCH_CELLS // max(doc_count, 1))
+
+        results = []
+        for start in range(0, len(queries), chunk_size):
+            chunk = queries[start:start + chunk_size]
+
+            cells, cell_weights = [], []
+            for query_row, tokens in enumerate(chunk):
+                for term_row, query_tf in self.__query_terms(tokens):
+                    begin, end = self.indptr[term_row], self.indptr[term_row + 1]
+                    cells.append(self.rows[begin:end] +
+                                 np.int64(query_row * doc_count))
+                    cell_weights.append(self.weights[begin:end] * query_tf)
+
+            if cells:
+                scores = np.bincount(np.concatenate(cells), np.concatenate(cell_weights),
+                                     minlength=len(chunk) * doc_count)
+            else:
+                scores = np.zeros(len(chunk) * doc_count)
+
+            for query_scores in scores.reshape(len(chunk), doc_count):
+                results.append(self.__top_k(query_scores, limit))
+
+        return results
+
+    def __top_k(self, scores: np.ndarray, limit: int) -> list[tuple[int, float]]:
+        matched = np.flatnonzero(scores)
+        if limit <= 0 or len(matched) == 0:
+            return []
+
+        if len(matched) > limit:
+            # keep everything tied with the k-th score so ties still break on doc id
+            kth = -np.partition(-scores[matched], limit - 1)[limit - 1]
+            matched = matched[scores[matched] >= kth]
+
+        order = np.lexsort((self.doc_ids[matched], -scores[matched]))[:limit]
+        return [(int(self.doc_ids[row]), float(scores[row])) for row in matched[order]]
@@ -0,0 +1,342 @@
+import re
+from typing import Iterator
+
+from lib.analyzer import Analyzer
+from lib.dynamic_pruning import END_OF_POSTINGS, PostingCursor
+from lib.phrase_query import phrase_occurs
+from lib.posting_list import gallop
+
+
+# parentheses, "quoted phrases" and bare words
+QUERY_TOKEN = re.compile(r'\(|\)|"[^"]*"|[^\s()"]+')
+
+OPERATORS = ("AND", "OR", "NOT")
+
+
+# Doc iterators: lazy, document-at-a-time views over one segment. Each one
+# exposes `doc()` (current doc id or END_OF_POSTINGS), `next_geq(target)`
+# (advance to the first doc >= target, never backwards) and `cost()` (an
+# upper estimate of how many docs it yields, used to pick the driving list).
+# PostingCursor already fits this protocol.
+
+
+class EmptyIterator:
+
+    def doc(self) -> float:
+        return END_OF_POSTINGS
+
+    def next_geq(self, target: int) -> float:
+        return END_OF_POSTINGS
+
+    def cost(self) -> int:
+        return 0
+
+
+class AllDocsIterator:
+    """Every live doc of a segment, the universe a bare NOT is taken against."""
+
+    def __init__(self, segment) -> None:
+        self.doc_ids = segment.doc_ids
+        self.deleted = segment.deleted
+        self.position = 0
+        self.__skip_deleted()
+
+    def __skip_deleted(self) -> None:
+        while self.position < len(self.doc_ids) and self.doc_ids[self.position] in self.deleted:
+            self.position += 1
+
+    def doc(self) -> float:
+        if self.position >= len(self.doc_ids):
+            return END_OF_POSTINGS
+        return self.doc_ids[self.position]
+
+    def next_geq(self, target: int) -> float:
+        if target > self.doc():
+            self.position = gallop(self.doc_ids, target, self.position)
+            self.__skip_deleted()
+        return self.doc()
+
+    def cost(self) -> int:
+        return len(self.doc_ids)
+
+
+class AndIterator:
+    """Intersection driven by the cheapest child; the others only gallop to its candidates."""
+
+    def __init__(self, children: list) -> None:
+        self.children = sorted(children, key=lambda child: child.cost())
+        self.current = self.__align(self.children[0].doc())
+
+    def __align(self, target: float) -> float:
+        lead = self.children[0]
+        doc = lead.next_geq(target)
+        while doc != END_OF_POSTINGS:
+            for child in self.children[1:]:
+                found = child.next_geq(doc)
+                if found != doc:
+                    doc = lead.next_geq(found)
+                    break
+            else:
+                return doc
+        return END_OF_POSTINGS
+
+    def doc(self) -> float:
+        return self.current
+
+    def next_geq(self, target: int) -> float:
+        if target > self.current:
+            self.current = self.__align(target)
+        return self.current
+
+    def cost(self) -> int:
+        return self.children[0].cost()
+
+
+class OrIterator:
+
+    def __init__(self, children: list) -> None:
+        self.children = children
+        self.current = min(child.doc() for child in children)
+
+    def doc(self) -> float:
+        return self.current
+
+    def next_geq(self, target: int) -> float:
+        if target > self.current:
+            self.current = min(child.next_geq(target)
+                               for child in self.children)
+        return self.current
+
+    def cost(self) -> int:
+        return sum(child.cost() for child in self.children)
+
+
+class AndNotIterator:
+    """Docs of `include` that are not in `exclude`."""
+
+    def __init__(self, include, exclude) -> None:
+        self.include = include
+        self.exclude = exclude
+        self.current = self.__skip_excluded(include.doc())
+
+    def __skip_excluded(self, doc: float) -> float:
+        while doc != END_OF_POSTINGS and self.exclude.next_geq(doc) == doc:
+            doc = self.include.next_geq(doc + 1)
+        return doc
+
+    def doc(self) -> float:
+        return self.current
+
+    def next_geq(self, target: int) -> float:
+        if target > self.current:
+            self.current = self.__skip_excluded(self.include.next_geq(target))
+        return self.current
+
+    def cost(self) -> int:
+        return self.include.cost()
+
+
+class PhraseIterator:
+    """Docs holding every phrase term, kept only if the positions line up."""
+
+    def __init__(self, cursors: list[PostingCursor], offsets: list[int]) -> None:
+        self.cursors = cursors
+        self.offsets = offsets
+        self.matches = AndIterator(cursors)
+        self.current = self.__verify(self.matches.doc())
+
+    def __verify(self, doc: float) -> float:
+        while doc != END_OF_POSTINGS and \
+                not phrase_occurs([cursor.positions() for cursor in self.cursors], self.offsets):
+            doc = self.matches.next_geq(doc + 1)
+        return doc
+
+    def doc(self) -> float:
+        return self.current
+
+    def next_geq(self, target: int) -> float:
+        if target > self.current:
+            self.current = self.__verify(self.matches.next_geq(target))
+        return self.current
+
+    def cost(self) -> int:
+        return self.matches.cost()
+
+
+def iterate_docs(iterator) -> Iterator[int]:
+    doc = iterator.doc()
+    while doc != END_OF_POSTINGS:
+        yield doc
+        doc = iterator.next_geq(doc + 1)
+
+
+# Query tree. Nodes are segment independent; `iterator(segment)` builds the
+# doc iterator that evaluates the node over one segment.
+
+
+class Term:
+
+    def __init__(self, token: str) -> None:
+        self.token = token
+
+    def iterator(self, segment):
+        postings = segment.postings.get(self.token)
+        if postings is None:
+            return EmptyIterator()
+        return PostingCursor(postings, deleted=segment.deleted)
+
+
+class Phrase:
+
+    def __init__(self, tokens: list[tuple[str, int]]) -> None:
+        self.tokens = tokens
+
+    def iterator(self, segment):
+        cursors = []
+        for token, _ in self.tokens:
+            postings = segment.postings.get(token)
+            if postings is None:
+                return EmptyIterator()
+            if not postings.has_positions():
+                raise ValueError(
+                    "Phrase queries need positions, rebuild the index with --positions")
+            cursors.append(PostingCursor(postings, deleted=segment.deleted))
+
+        start = self.tokens[0][1]
+        return PhraseIterator(cursors, [position - start for _, position in self.tokens])
+
+
+class Not:
+
+    def __init__(self, child) -> None:
+        self.child = child
+
+    def iterator(self, segment):
+        return AndNotIterator(AllDocsIterator(segment), self.child.iterator(segment))
+
+
+class And:
+
+    def __init__(self, children: list) -> None:
+        self.children = children
+
+    def iterator(self, segment):
+        # NOT children become an exclusion list instead of a complement
+        included = [child.iterator(segment) for child in self.children
+                    if not isinstance(child, Not)]
+        excluded = [child.child.iterator(segment) for child in self.children
+                    if isinstance(child, Not)]
+
+        if not included:
+            iterator = AllDocsIterator(segment)
+        elif len(included) == 1:
+            iterator = included[0]
+        else:
+            iterator = AndIterator(included)
+
+        if excluded:
+            exclude = excluded[0] if len(
+                excluded) == 1 else OrIterator(excluded)
+            iterator = AndNotIterator(iterator, exclude)
+        return iterator
+
+
+class Or:
+
+    def __init__(self, children: list) -> None:
+        self.children = children
+
+    def iterator(self, segment):
+        return OrIterator([child.iterator(segment) for child in self.children])
+
+
+def combine(node_type, children: list):
+    """Build an And / Or node, dropping empty (all-stopword) operands."""
+    children = [child for child in children if child is not None]
+    if not children:
+        return None
+    if len(children) == 1:
+        return children[0]
+    return node_type(children)
+
+
+def any_of(tokens: list[str]):
+    return combine(Or, [Term(token) for token in dict.fromkeys(tokens)])
+
+
+class QueryParser:
+    """Recursive descent parser for boolean queries.
+
+        or      := and ("OR" and)*
+        and     := unary (["AND"] unary)*     adjacent operands are ANDed
+        unary   := "NOT" unary | "(" or ")" | "phrase" | word
+
+    Operators must be upper case, words go through the analyzer, so a
+    stopword operand simply drops out of its group.
+    """
+
+    def __init__(self, query: str, analyzer: Analyzer) -> None:
+        self.tokens = QUERY_TOKEN.findall(query)
+        self.position = 0
+        self.analyzer = analyzer
+
+    def parse(self):
+        node = self.__or()
+        if self.position < len(self.tokens):
+            raise ValueError(
+                f"Unexpected '{self.tokens[self.position]}' in query")
+        return node
+
+    def __peek(self) -> str | None:
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return None
+
+    def __next(self) -> str:
+        token = self.__peek()
+        if token is None:
+            raise ValueError("Query ended unexpectedly")
+        self.position += 1
+        return token
+
+    def __or(self):
+        children = [self.__and()]
+        while self.__peek() == "OR":
+            self.position += 1
+            children.append(self.__and())
+        return combine(Or, children)
+
+    def __and(self):
+        children = [self.__unary()]
+        while self.__peek() not in (None, "OR", ")"):
+            if self.__peek() == "AND":
+                self.position += 1
+            children.append(self.__unary())
+        return combine(And, children)
+
+    def __unary(self):
+        token = self.__next()
+        if token == "NOT":
+            child = self.__unary()
+            return Not(child) if child is not None else None
+        if token == "(":
+            node = self.__or()
+            if self.__next() != ")":
+                raise ValueError("Missing ')' in query")
+            return node
+        if token in OPERATORS or token == ")":
+            raise ValueError(f"Unexpected '{token}' in query")
+
+        if token.startswith('"'):
+            tokens = self.analyzer.analyze_positions(token.strip('"'))
+            if len(tokens) > 1:
+                return Phrase(tokens)
+            return combine(And, [Term(token) for token, _ in tokens])
+
+        # stopwords analyze to nothing and drop out
+        return combine(And, [Term(token) for token in self.analyzer.analyze(token)])
+
+
+def parse_boolean_query(query: str, analyzer: Analyzer):
+    """Parse a query into its node tree, or None if every operand was a stopword."""
+    return QueryParser(query, analyzer).parse()
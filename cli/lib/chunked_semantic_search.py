@@ -1,27 +1,53 @@
-from typing import Dict, List, Any
+from typing import Dict, Iterator, Any
+import hashlib
 import json
 import os
 
 import numpy as np
 
+from lib.hnsw_index import HNSWIndex
+from lib.ivfpq_index import IVFPQIndex
 from lib.semantic_search import SemanticSearch
-from lib.utils.constants import CACHE_DIR, DEFAULT_SEARCH_LIMIT
-from lib.utils.math_utils import cosine_similarity
+from lib.utils.constants import (
+    CACHE_DIR,
+    DEFAULT_SEARCH_LIMIT,
+    EMBEDDING_ENCODER,
+    EMBEDDING_STORAGE,
+    HNSW_EF_SEARCH,
+    IVF_NPROBE,
+    SEMANTIC_BACKEND,
+)
+from lib.utils.embedding_utils import update_embeddings
+from lib.utils.math_utils import normalize_rows, top_k_indices
 from lib.utils.search_utils import format_search_result, load_movies
 from lib.utils.semantic_search_utils import semantic_chunk_text
 
+CHUNK_MAX_SENTENCES = 4
+CHUNK_OVERLAP = 1
 
-class ChunkedSemanticSearch(SemanticSearch):
-    def __init__(self, model_name="all-MiniLM-L6-v2") -> None:
 
-        super().__init__(model_name)
+class ChunkedSemanticSearch(SemanticSearch):
+    def __init__(self, model_name="all-MiniLM-L6-v2", backend: str = SEMANTIC_BACKEND,
+                 ef_search: int = HNSW_EF_SEARCH, nprobe: int = IVF_NPROBE,
+                 storage: str = EMBEDDING_STORAGE, encoder: str = EMBEDDING_ENCODER) -> None:
+        super().__init__(model_name, backend, ef_search, nprobe, storage, encoder)
+        # L2-normalized rows, stored like `embeddings`
         self.chunk_embeddings = None
         self.chunk_metadata = None
+
+        # chunks are stored movie by movie: chunk_starts[i] is the first chunk
+        # of chunk_movies[i] (a movie index), so the chunks of each movie are
+        # the contiguous run up to the next start
+        self.chunk_starts: np.ndarray | None = None
+        self.chunk_movies: np.ndarray | None = None
         self.chunk_embeddings_path = os.path.join(
             CACHE_DIR, "chunk_embeddings.npy")
         self.chunk_metadata_path = os.path.join(
             CACHE_DIR, "chunk_metadata.json")
 
+        self.chunk_index: HNSWIndex | IVFPQIndex | None = None
+        self.chunk_index_path = self._vector_index_path("chunk")
+
     def build_chunk_embeddings(self, documents) -> np.ndarray:
         self.documents = documents
 
@@ -29,37 +55,53 @@ class ChunkedSemanticSearch(SemanticSearch):
         for doc in self.documents:
             self.document_map[doc["id"]] = doc
 
-        all_chunks = []
-        chunk_metadata: List[Dict[str, Any]] = []
-
-        for movie_idx, doc in enumerate(documents):
-            text = doc.get('description', '')
-            if not text.strip():
-                continue
-
-            chunks = semantic_chunk_text(doc['description'],
-                                         max_chunk_size=4, overlap=1)
-
-            for chunk_idx, chunk in enumerate(chunks):
-                all_chunks.append(chunk)
-                chunk_metadata.append(
-                    {"movie_idx": movie_idx, "chunk_idx": chunk_idx, "total_chunks": len(chunks)})
-
-        self.chunk_embeddings = self.model.encode(all_chunks)
-        self.chunk_metadata = chunk_metadata
+        self.chunk_metadata = []
+
+        def chunk_texts() -> Iterator[str]:
+            for chunk, metadata in _iter_chunks(documents):
+                self.chunk_metadata.append(metadata)
+                yield chunk
+
+        # streamed batch by batch; only chunks whose text is new or changed
+        # since the last build are encoded, the other vectors are reused by text hash
+        _, encoded = update_embeddings(
+            self.chunk_embeddings_path, self.model, self.model_name, chunk_texts(), self.storage, self.encoder)
+        self.chunk_embeddings = self._load_vectors(self.chunk_embeddings_path)
+
+        tmp_metadata_path = f"{self.chunk_metadata_path}.tmp"
+        with open(tmp_metadata_path, "w") as f:
+            json.dump({"chunks": self.chunk_metadata, "total_chunks": len(self.chunk_metadata),
+                       "fingerprint": _documents_fingerprint(self.model_name, documents)}, f)
+        os.replace(tmp_metadata_path, self.chunk_metadata_path)
+        self.__index_chunk_movies()
+
+        if encoded is not None:
+            print(f"Encoded {encoded} new or changed chunks, reused {len(self.chunk_metadata) - encoded}")
+            self._remove_vector_indexes("chunk")
+        if self.backend != "exact":
+            self.chunk_index = self._load_or_create_vector_index(
+                self.chunk_embeddings, self.chunk_index_path)
 
         print(f"Built chunk_embeddings f{self.chunk_embeddings.shape}")
         print(f"Built chunk_metadata f{self.chunk_metadata[:2]}...")
 
-        with open(self.chunk_embeddings_path, "wb") as f:
-            np.save(f, self.chunk_embeddings)
-
-        with open(self.chunk_metadata_path, "w") as f:
-            json.dump({"chunks": chunk_metadata,
-                       "total_chunks": len(all_chunks)}, f, indent=2)
-
         return self.chunk_embeddings
 
+    def __index_chunk_movies(self) -> None:
+        movies = np.fromiter((chunk["movie_idx"] for chunk in self.chunk_metadata),
+                             dtype=np.int64, count=len(self.chunk_metadata))
+        if np.any(movies[1:] < movies[:-1]):
+            # not written movie by movie, regroup once so every movie is one run
+            order = np.argsort(movies, kind="stable")
+            movies = movies[order]
+            self.chunk_embeddings = self.chunk_embeddings[order]
+            self.chunk_metadata = [self.chunk_metadata[i] for i in order]
+
+        is_start = np.ones(len(movies), dtype=bool)
+        is_start[1:] = movies[1:] != movies[:-1]
+        self.chunk_starts = np.flatnonzero(is_start)
+        self.chunk_movies = movies[self.chunk_starts]
+
     def load_or_create_chunk_embeddings(self, documents: list[dict]) -> np.ndarray:
         self.documents = documents
 
@@ -69,24 +111,45 @@ class ChunkedSemanticSearch(SemanticSearch):
 
         if os.path.exists(self.chunk_embeddings_path) and os.path.exists(self.chunk_metadata_path):
 
-            with open(self.chunk_embeddings_path, "rb") as f:
-                self.chunk_embeddings = np.load(f)
-
             with open(self.chunk_metadata_path, "r") as f:
                 metadata = json.load(f)
+
+            if metadata.get("fingerprint") == _documents_fingerprint(self.model_name, documents):
+                self.chunk_embeddings = self._load_vectors(
+                    self.chunk_embeddings_path)
                 self.chunk_metadata = metadata["chunks"]
+                self.__index_chunk_movies()
+
+                if self.backend != "exact":
+                    self.chunk_index = self._load_or_create_vector_index(
+                        self.chunk_embeddings, self.chunk_index_path)
 
-            return self.chunk_embeddings
+                return self.chunk_embeddings
+
+            print("Documents changed since the chunks were embedded. Updating chunk embeddings...")
+            return self.build_chunk_embeddings(documents)
 
         print("Chunk embeddings not found. Building new chunk embeddings...")
 
         return self.build_chunk_embeddings(documents)
 
-    def search_chunks(self, query: str, limit: int = DEFAULT_SEARCH_LIMIT):
-
-        query_embeddings = self.generate_embedding(query)
+    def __approximate_top_movies(self, query_embeddings: np.ndarray, limit: int) -> tuple[np.ndarray, np.ndarray]:
+        """(movie groups, scores) of the best `limit` movies among the approximate
+        nearest chunks, asking for more chunks until enough distinct movies show up."""
+        k = 2 * limit
+        while True:
+            chunk_ids, chunk_scores = self._vector_search(
+                self.chunk_index, self.chunk_embeddings, query_embeddings, k)
+            groups = np.searchsorted(self.chunk_starts, chunk_ids, side="right") - 1
+
+            # chunks come best first, so a movie's first chunk is its best one
+            _, first = np.unique(groups, return_index=True)
+            if len(first) >= limit or k >= len(self.chunk_embeddings):
+                first = np.sort(first)[:limit]
+                return groups[first], chunk_scores[first]
+            k *= 2
 
-        chunk_scores = []
+    def search_chunks(self, query: str, limit: int = DEFAULT_SEARCH_LIMIT):
 
         if self.chunk_embeddings is None:
             raise ValueError(
@@ -96,44 +159,66 @@ class ChunkedSemanticSearch(SemanticSearch):
             raise ValueError(
                 "Chunk metadata is not loaded. Please build or load embeddings before searching.")
 
-        for i, chunk_embedding in enumerate(self.chunk_embeddings):
-            similarity_score = cosine_similarity(
-                chunk_embedding, query_embeddings)
-
-            chunk_scores.append(
-                {"chunk_idx": self.chunk_metadata[i]["chunk_idx"],
-                 "movie_idx": self.chunk_metadata[i]["movie_idx"],
-                 "score": similarity_score
-                 }
-            )
-
-        print(f"Computed similarity scores for {len(chunk_scores)} chunks.")
+        query_embeddings = normalize_rows(self.generate_embedding(query))
 
-        movies_scores: dict[int, float] = {}
+        if self.backend != "exact":
+            top_groups, top_scores = self.__approximate_top_movies(
+                query_embeddings, limit)
+        else:
+            # cosine similarity with every chunk at once
+            chunk_scores = self.chunk_embeddings @ query_embeddings
 
-        for chunk_score in chunk_scores:
-            if chunk_score["movie_idx"] not in movies_scores or chunk_score["score"] > movies_scores[chunk_score["movie_idx"]]:
-                movies_scores[chunk_score["movie_idx"]] = chunk_score["score"]
+            print(
+                f"Computed similarity scores for {len(chunk_scores)} chunks.")
 
-        sorted_movies_scores = sorted(
-            movies_scores.items(), key=lambda x: x[1], reverse=True)
+            # a movie scores as its best chunk
+            movie_scores = np.maximum.reduceat(chunk_scores, self.chunk_starts) \
+                if len(chunk_scores) else chunk_scores
+            top_groups = top_k_indices(movie_scores, limit)
+            top_scores = movie_scores[top_groups]
 
         final_list = []
-        for mv_score in sorted_movies_scores[:limit]:
-            movie = self.documents[mv_score[0]]
+        for group, score in zip(top_groups.tolist(), top_scores.tolist()):
+            movie = self.documents[self.chunk_movies[group]]
             formatted = format_search_result(
                 doc_id=movie['id'],
                 title=movie['title'],
                 document=movie['description'],
-                score=mv_score[1]
+                score=score
             )
             final_list.append(formatted)
 
         return final_list
 
 
-def search_chunked(query: str, limit: int = DEFAULT_SEARCH_LIMIT):
-    chunked_sem_model = ChunkedSemanticSearch()
+def _iter_chunks(documents) -> Iterator[tuple[str, Dict[str, Any]]]:
+    for movie_idx, doc in enumerate(documents):
+        text = doc.get('description', '')
+        if not text.strip():
+            continue
+
+        chunks = semantic_chunk_text(doc['description'],
+                                     max_chunk_size=CHUNK_MAX_SENTENCES, overlap=CHUNK_OVERLAP)
+
+        for chunk_idx, chunk in enumerate(chunks):
+            yield chunk, {"movie_idx": movie_idx, "chunk_idx": chunk_idx, "total_chunks": len(chunks)}
+
+
+def _documents_fingerprint(model_name: str, documents) -> str:
+    """Hash of everything the chunks and their vectors are derived from, so an
+    unchanged catalog loads without re-chunking it."""
+    digest = hashlib.blake2b(
+        f"{model_name}\0{CHUNK_MAX_SENTENCES}\0{CHUNK_OVERLAP}".encode(), digest_size=16)
+    for doc in documents:
+        digest.update(doc.get("description", "").encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def search_chunked(query: str, limit: int = DEFAULT_SEARCH_LIMIT, backend: str = SEMANTIC_BACKEND,
+                   ef_search: int = HNSW_EF_SEARCH, nprobe: int = IVF_NPROBE, encoder: str = EMBEDDING_ENCODER):
+    chunked_sem_model = ChunkedSemanticSearch(
+        backend=backend, ef_search=ef_search, nprobe=nprobe, encoder=encoder)
 
     documents = load_movies()
 
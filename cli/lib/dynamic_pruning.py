@@ -0,0 +1,189 @@
+import heapq
+from typing import AbstractSet, Callable
+
+from lib.posting_list import PostingList, gallop
+
+
+END_OF_POSTINGS = float("inf")
+
+
+class PostingCursor:
+    """Document-at-a-time cursor over one compressed posting list.
+
+    Only the block under the cursor is decoded; `next_geq` uses the block
+    skip list to jump over whole blocks. `scorer(doc_id, tf)` returns the
+    BM25 contribution of the term and `block_bound(max_tf, min_length)` turns
+    each block's stored tf / length bounds into a score bound with the same
+    weighting, once per query. Both may be omitted when the cursor is only
+    used to match docs. Doc ids in `deleted` (tombstones) are stepped over.
+
+    With `fields` (BM25F) both also get the per-field tfs: the posting's in
+    `scorer(doc_id, tf, field_tfs)` and the block's largest ones in
+    `block_bound(max_tf, min_length, max_field_tfs)`.
+    """
+
+    def __init__(self, postings: PostingList, scorer: Callable[..., float] | None = None,
+                 block_bound: Callable[..., float] | None = None,
+                 deleted: AbstractSet[int] = frozenset(), fields: bool = False) -> None:
+        self.postings = postings
+        self.scorer = scorer
+        self.deleted = deleted
+        self.fields = fields
+        if block_bound is None:
+            self.block_bounds = []
+        elif fields:
+            self.block_bounds = [block_bound(max_tf, min_length, postings.block_field_bounds(block))
+                                 for block, (max_tf, min_length) in enumerate(zip(postings.block_max_tfs,
+                                                                                  postings.block_min_lengths))]
+        else:
+            self.block_bounds = list(map(block_bound, postings.block_max_tfs,
+                                         postings.block_min_lengths))
+        self.upper_bound = max(self.block_bounds, default=0.0)
+        self.block = -1
+        self.doc_ids: list[int] = []
+        self.tfs: list[int] = []
+        self.block_positions: list[list[int]] | None = None
+        self.block_field_tfs: list[list[int]] | None = None
+        self.position = 0
+        self.__load_block(0)
+        self.__skip_deleted()
+
+    def __load_block(self, block: int) -> None:
+        self.block = block
+        self.position = 0
+        self.block_positions = None
+        self.block_field_tfs = None
+        if block < self.postings.block_count():
+            self.doc_ids, self.tfs = self.postings.decode_block(block)
+        else:
+            self.doc_ids, self.tfs = [], []
+
+    def __skip_deleted(self) -> float:
+        while self.deleted:
+            if self.position >= len(self.doc_ids):
+                if self.block + 1 >= self.postings.block_count():
+                    break
+                self.__load_block(self.block + 1)
+            if self.doc_ids[self.position] not in self.deleted:
+                break
+            self.position += 1
+        return self.doc()
+
+    def doc(self) -> float:
+        if self.position >= len(self.doc_ids):
+            return END_OF_POSTINGS
+        return self.doc_ids[self.position]
+
+    def next_geq(self, target: int) -> float:
+        if self.block >= self.postings.block_count():
+            return END_OF_POSTINGS
+
+        if target > self.postings.block_last_docs[self.block]:
+            self.__load_block(
+                gallop(self.postings.block_last_docs, target, self.block + 1))
+
+        self.position = gallop(self.doc_ids, target, self.position)
+        return self.__skip_deleted()
+
+    def cost(self) -> int:
+        return len(self.postings)
+
+    def score(self) -> float:
+        if self.fields:
+            return self.scorer(self.doc_ids[self.position], self.tfs[self.position], self.field_tfs())
+        return self.scorer(self.doc_ids[self.position], self.tfs[self.position])
+
+    def positions(self) -> list[int]:
+        if self.block_positions is None:
+            self.block_positions = self.postings.decode_positions(
+                self.block, self.tfs)
+        return self.block_positions[self.position]
+
+    def field_tfs(self) -> list[int]:
+        if self.block_field_tfs is None:
+            self.block_field_tfs = self.postings.decode_field_tfs(
+                self.block, len(self.doc_ids))
+        return self.block_field_tfs[self.position]
+
+    def block_upper_bound(self, target: int) -> float:
+        """Upper bound of the block that would contain `target`, without moving the cursor."""
+        block = self.postings.find_block(target, max(self.block, 0))
+        if block >= self.postings.block_count():
+            return 0.0
+        return self.block_bounds[block]
+
+
+def max_score_top_k(cursors: list[PostingCursor], limit: int) -> list[tuple[int, float]]:
+    """Block-Max MaxScore: exact top-k without fully scoring every candidate.
+
+    Cursors are ordered by their term upper bound. The cheapest prefix whose
+    bounds cannot beat the current k-th score on their own is "non-essential":
+    candidates are only drawn from the remaining essential lists, and the
+    non-essential ones are probed (block bound first) only while the candidate
+    can still enter the heap.
+    """
+    if limit <= 0 or not cursors:
+        return []
+
+    cursors = sorted(cursors, key=lambda c: c.upper_bound)
+    prefix_bounds = []
+    total = 0.0
+    for cursor in cursors:
+        total += cursor.upper_bound
+        prefix_bounds.append(total)
+
+    heap: list[tuple[float, int]] = []
+    threshold = 0.0
+    first_essential = 0
+
+    while first_essential < len(cursors):
+        essential = cursors[first_essential:]
+        candidate = min(c.doc() for c in essential)
+        if candidate == END_OF_POSTINGS:
+            break
+
+        matching = [c for c in essential if c.doc() == candidate]
+        non_essential_bound = prefix_bounds[first_essential -
+                                            1] if first_essential else 0.0
+
+        # block-max check: skip the candidate before scoring anything if the
+        # current blocks of its essential lists cannot lift it into the heap
+        if len(heap) == limit:
+            bound = non_essential_bound
+            for cursor in matching:
+                bound += cursor.block_upper_bound(candidate)
+            if bound <= threshold:
+                for cursor in matching:
+                    cursor.next_geq(candidate + 1)
+                continue
+
+        score = 0.0
+        for cursor in matching:
+            score += cursor.score()
+            cursor.next_geq(candidate + 1)
+
+        for i in range(first_essential - 1, -1, -1):
+            if score + prefix_bounds[i] <= threshold:
+                break
+
+            cursor = cursors[i]
+            rest = prefix_bounds[i - 1] if i > 0 else 0.0
+            if score + cursor.block_upper_bound(candidate) + rest <= threshold:
+                break
+
+            if cursor.next_geq(candidate) == candidate:
+                score += cursor.score()
+        else:
+            if len(heap) < limit:
+                heapq.heappush(heap, (score, -candidate))
+            elif score > threshold:
+                heapq.heapreplace(heap, (score, -candidate))
+            else:
+                continue
+
+            if len(heap) == limit:
+                threshold = heap[0][0]
+                while first_essential < len(cursors) and prefix_bounds[first_essential] <= threshold:
+                    first_essential += 1
+
+    return [(-neg_doc_id, score) for score, neg_doc_id in sorted(heap, reverse=True)]
@@ -0,0 +1,204 @@
+import heapq
+import math
+import os
+
+import numpy as np
+
+from lib.utils.constants import HNSW_EF_CONSTRUCTION, HNSW_EF_SEARCH, HNSW_M
+
+
+class HNSWIndex:
+    """Hierarchical Navigable Small World graph over L2-normalized vectors,
+    for approximate maximum inner product (= cosine) search.
+
+    Every vector is a node on level 0 and, with geometrically decreasing
+    probability, on the levels above. A query walks greedily down from the
+    single entry point on the top level, then runs a best-first search of
+    width `ef_search` on level 0. Nodes keep at most `M` neighbours on upper
+    levels and 2 * `M` on level 0, picked with the paper's diversity
+    heuristic. The vectors are not owned: the same matrix must be passed back
+    on load.
+    """
+
+    def __init__(self, vectors: np.ndarray, M: int = HNSW_M, ef_construction: int = HNSW_EF_CONSTRUCTION,
+                 seed: int = 0) -> None:
+        self.vectors = vectors
+        self.M = M
+        self.ef_construction = ef_construction
+        self.level_multiplier = 1 / math.log(M)
+        self.rng = np.random.default_rng(seed)
+
+        # graph[level][node] -> neighbour nodes
+        self.graph: list[dict[int, list[int]]] = []
+        self.entry_point = -1
+
+    def __len__(self) -> int:
+        return len(self.graph[0]) if self.graph else 0
+
+    def build(self) -> "HNSWIndex":
+        levels = np.floor(-np.log(1 - self.rng.random(len(self.vectors))) * self.level_multiplier)
+        for node, level in enumerate(levels.astype(int).tolist()):
+            self.__insert(node, level)
+        return self
+
+    def __max_neighbors(self, level: int) -> int:
+        return 2 * self.M if level == 0 else self.M
+
+    def __insert(self, node: int, node_level: int) -> None:
+        query = self.vectors[node]
+        top_level = len(self.graph) - 1
+        while len(self.graph) <= node_level:
+            self.graph.append({})
+
+        if self.entry_point < 0:
+            for level in range(node_level + 1):
+                self.graph[level][node] = []
+            self.entry_point = node
+            return
+
+        entry = self.entry_point
+        for level in range(top_level, node_level, -1):
+            entry = self.__greedy(query, entry, level)
+
+        entries = [(float(self.vectors[entry] @ query), entry)]
+        for level in range(min(node_level, top_level), -1, -1):
+            found = self.__search_layer(query, entries, self.ef_construction, level)
+            neighbors = self.__select(query, found, self.M)
+            layer = self.graph[level]
+            layer[node] = neighbors
+
+            max_neighbors = self.__max_neighbors(level)
+            for neighbor in neighbors:
+                links = layer[neighbor]
+                links.append(node)
+                if len(links) > max_neighbors:
+                    base = self.vectors[neighbor]
+                    scores = (self.vectors[links] @ base).tolist()
+                    layer[neighbor] = self.__select(base, list(zip(scores, links)), max_neighbors)
+            entries = found
+
+        for level in range(top_level + 1, node_level + 1):
+            self.graph[level][node] = []
+        if node_level > top_level:
+            self.entry_point = node
+
+    def __select(self, base: np.ndarray, candidates: list[tuple[float, int]], count: int) -> list[int]:
+        """Up to `count` candidates, best first, skipping any that is closer to
+        an already picked neighbour than to the base, so links spread out
+        instead of piling into one cluster."""
+        candidates = sorted(candidates, reverse=True)
+        if len(candidates) <= count:
+            return [node for _, node in candidates]
+
+        nodes = [node for _, node in candidates]
+        candidate_vectors = self.vectors[nodes]
+        pairwise = candidate_vectors @ candidate_vectors.T
+
+        picked = []
+        for i, (score, _) in enumerate(candidates):
+            if not picked or pairwise[i, picked].max() < score:
+                picked.append(i)
+                if len(picked) == count:
+                    break
+        return [nodes[i] for i in picked]
+
+    def __greedy(self, query: np.ndarray, entry: int, level: int) -> int:
+        """Hill-climb to the neighbour closest to the query on one level."""
+        best, best_score = entry, float(self.vectors[entry] @ query)
+        layer = self.graph[level]
+        improved = True
+        while improved:
+            improved = False
+            neighbors = layer[best]
+            if not neighbors:
+                break
+            scores = self.vectors[neighbors] @ query
+            i = int(scores.argmax())
+            if scores[i] > best_score:
+                best, best_score = neighbors[i], float(scores[i])
+                improved = True
+        return best
+
+    def __search_layer(self, query: np.ndarray, entries: list[tuple[float, int]], ef: int,
+                       level: int) -> list[tuple[float, int]]:
+        """Best-first search keeping the `ef` closest nodes seen: (score, node), unordered."""
+        layer = self.graph[level]
+        vectors = self.vectors
+        heappush, heappop, heapreplace = heapq.heappush, heapq.heappop, heapq.heapreplace
+        visited = {node for _, node in entries}
+        candidates = [(-score, node) for score, node in entries]
+        heapq.heapify(candidates)
+        found = list(entries)
+        heapq.heapify(found)
+        while len(found) > ef:
+            heapq.heappop(found)
+
+        while candidates:
+            negative_score, node = heappop(candidates)
+            if -negative_score < found[0][0] and len(found) >= ef:
+                break
+
+            neighbors = [neighbor for neighbor in layer[node] if neighbor not in visited]
+            if not neighbors:
+                continue
+            visited.update(neighbors)
+
+            scores = (vectors[neighbors] @ query).tolist()
+            for neighbor, score in zip(neighbors, scores):
+                if len(found) < ef:
+                    heappush(found, (score, neighbor))
+                elif score > found[0][0]:
+                    heapreplace(found, (score, neighbor))
+                else:
+                    continue
+                heappush(candidates, (-score, neighbor))
+        return found
+
+    def search(self, query: np.ndarray, k: int, ef_search: int = HNSW_EF_SEARCH) -> tuple[np.ndarray, np.ndarray]:
+        """(node ids, scores) of the approximate k nearest vectors, best first."""
+        if self.entry_point < 0 or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        entry = self.entry_point
+        for level in range(len(self.graph) - 1, 0, -1):
+            entry = self.__greedy(query, entry, level)
+
+        found = self.__search_layer(
+            query, [(float(self.vectors[entry] @ query), entry)], max(ef_search, k), 0)
+        best = heapq.nlargest(k, found)
+        return (np.array([node for _, node in best], dtype=np.int64),
+                np.array([score for score, _ in best], dtype=np.float32))
+
+    def save(self, path: str) -> None:
+        """Levels are stored as CSR arrays: nodes, offsets into one flat neighbours array."""
+        arrays = {}
+        for level, layer in enumerate(self.graph):
+            nodes = sorted(layer)
+            offsets = np.zeros(len(nodes) + 1, dtype=np.int64)
+            np.cumsum([len(layer[node]) for node in nodes], out=offsets[1:])
+            arrays[f"level{level}_nodes"] = np.array(nodes, dtype=np.int32)
+            arrays[f"level{level}_offsets"] = offsets
+            arrays[f"level{level}_neighbors"] = np.array(
+                [neighbor for node in nodes for neighbor in layer[node]], dtype=np.int32)
+
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, M=self.M, ef_construction=self.ef_construction, entry_point=self.entry_point,
+                 levels=len(self.graph), count=len(self), **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, vectors: np.ndarray) -> "HNSWIndex":
+        with np.load(path) as data:
+            if int(data["count"]) != len(vectors):
+                raise ValueError(
+                    f"HNSW index at {path} covers {int(data['count'])} vectors, expected {len(vectors)}")
+
+            index = cls(vectors, int(data["M"]), int(data["ef_construction"]))
+            index.entry_point = int(data["entry_point"])
+            for level in range(int(data["levels"])):
+                nodes = data[f"level{level}_nodes"].tolist()
+                offsets = data[f"level{level}_offsets"].tolist()
+                neighbors = data[f"level{level}_neighbors"].tolist()
+                index.graph.append({node: neighbors[offsets[i]:offsets[i + 1]]
+                                    for i, node in enumerate(nodes)})
+        return index
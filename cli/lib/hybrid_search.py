@@ -1,5 +1,4 @@
 import os
-from pydoc import doc
 import re
 
 from lib.utils.constants import DEFAULT_SEARCH_LIMIT
@@ -19,9 +18,9 @@ class HybridSearch:
         if not os.path.exists(self.idx.index_path):
             self.idx.build()
             self.idx.save()
+        self.idx.load()
 
     def _bm25_search(self, query, limit):
-        self.idx.load()
         return self.idx.bm25_search(query, limit)
 
     def weighted_search(self, query, alpha, limit=5):
@@ -0,0 +1,166 @@
+from collections import Counter, defaultdict
+from itertools import chain
+
+from lib.posting_list import LEADING_FIELDS, PostingList
+from lib.utils.constants import INDEX_FIELDS
+from lib.utils.search_utils import get_analyzer
+
+
+# term -> (sorted doc ids, parallel term frequencies, parallel position
+# lists, left empty when positions are not indexed, and the LEADING_FIELDS
+# tfs of every posting back to back)
+RawPostings = dict[str, tuple[list[int], list[int], list[list[int]], list[int]]]
+
+# (doc id, text of every INDEX_FIELDS field)
+Document = tuple[int, tuple[str, ...]]
+
+
+def document_fields(movie: dict) -> tuple[str, ...]:
+    return tuple(movie[field] for field in INDEX_FIELDS)
+
+
+def document_words(fields: tuple[str, ...]) -> set[str]:
+    """The distinct surface (unstemmed) words of a document's fields, without
+    stopwords and tokens that aren't purely alphabetic."""
+    analyzer = get_analyzer()
+    return {token for text in fields for token in analyzer.tokenize(text)
+            if token.isalpha() and token not in analyzer.stopwords}
+
+
+def analyze_shard(documents: list[Document], positions: bool = False) -> tuple[
+        RawPostings, dict[int, int], dict[int, tuple[int, ...]], dict[str, str]]:
+    """Map step: tokenize and count one contiguous, id-sorted slice of the corpus.
+
+    Fields are analyzed one after the other as a single token stream, so
+    totals and positions are those of the concatenated text. Returns the
+    partial postings, the doc lengths, the LEADING_FIELDS lengths and the
+    stems this process learned so the parent can persist them.
+    """
+    analyzer = get_analyzer()
+    postings: RawPostings = defaultdict(lambda: ([], [], [], []))
+    doc_length = {}
+    field_length = {}
+    # every posting starts with zero leading field tfs, the few tokens that
+    # occur in a leading field are then patched in place
+    no_field_tfs = [0] * LEADING_FIELDS
+
+    if positions:
+        for doc_id, fields in documents:
+            token_positions = defaultdict(list)
+            leading_counts = []
+            start = 0
+            for field, text in enumerate(fields):
+                analyzed = analyzer.analyze_positions(text, start)
+                if field < LEADING_FIELDS:
+                    leading_counts.append(Counter(token for token, _ in analyzed))
+                    start += len(analyzer.tokenize(text))
+                for token, position in analyzed:
+                    token_positions[token].append(position)
+
+            doc_length[doc_id] = sum(len(p) for p in token_positions.values())
+            field_length[doc_id] = tuple(
+                sum(counts.values()) for counts in leading_counts)
+            for token, doc_positions in token_positions.items():
+                doc_ids, tfs, position_lists, field_tfs = postings[token]
+                doc_ids.append(doc_id)
+                tfs.append(len(doc_positions))
+                position_lists.append(doc_positions)
+                field_tfs.extend(no_field_tfs)
+            _set_field_tfs(postings, leading_counts)
+
+        return dict(postings), doc_length, field_length, dict(analyzer.stem_cache)
+
+    field_count = len(INDEX_FIELDS)
+    analyzed = analyzer.analyze_many(
+        text for _, fields in documents for text in fields)
+    for i, (doc_id, _) in enumerate(documents):
+        fields = analyzed[i * field_count:(i + 1) * field_count]
+        leading_counts = [Counter(tokens) for tokens in fields[:LEADING_FIELDS]]
+        doc_length[doc_id] = sum(map(len, fields))
+        field_length[doc_id] = tuple(map(len, fields[:LEADING_FIELDS]))
+        for token, tf in Counter(chain.from_iterable(fields)).items():
+            doc_ids, tfs, _, field_tfs = postings[token]
+            doc_ids.append(doc_id)
+            tfs.append(tf)
+            field_tfs.extend(no_field_tfs)
+        _set_field_tfs(postings, leading_counts)
+
+    return dict(postings), doc_length, field_length, dict(analyzer.stem_cache)
+
+
+def _set_field_tfs(postings: RawPostings, leading_counts: list[Counter]) -> None:
+    """Fill in the leading field tfs of the postings just added for one doc."""
+    for field, counts in enumerate(leading_counts):
+        for token, tf in counts.items():
+            postings[token][3][field - LEADING_FIELDS] = tf
+
+
+def encode_shard(postings: RawPostings, doc_length: dict[int, int]) -> dict[str, PostingList]:
+    """Compress a set of merged posting lists along with their block tf / length bounds."""
+    return {term: PostingList(doc_ids, tfs, [doc_length[doc_id] for doc_id in doc_ids],
+                              position_lists or None, field_tfs)
+            for term, (doc_ids, tfs, position_lists, field_tfs) in postings.items()}
+
+
+def merge_shards(shards: list[RawPostings]) -> RawPostings:
+    """Concatenate partial postings; shards cover ascending doc id ranges so the result stays sorted."""
+    merged: RawPostings = {}
+    for shard in shards:
+        for term, lists in shard.items():
+            if term in merged:
+                for merged_list, shard_list in zip(merged[term], lists):
+                    merged_list.extend(shard_list)
+            else:
+                merged[term] = lists
+    return merged
+
+
+def split(items: list, parts: int) -> list[list]:
+    size = -(-len(items) // parts) if items else 0
+    return [items[i:i + size] for i in range(0, len(items), size)] if size else []
+
+
+def build_postings(documents: list[Document], workers: int = 1, positions: bool = False) -> tuple[
+        dict[str, PostingList], dict[int, int], dict[int, tuple[int, ...]]]:
+    """Build compressed postings for (doc id, field texts) pairs sorted by doc
+    id, optionally with token positions.
+
+    With more than one worker the corpus is split into contiguous shards that
+    are analyzed in a process pool, merged in the parent, and the merged terms
+    are fanned out again to be encoded.
+    """
+    if workers <= 1:
+        postings, doc_length, field_length, _ = analyze_shard(
+            documents, positions)
+        return encode_shard(postings, doc_length), doc_length, field_length
+
+    # only builds need a process pool, searches skip importing it
+    from concurrent.futures import ProcessPoolExecutor
+
+    analyzer = get_analyzer()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        shards = split(documents, workers)
+        partials = list(executor.map(
+            analyze_shard, shards, [positions] * len(shards)))
+
+        doc_length: dict[int, int] = {}
+        field_length: dict[int, tuple[int, ...]] = {}
+        for _, shard_doc_length, shard_field_length, stems in partials:
+            doc_length.update(shard_doc_length)
+            field_length.update(shard_field_length)
+            analyzer.update_stems(stems)
+        postings = merge_shards([shard for shard, _, _, _ in partials])
+
+        # largest lists first, dealt round-robin, keeps the encode shards balanced
+        terms = sorted(postings, key=lambda t: len(
+            postings[t][0]), reverse=True)
+        term_shards = [{term: postings[term] for term in terms[i::workers]}
+                       for i in range(workers)]
+        encoded = executor.map(
+            encode_shard, term_shards, [doc_length] * workers)
+
+        index: dict[str, PostingList] = {}
+        for shard in encoded:
+            index.update(shard)
+
+    return index, doc_length, field_length
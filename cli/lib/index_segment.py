@@ -0,0 +1,389 @@
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping
+from itertools import chain
+import json
+import mmap
+import os
+import struct
+from typing import Iterator
+
+from lib.posting_list import LEADING_FIELDS, PostingList
+from lib.utils.constants import INDEX_FIELDS, POSTING_BLOCK_SIZE
+
+
+SEGMENT_MAGIC = b"HOOPLAIX"
+SEGMENT_VERSION = 4
+
+# magic, version, block size, field count, term count, doc count, total doc
+# length, then the byte offsets of every section
+HEADER = struct.Struct("<8sIIIIIQQQQQQQQQ")
+
+# postings offset, term offset, term length, doc count, data length,
+# positions length, field tfs length
+VOCAB_ENTRY = struct.Struct("<QIIIIII")
+
+ALIGNMENT = 8
+
+# Segment layout (little endian, every section 8-byte aligned). Sections are
+# found through the header offsets, so they are written in the order a
+# single streaming pass produces them:
+#
+#   header
+#   doc store     one JSON document per doc id, in doc id order
+#   postings      per term, in term order: block offsets (u32), block last
+#                 doc ids (u32), block max tfs (u32), block min doc lengths
+#                 (u32), block position offsets (u32, only with positions),
+#                 block field tfs offsets and block max field tfs (u32, only
+#                 with field tfs), the varint block data, the varint
+#                 positions, then the varint field tfs
+#   term strings  utf-8 term bytes, referenced by the vocabulary
+#   vocabulary    VOCAB_ENTRY per term, sorted by term
+#   doc ids       sorted doc ids (u32)
+#   doc lengths   token count per doc, parallel to doc ids (u32)
+#   doc offsets   N + 1 offsets into the doc store (u64)
+#   field lengths token count per doc of each field but the last, one array
+#                 per field, parallel to doc ids (u32)
+#   field stats   total, min and max length of each of those fields (u64)
+
+
+def _pad(f) -> None:
+    remainder = f.tell() % ALIGNMENT
+    if remainder:
+        f.write(b"\0" * (ALIGNMENT - remainder))
+
+
+def _write_array(f, fmt: str, values) -> int:
+    _pad(f)
+    offset = f.tell()
+    f.write(struct.pack(f"<{len(values)}{fmt}", *values))
+    return offset
+
+
+class SegmentWriter:
+    """Writes a segment in one pass: every document in doc id order, then
+    every term in term order.
+
+    Documents and postings go straight to the file, only the per-doc and
+    per-term fixed size entries are kept until `close()`, so writing a
+    segment never needs the whole index in memory.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.tmp_path = f"{path}.tmp"
+        self.file = open(self.tmp_path, "wb")
+        self.file.write(b"\0" * HEADER.size)
+        _pad(self.file)
+        self.doc_store_offset = self.file.tell()
+
+        self.doc_ids = array("I")
+        self.doc_lengths = array("I")
+        self.doc_offsets = array("Q", [0])
+        self.field_lengths = [array("I") for _ in range(LEADING_FIELDS)]
+        self.terms: list[bytes] = []
+        self.vocab: list[tuple[int, int, int, int]] = []
+
+    def __enter__(self) -> "SegmentWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.file.close()
+            os.remove(self.tmp_path)
+
+    def add_document(self, doc_id: int, doc: dict, doc_length: int, field_length: tuple[int, ...]) -> None:
+        if self.terms:
+            raise ValueError("Documents must be added before any term")
+        if self.doc_ids and doc_id <= self.doc_ids[-1]:
+            raise ValueError("Documents must be added in increasing doc id order")
+
+        stored = json.dumps(doc).encode("utf-8")
+        self.file.write(stored)
+        self.doc_ids.append(doc_id)
+        self.doc_lengths.append(doc_length)
+        self.doc_offsets.append(self.doc_offsets[-1] + len(stored))
+        for lengths, length in zip(self.field_lengths, field_length):
+            lengths.append(length)
+
+    def add_term(self, term: str, postings: PostingList) -> None:
+        encoded = term.encode("utf-8")
+        if self.terms and encoded <= self.terms[-1]:
+            raise ValueError("Terms must be added in sorted order")
+
+        f = self.file
+        _pad(f)
+        postings_offset = f.tell()
+        block_arrays = [postings.block_offsets, postings.block_last_docs, postings.block_max_tfs,
+                        postings.block_min_lengths, postings.block_position_offsets,
+                        postings.block_field_offsets, postings.block_max_field_tfs]
+        f.write(struct.pack(f"<{sum(map(len, block_arrays))}I", *chain.from_iterable(block_arrays)))
+        f.write(postings.data)
+        f.write(postings.positions)
+        f.write(postings.field_tfs)
+
+        self.terms.append(encoded)
+        self.vocab.append((postings_offset, len(postings), len(postings.data),
+                           len(postings.positions), len(postings.field_tfs)))
+
+    def close(self) -> None:
+        f = self.file
+
+        _pad(f)
+        terms_offset = f.tell()
+        vocab = []
+        for encoded, (postings_offset, doc_count, *lengths) in zip(self.terms, self.vocab):
+            vocab.append(VOCAB_ENTRY.pack(postings_offset, f.tell() - terms_offset, len(encoded),
+                                          doc_count, *lengths))
+            f.write(encoded)
+
+        _pad(f)
+        vocab_offset = f.tell()
+        f.write(b"".join(vocab))
+
+        doc_ids_offset = _write_array(f, "I", self.doc_ids)
+        doc_lengths_offset = _write_array(f, "I", self.doc_lengths)
+        doc_offsets_offset = _write_array(f, "Q", self.doc_offsets)
+        field_lengths_offset = _write_array(
+            f, "I", list(chain.from_iterable(self.field_lengths)))
+        field_stats_offset = _write_array(f, "Q", [stat for lengths in self.field_lengths for stat in
+                                                   (sum(lengths), min(lengths, default=0), max(lengths, default=0))])
+
+        f.seek(0)
+        f.write(HEADER.pack(SEGMENT_MAGIC, SEGMENT_VERSION, POSTING_BLOCK_SIZE, len(INDEX_FIELDS),
+                            len(self.terms), len(self.doc_ids), sum(self.doc_lengths), vocab_offset,
+                            terms_offset, doc_ids_offset, doc_lengths_offset, doc_offsets_offset,
+                            self.doc_store_offset, field_lengths_offset, field_stats_offset))
+        f.close()
+
+        os.replace(self.tmp_path, self.path)
+
+    def doc_count(self) -> int:
+        return len(self.doc_ids)
+
+
+def write_segment(path: str, index: Mapping[str, PostingList], docmap: Mapping[int, dict],
+                  doc_length: Mapping[int, int], field_length: Mapping[int, tuple[int, ...]]) -> None:
+    with SegmentWriter(path) as writer:
+        for doc_id in sorted(docmap):
+            writer.add_document(
+                doc_id, docmap[doc_id], doc_length[doc_id], field_length[doc_id])
+        for term in sorted(index):
+            writer.add_term(term, index[term])
+
+
+class IndexSegment:
+    """Read-only view over a segment file mapped with mmap.
+
+    Opening only parses the header; vocabulary lookups binary search the
+    mapped term table and postings are wrapped as zero-copy memoryviews, so
+    only the pages a query touches are read and the OS page cache is shared
+    between processes.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, "rb") as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.buffer = memoryview(self.mmap)
+
+        magic, version = struct.unpack_from("<8sI", self.buffer)
+        if magic != SEGMENT_MAGIC:
+            raise ValueError(f"Not an index segment: {path}")
+        if version != SEGMENT_VERSION:
+            raise ValueError(
+                f"Index segment {path} was written by an incompatible version, please rebuild it")
+
+        (_, _, block_size, field_count, self.term_count, self.doc_count, self.total_doc_length,
+         self.vocab_offset, self.terms_offset, doc_ids_offset, doc_lengths_offset, doc_offsets_offset,
+         self.doc_store_offset, field_lengths_offset, field_stats_offset) = HEADER.unpack_from(self.buffer)
+
+        if block_size != POSTING_BLOCK_SIZE or field_count != len(INDEX_FIELDS):
+            raise ValueError(
+                f"Index segment {path} was written by an incompatible version, please rebuild it")
+
+        self.doc_ids = self.__view(doc_ids_offset, "I", self.doc_count)
+        self.doc_lengths = self.__view(
+            doc_lengths_offset, "I", self.doc_count)
+        self.doc_offsets = self.__view(
+            doc_offsets_offset, "Q", self.doc_count + 1)
+        self.field_lengths = [self.__view(field_lengths_offset + 4 * self.doc_count * field, "I", self.doc_count)
+                              for field in range(LEADING_FIELDS)]
+
+        # total, min and max length of every field but the last
+        field_stats = self.__view(field_stats_offset, "Q", 3 * LEADING_FIELDS)
+        self.total_field_lengths = list(field_stats[0::3])
+        self.field_length_ranges = list(zip(field_stats[1::3], field_stats[2::3]))
+
+        # movie ids are usually contiguous, which turns doc lookups into plain indexing
+        self.first_doc_id = self.doc_ids[0] if self.doc_count else 0
+        self.dense_doc_ids = self.doc_count > 0 and \
+            self.doc_ids[-1] - self.first_doc_id == self.doc_count - 1
+
+        # ids deleted since the segment was written, kept in the index manifest
+        self.deleted: set[int] = set()
+
+        self.postings = SegmentPostings(self)
+        self.docmap = SegmentDocStore(self)
+        self.doc_length = SegmentDocLengths(self)
+        self.field_length = SegmentFieldLengths(self)
+
+    def __view(self, offset: int, fmt: str, count: int) -> memoryview:
+        size = struct.calcsize(fmt)
+        return self.buffer[offset:offset + size * count].cast(fmt)
+
+    def avg_doc_length(self) -> float:
+        if self.doc_count == 0:
+            return 0.0
+        return self.total_doc_length / self.doc_count
+
+    def term_at(self, position: int) -> str:
+        _, term_offset, term_length, *_ = VOCAB_ENTRY.unpack_from(
+            self.buffer, self.vocab_offset + position * VOCAB_ENTRY.size)
+        start = self.terms_offset + term_offset
+        return str(self.buffer[start:start + term_length], "utf-8")
+
+    def find_term(self, term: str) -> int:
+        low, high = 0, self.term_count
+        while low < high:
+            middle = (low + high) // 2
+            if self.term_at(middle) < term:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.term_count and self.term_at(low) == term:
+            return low
+        return -1
+
+    def postings_at(self, position: int) -> PostingList:
+        postings_offset, _, _, doc_count, data_length, positions_length, field_tfs_length = VOCAB_ENTRY.unpack_from(
+            self.buffer, self.vocab_offset + position * VOCAB_ENTRY.size)
+        block_count = -(-doc_count // POSTING_BLOCK_SIZE)
+
+        block_offsets, block_last_docs, block_max_tfs, block_min_lengths = (
+            self.__view(postings_offset + 4 * block_count * i, "I", block_count) for i in range(4))
+        offset = postings_offset + 4 * block_count * 4
+
+        block_position_offsets = ()
+        if positions_length:
+            block_position_offsets = self.__view(offset, "I", block_count)
+            offset += 4 * block_count
+
+        block_field_offsets = block_max_field_tfs = ()
+        if field_tfs_length:
+            block_field_offsets = self.__view(offset, "I", block_count)
+            offset += 4 * block_count
+            block_max_field_tfs = self.__view(
+                offset, "I", block_count * LEADING_FIELDS)
+            offset += 4 * block_count * LEADING_FIELDS
+
+        data = self.buffer[offset:offset + data_length]
+        offset += data_length
+        positions = self.buffer[offset:offset + positions_length]
+        offset += positions_length
+        field_tfs = self.buffer[offset:offset + field_tfs_length]
+
+        return PostingList.from_buffers(doc_count, data, block_offsets, block_last_docs, block_max_tfs,
+                                        block_min_lengths, positions, block_position_offsets, field_tfs,
+                                        block_field_offsets, block_max_field_tfs)
+
+    def doc_position(self, doc_id: int) -> int:
+        if self.dense_doc_ids:
+            position = doc_id - self.first_doc_id
+            return position if 0 <= position < self.doc_count else -1
+
+        position = bisect_left(self.doc_ids, doc_id)
+        if position < self.doc_count and self.doc_ids[position] == doc_id:
+            return position
+        return -1
+
+
+class SegmentPostings(Mapping):
+    """term -> PostingList, looked up lazily in the mapped vocabulary."""
+
+    def __init__(self, segment: IndexSegment) -> None:
+        self.segment = segment
+
+    def __getitem__(self, term: str) -> PostingList:
+        position = self.segment.find_term(term)
+        if position < 0:
+            raise KeyError(term)
+        return self.segment.postings_at(position)
+
+    def __iter__(self) -> Iterator[str]:
+        for position in range(self.segment.term_count):
+            yield self.segment.term_at(position)
+
+    def items(self) -> Iterator[tuple[str, PostingList]]:
+        """(term, postings) in term order, read sequentially without lookups."""
+        for position in range(self.segment.term_count):
+            yield self.segment.term_at(position), self.segment.postings_at(position)
+
+    def __len__(self) -> int:
+        return self.segment.term_count
+
+
+class SegmentDocStore(Mapping):
+    """doc id -> movie dict, decoded from the doc store on access."""
+
+    def __init__(self, segment: IndexSegment) -> None:
+        self.segment = segment
+
+    def __getitem__(self, doc_id: int) -> dict:
+        position = self.segment.doc_position(doc_id)
+        if position < 0:
+            raise KeyError(doc_id)
+        start = self.segment.doc_store_offset + \
+            self.segment.doc_offsets[position]
+        end = self.segment.doc_store_offset + \
+            self.segment.doc_offsets[position + 1]
+        return json.loads(self.segment.buffer[start:end].tobytes())
+
+    def __contains__(self, doc_id: object) -> bool:
+        return isinstance(doc_id, int) and self.segment.doc_position(doc_id) >= 0
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.segment.doc_ids)
+
+    def __len__(self) -> int:
+        return self.segment.doc_count
+
+
+class SegmentDocLengths(Mapping):
+    """doc id -> token count, read straight from the mapped array."""
+
+    def __init__(self, segment: IndexSegment) -> None:
+        self.segment = segment
+
+    def __getitem__(self, doc_id: int) -> int:
+        position = self.segment.doc_position(doc_id)
+        if position < 0:
+            raise KeyError(doc_id)
+        return self.segment.doc_lengths[position]
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.segment.doc_ids)
+
+    def __len__(self) -> int:
+        return self.segment.doc_count
+
+
+class SegmentFieldLengths(Mapping):
+    """doc id -> token counts of every field but the last."""
+
+    def __init__(self, segment: IndexSegment) -> None:
+        self.segment = segment
+
+    def __getitem__(self, doc_id: int) -> tuple[int, ...]:
+        position = self.segment.doc_position(doc_id)
+        if position < 0:
+            raise KeyError(doc_id)
+        return tuple(lengths[position] for lengths in self.segment.field_lengths)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.segment.doc_ids)
+
+    def __len__(self) -> int:
+        return self.segment.doc_count
@@ -1,121 +1,439 @@
-from audioop import reverse
 from collections import defaultdict
+from collections.abc import Mapping
+from functools import partial
+import heapq
+from itertools import batched, combinations, islice
+import json
 import math
 import os
-import pickle
-from textwrap import indent
-import token
-from typing import Counter
-from lib.utils.constants import CACHE_DIR, BM25_B, BM25_K1, DEFAULT_SEARCH_LIMIT
-from lib.utils.search_utils import format_search_result, stop_words_remover, tokenizer, load_movies
+import threading
+from typing import Any, Callable, Counter, Iterator
+from lib.autocomplete import Autocomplete
+from lib.bm25_matrix import BM25Matrix
+from lib.boolean_query import iterate_docs, parse_boolean_query
+from lib.dynamic_pruning import PostingCursor, max_score_top_k
+from lib.index_builder import build_postings, document_fields, document_words
+from lib.index_segment import IndexSegment, write_segment
+from lib.query_cache import QueryCache
+from lib.phrase_query import intersect_cursors, parse_phrases, phrase_occurs, proximity_frequency
+from lib.segmented_index import LiveDocs, LivePostings, LiveVocabulary, MemorySegment, merge_segments, select_merge
+from lib.utils.constants import (
+    CACHE_DIR,
+    BM25_B,
+    BM25_K1,
+    BM25F_B,
+    BM25F_WEIGHTS,
+    DEFAULT_SEARCH_LIMIT,
+    INDEX_BATCH_SIZE,
+    INDEX_FIELDS,
+    PROXIMITY_WINDOW,
+    SEARCH_LIMIT_MULTIPLIER,
+)
+from lib.utils.math_utils import bm25_idf, bm25_tf, bm25f_tf
+from lib.utils.search_utils import format_search_result, get_analyzer, iter_movies
 
 
 class InvertedIndex:
 
     def __init__(self) -> None:
-        # index = "term": {"1", "2", "3", "4"}
-        self.index = defaultdict(set)
+        # index = "term": the term's postings across all segments, each a
+        # PostingList([1, 2, 3, 4] doc ids, [2, 1, 1, 5] tfs) with per-block
+        # tf / doc length bounds for top-k pruning
+        self.index: Mapping[str, LivePostings] = {}
 
         # docmap = "1" : {"id": "1", "title": "movie_title", "description": "<description>", ...}
-        self.docmap: dict[int, dict] = {}
+        self.docmap: Mapping[int, dict] = {}
 
-        # term_freq = "1" : Counter({"term_1": 4 -> (count), "term_2": 6 ...} ...)
-        self.term_frequencies = defaultdict(Counter)
+        self.doc_length: Mapping[int, int] = {}
 
-        self.doc_length: dict[int, int] = {}
+        # cached whenever the segments change so scoring never re-sums doc_length
+        self.avg_doc_length: float = 0.0
 
-        self.index_path = os.path.join(CACHE_DIR, "index.pkl")
-        self.docmap_path = os.path.join(CACHE_DIR, "docmap.pkl")
-        self.term_frequencies_path = os.path.join(
-            CACHE_DIR, "term_frequencies.pkl")
-        self.doc_lengths_path = os.path.join(CACHE_DIR, "doc_lengths.pkl")
+        # the same per INDEX_FIELDS field, for BM25F
+        self.avg_field_lengths: list[float] = [0.0] * len(INDEX_FIELDS)
 
-    def __add_document(self, doc_id: int, text: str) -> None:
-        tokens = tokenizer(text)
-        tokens = stop_words_remover(tokens)
-        self.doc_length[doc_id] = len(tokens)
-        for token in tokens:
-            self.index[token].add(doc_id)
-            self.term_frequencies[doc_id][token] += 1
+        # oldest first; the index is the union of their live (not tombstoned) docs
+        self.segments: list[IndexSegment | MemorySegment] = []
+
+        # whether the manifest on disk describes these segments
+        self.saved = False
+
+        # whether postings carry token positions (phrase / proximity queries)
+        self.positions = False
+
+        # bumped on every change to the indexed documents
+        self.generation = 0
+        self.next_segment = 0
+
+        # vectorized BM25 weights, rebuilt whenever the generation moves on
+        self.matrix: BM25Matrix | None = None
+
+        # surface word -> number of live docs containing it, kept up to date
+        # by builds and updates and read on first use; the index only holds stems
+        self.vocabulary: Counter[str] | None = None
+
+        # type-ahead completions, rebuilt the same way
+        self.completer: Autocomplete | None = None
+
+        # top-k results of repeated queries, dropped whenever the generation moves on
+        self.query_cache = QueryCache()
+
+        self.lock = threading.RLock()
+        self.merge_thread: threading.Thread | None = None
+
+        self.analyzer = get_analyzer()
+
+        self.index_path = os.path.join(CACHE_DIR, "index_manifest.json")
+        self.stem_table_path = os.path.join(CACHE_DIR, "stem_table.json")
+        self.vocabulary_path = os.path.join(CACHE_DIR, "vocabulary.json")
+        self.bm25_matrix_path = os.path.join(CACHE_DIR, "bm25_matrix.npz")
+        self.query_cache_path = os.path.join(CACHE_DIR, "query_cache.json")
+        self.autocomplete_path = os.path.join(CACHE_DIR, "autocomplete.npz")
 
     def __get_avg_doc_length(self) -> float:
 
         number_of_docs = len(self.doc_length)
         total_doc_length = 0
-        for doclength in self.doc_length.values():
-            total_doc_length += doclength
+        for segment in self.segments:
+            total_doc_length += segment.total_doc_length
+            for doc_id in segment.deleted:
+                total_doc_length -= segment.doc_length[doc_id]
 
         if number_of_docs == 0 or total_doc_length == 0:
             return 0.0
 
         return total_doc_length / number_of_docs
 
-    def get_documents(self, term: str) -> list[int]:
-        doc_ids = self.index[term]
-
-        sorted_ids = sorted(doc_ids)
-
-        return sorted_ids
-
-    def build(self):
-        movies = load_movies()
+    def __get_avg_field_lengths(self) -> list[float]:
+        number_of_docs = len(self.doc_length)
+        if number_of_docs == 0:
+            return [0.0] * len(INDEX_FIELDS)
+
+        # leading fields are totalled per segment, the last one is the rest of the doc lengths
+        leading_totals = [0] * (len(INDEX_FIELDS) - 1)
+        for segment in self.segments:
+            for field, total in enumerate(segment.total_field_lengths):
+                leading_totals[field] += total
+            for doc_id in segment.deleted:
+                for field, length in enumerate(segment.field_length[doc_id]):
+                    leading_totals[field] -= length
+
+        last_total = self.avg_doc_length * number_of_docs - sum(leading_totals)
+        return [total / number_of_docs for total in leading_totals] + [last_total / number_of_docs]
+
+    def __refresh(self) -> None:
+        self.index = LiveVocabulary(self.segments)
+        self.docmap = LiveDocs(self.segments, "docmap")
+        self.doc_length = LiveDocs(self.segments, "doc_length")
+        self.avg_doc_length = self.__get_avg_doc_length()
+        self.avg_field_lengths = self.__get_avg_field_lengths()
+
+    def vocabulary_words(self) -> dict[str, int]:
+        """Surface word -> document frequency over the live documents."""
+        with self.lock:
+            return dict(self.__vocabulary())
+
+    def __vocabulary(self) -> Counter[str]:
+        if self.vocabulary is None and os.path.exists(self.vocabulary_path):
+            with open(self.vocabulary_path, "r") as f:
+                saved = json.load(f)
+            if saved["generation"] == self.generation:
+                self.vocabulary = Counter(saved["words"])
+        if self.vocabulary is None:
+            # saved by an older build or out of step with the manifest
+            self.vocabulary = Counter()
+            for doc in self.docmap.values():
+                self.vocabulary.update(document_words(document_fields(doc)))
+            if self.__is_saved():
+                self.__save_vocabulary()
+        return self.vocabulary
+
+    def __save_vocabulary(self) -> None:
+        tmp_path = f"{self.vocabulary_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"generation": self.generation, "words": self.vocabulary}, f)
+        os.replace(tmp_path, self.vocabulary_path)
+
+    def __count_words(self, docs: Iterator[dict], sign: int) -> None:
+        vocabulary = self.__vocabulary()
+        for doc in docs:
+            for word in document_words(document_fields(doc)):
+                vocabulary[word] += sign
+                if not vocabulary[word]:
+                    del vocabulary[word]
 
-        for movie in movies:
-            doc_id = movie['id']
-            self.docmap[doc_id] = movie
-            input_text = f"{movie["title"]} {movie["description"]}"
-            self.__add_document(doc_id, input_text)
+    def get_documents(self, term: str) -> list[int]:
+        postings = self.index.get(term)
+        if postings is None:
+            return []
+
+        return list(postings.doc_ids())
+
+    def __doc_freq(self, token: str) -> int:
+        postings = self.index.get(token)
+        return len(postings) if postings is not None else 0
+
+    def build(self, workers: int = 1, positions: bool = False):
+        """Index the catalog streamed in batches of INDEX_BATCH_SIZE movies.
+
+        Every batch is written out as its own segment, then the batches are
+        merged into one, so memory stays bounded by the batch size however
+        large the catalog is. The result is only live once saved.
+        """
+        # reuse the stems of the previous build, stemming dominates build time
+        self.analyzer.load_stem_table(self.stem_table_path)
+        self.__sync_counters()
+
+        self.positions = positions
+        batches = []
+        vocabulary = Counter()
+        for movies in batched(iter_movies(), INDEX_BATCH_SIZE):
+            docmap = dict(sorted((movie["id"], movie) for movie in movies))
+            documents = [(doc_id, document_fields(movie))
+                         for doc_id, movie in docmap.items()]
+            for _, fields in documents:
+                vocabulary.update(document_words(fields))
+            postings, doc_length, field_length = build_postings(
+                documents, workers, positions)
+            batches.append(self.__persist(
+                MemorySegment(postings, docmap, doc_length, field_length)))
+
+        if len(batches) > 1:
+            print(f"merging {len(batches)} batch segments...")
+            path = self.__new_segment_path()
+            merge_segments([(segment, segment.deleted)
+                           for segment in batches], path)
+            for segment in batches:
+                os.remove(segment.path)
+            batches = [IndexSegment(path)]
+
+        self.segments = batches
+        self.vocabulary = vocabulary
+        self.saved = False
+        self.__refresh()
 
     def save(self):
         os.makedirs(CACHE_DIR, exist_ok=True)
-        print("saving index...")
-        with open(self.index_path, "wb") as f:
-            pickle.dump(self.index, f)
-
-        print("saving docmap...")
-        with open(self.docmap_path, "wb") as f:
-            pickle.dump(self.docmap, f)
-
-        print("saving term frequencies...")
-        with open(self.term_frequencies_path, "wb") as f:
-            pickle.dump(self.term_frequencies, f)
-
-        print("saving document lengths...")
-        with open(self.doc_lengths_path, "wb") as f:
-            pickle.dump(self.doc_length, f)
+        self.wait_for_merges()
+
+        stale = []
+        if os.path.exists(self.index_path):
+            stale = [entry["name"]
+                     for entry in self.__sync_counters()["segments"]]
+
+        print("saving index segments...")
+        with self.lock:
+            self.segments = [self.__persist(segment)
+                             for segment in self.segments]
+            self.vocabulary = self.__vocabulary()
+            self.generation += 1
+            self.__write_manifest()
+            self.saved = True
+            self.__save_vocabulary()
+
+        live = {os.path.basename(segment.path) for segment in self.segments}
+        for name in stale:
+            if name not in live:
+                os.remove(os.path.join(CACHE_DIR, name))
+
+        print("saving stem table...")
+        self.analyzer.save_stem_table(self.stem_table_path)
+
+        print("saving autocomplete...")
+        self.prefix_completer()
 
     def load(self):
-        if not os.path.exists(self.docmap_path):
-            raise FileNotFoundError(
-                f"Docmap file not found: {self.docmap_path}")
-
         if not os.path.exists(self.index_path):
             raise FileNotFoundError(f"Index file not found: {self.index_path}")
 
-        if not os.path.exists(self.term_frequencies_path):
-            raise FileNotFoundError(
-                f"Term Frequencies file not found: {self.term_frequencies_path}")
-
-        if not os.path.exists(self.doc_lengths_path):
-            raise FileNotFoundError(
-                f"Document Length file not found: {self.doc_lengths_path}")
-
-        with open(self.docmap_path, "rb") as f:
-            self.docmap = pickle.load(f)
+        manifest = self.__read_manifest()
+        segments = []
+        for entry in manifest["segments"]:
+            segment = IndexSegment(os.path.join(CACHE_DIR, entry["name"]))
+            segment.deleted = set(entry["deleted"])
+            segments.append(segment)
+
+        self.segments = segments
+        self.positions = manifest["positions"]
+        self.generation = manifest["generation"]
+        self.next_segment = manifest["next_segment"]
+        self.saved = True
+        self.__refresh()
+        self.analyzer.defer_stem_table(self.stem_table_path)
+
+        if os.path.exists(self.query_cache_path):
+            self.query_cache = QueryCache.load(self.query_cache_path)
+
+    def save_query_cache(self) -> None:
+        """Persist the query cache so later processes start warm."""
+        if self.__is_saved():
+            self.query_cache.save(self.query_cache_path)
+
+    def __read_manifest(self) -> dict:
+        with open(self.index_path, "r") as f:
+            return json.load(f)
+
+    def __sync_counters(self) -> dict | None:
+        """Keep counting from the manifest on disk so segment names and
+        generations never repeat across rebuilds."""
+        if not os.path.exists(self.index_path):
+            return None
+        manifest = self.__read_manifest()
+        self.generation = max(self.generation, manifest["generation"])
+        self.next_segment = max(self.next_segment, manifest["next_segment"])
+        return manifest
+
+    def __write_manifest(self) -> None:
+        manifest = {
+            "positions": self.positions,
+            "generation": self.generation,
+            "next_segment": self.next_segment,
+            "segments": [{"name": os.path.basename(segment.path), "deleted": sorted(segment.deleted)}
+                         for segment in self.segments],
+        }
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self.index_path)
+        self.__refresh()
+
+    def __persist(self, segment: IndexSegment | MemorySegment) -> IndexSegment:
+        if isinstance(segment, IndexSegment):
+            return segment
+
+        path = self.__new_segment_path()
+        write_segment(path, segment.postings, segment.docmap,
+                      segment.doc_length, segment.field_length)
+
+        persisted = IndexSegment(path)
+        persisted.deleted = segment.deleted
+        return persisted
+
+    def __new_segment_path(self) -> str:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with self.lock:
+            path = os.path.join(
+                CACHE_DIR, f"segment_{self.next_segment}.seg")
+            self.next_segment += 1
+        return path
+
+    def add_document(self, movie: dict) -> None:
+        if movie["id"] in self.docmap:
+            raise ValueError(
+                f"Movie {movie["id"]} is already indexed, use update_document")
+        self.upsert_documents([movie])
+
+    def update_document(self, movie: dict) -> None:
+        if movie["id"] not in self.docmap:
+            raise ValueError(f"Movie {movie["id"]} is not in the index")
+        self.upsert_documents([movie])
+
+    def delete_document(self, doc_id: int) -> None:
+        self.__require_saved()
+        with self.lock:
+            doc = self.docmap.get(doc_id)
+            if not self.__tombstone(doc_id):
+                raise ValueError(f"Movie {doc_id} is not in the index")
+            self.__count_words([doc], -1)
+            self.generation += 1
+            self.__write_manifest()
+            self.__save_vocabulary()
+        self.maybe_merge()
+
+    def upsert_documents(self, movies: list[dict]) -> None:
+        """Index movies into a new small segment and tombstone their older copies.
+
+        Scoring always uses the live N / avgdl / df across all segments, so
+        results match a full rebuild of the same documents.
+        """
+        self.__require_saved()
+        movies_by_id = {movie["id"]: movie for movie in movies}
+        docmap = dict(sorted(movies_by_id.items()))
+        documents = [(doc_id, document_fields(movie))
+                     for doc_id, movie in docmap.items()]
+
+        postings, doc_length, field_length = build_postings(
+            documents, positions=self.positions)
+        segment = self.__persist(MemorySegment(
+            postings, docmap, doc_length, field_length))
+
+        with self.lock:
+            self.__count_words((self.docmap[doc_id] for doc_id in docmap if doc_id in self.docmap), -1)
+            self.__count_words(docmap.values(), 1)
+            for doc_id in docmap:
+                self.__tombstone(doc_id)
+            self.segments = self.segments + [segment]
+            self.generation += 1
+            self.__write_manifest()
+            self.__save_vocabulary()
+        self.maybe_merge()
+
+    def __is_saved(self) -> bool:
+        return bool(self.segments) and self.saved
+
+    def __require_saved(self) -> None:
+        if not self.__is_saved():
+            raise ValueError(
+                "The index must be loaded or saved before it can be updated")
+
+    def __tombstone(self, doc_id: int) -> bool:
+        for segment in self.segments:
+            if doc_id in segment.docmap and doc_id not in segment.deleted:
+                segment.deleted.add(doc_id)
+                return True
+        return False
+
+    def maybe_merge(self, background: bool = True) -> None:
+        """Compact the segments picked by the merge policy, on a background thread by default.
+
+        Queries keep using the old segments until the merged one is swapped in.
+        """
+        with self.lock:
+            if self.merge_thread is not None and self.merge_thread.is_alive():
+                return
+            victims = select_merge(self.segments)
+            if not victims:
+                return
+            parts = [(segment, frozenset(segment.deleted))
+                     for segment in victims]
+
+            if background:
+                self.merge_thread = threading.Thread(
+                    target=self.__merge, args=(parts,), name="segment-merge")
+                self.merge_thread.start()
+                return
+
+        self.__merge(parts)
+
+    def wait_for_merges(self) -> None:
+        if self.merge_thread is not None:
+            self.merge_thread.join()
+
+    def __merge(self, parts: list[tuple[IndexSegment, frozenset[int]]]) -> None:
+        path = self.__new_segment_path()
+        if merge_segments(parts, path):
+            segment = IndexSegment(path)
+        else:
+            segment = None
+            os.remove(path)
 
-        with open(self.index_path, "rb") as f:
-            self.index = pickle.load(f)
+        with self.lock:
+            victims = [victim for victim, _ in parts]
+            if segment is not None:
+                # docs deleted while the merge ran are tombstoned in the merged segment
+                for victim, deleted in parts:
+                    segment.deleted.update(victim.deleted - deleted)
 
-        with open(self.term_frequencies_path, "rb") as f:
-            self.term_frequencies = pickle.load(f)
+            self.segments = [s for s in self.segments if s not in victims] + \
+                ([segment] if segment is not None else [])
+            self.__write_manifest()
 
-        with open(self.doc_lengths_path, "rb") as f:
-            self.doc_length = pickle.load(f)
+        for victim in victims:
+            os.remove(victim.path)
 
     def get_tf(self, doc_id: int, term: str) -> int:
 
-        terms = tokenizer(term)
-        terms = stop_words_remover(terms)
+        terms = self.analyzer.analyze(term)
 
         if len(terms) > 1:
             raise Exception("term should be singular")
@@ -123,18 +441,21 @@ class InvertedIndex:
         if not terms:
             return 0
 
-        return self.term_frequencies[doc_id][terms[0]]
+        postings = self.index.get(terms[0])
+        if postings is None:
+            return 0
+
+        return postings.tf(doc_id)
 
     def get_idf(self, term: str) -> float:
-        doc_count = len(self.term_frequencies)
+        doc_count = len(self.docmap)
 
-        terms = tokenizer(term)
-        terms = stop_words_remover(terms)
+        terms = self.analyzer.analyze(term)
 
         if not terms:
             term_doc_count = 0
         else:
-            term_doc_count = len(self.index[terms[0]])
+            term_doc_count = self.__doc_freq(terms[0])
 
         idf = math.log((doc_count + 1) / (term_doc_count + 1))
 
@@ -144,13 +465,12 @@ class InvertedIndex:
 
         tf = self.get_tf(doc_id, term)
 
-        terms = tokenizer(term)
-        terms = stop_words_remover(terms)
+        terms = self.analyzer.analyze(term)
 
         if not terms:
             doc_freq = 0
         else:
-            doc_freq = len(self.index[terms[0]])
+            doc_freq = self.__doc_freq(terms[0])
 
         doc_count = len(self.docmap)
 
@@ -160,29 +480,25 @@ class InvertedIndex:
 
     def get_bm25_idf(self, term: str) -> float:
 
-        doc_count = len(self.docmap)
-        terms = tokenizer(term)
-        terms = stop_words_remover(terms)
+        terms = self.analyzer.analyze(term)
 
         if not terms:
             doc_freq = 0
         else:
-            doc_freq = len(self.index[terms[0]])
+            doc_freq = self.__doc_freq(terms[0])
 
-        bm25_idf = math.log(
-            (doc_count - doc_freq + 0.5) / (doc_freq + 0.5) + 1)
+        return self.__bm25_idf(doc_freq)
 
-        return bm25_idf
+    def __bm25_idf(self, doc_freq: int) -> float:
+        return bm25_idf(doc_freq, len(self.docmap))
+
+    def __bm25_tf(self, tf: int, doc_length: int, k1: float = BM25_K1, b: float = BM25_B) -> float:
+        return bm25_tf(tf, doc_length, self.avg_doc_length, k1, b)
 
     def get_bm25_tf(self, doc_id: int, term: str, k1: float = BM25_K1, b: float = BM25_B) -> float:
         tf = self.get_tf(doc_id, term)
 
-        length_norm = 1 - b + b * \
-            (self.doc_length[doc_id] / self.__get_avg_doc_length())
-
-        tf_component = (tf * (k1 + 1)) / (tf + k1 * length_norm)
-
-        return tf_component
+        return self.__bm25_tf(tf, self.doc_length[doc_id], k1, b)
 
     def bm25(self, doc_id: int, term: str) -> float:
         bm25_tf = self.get_bm25_tf(doc_id, term)
@@ -190,22 +506,113 @@ class InvertedIndex:
 
         return bm25_tf * bm25_idf
 
-    def bm25_search(self, query: str, limit: int = DEFAULT_SEARCH_LIMIT) -> list[dict]:
-        query_tokens = tokenizer(query)
-        query_tokens = stop_words_remover(query_tokens)
+    def boolean_search(self, query: str, limit: int = DEFAULT_SEARCH_LIMIT) -> list[dict]:
+        """Movies matching a boolean query (AND / OR / NOT, parentheses, "phrases"), by id."""
+        return [self.docmap[doc_id] for doc_id in self.match(parse_boolean_query(query, self.analyzer), limit)]
+
+    def match(self, node, limit: int = DEFAULT_SEARCH_LIMIT) -> list[int]:
+        """The first `limit` doc ids matching a query node.
+
+        Every segment is evaluated by its own lazy doc iterator and the
+        (disjoint) streams are merged, so evaluation stops after `limit` hits.
+        """
+        if node is None:
+            return []
+        streams = [iterate_docs(node.iterator(segment))
+                   for segment in self.segments]
+        return list(islice(heapq.merge(*streams), limit))
+
+    def bm25_search(self, query: str, limit: int = DEFAULT_SEARCH_LIMIT, prune: bool = True,
+                    proximity: bool = False) -> list[dict]:
+        """BM25 top-k. Quoted phrases in the query must match exactly; with
+        `proximity` the best candidates are re-ranked with a term proximity bonus."""
+        text, phrases = parse_phrases(query)
+        query_tokens = self.analyzer.analyze(text)
+        phrase_tokens = [tokens for tokens in map(
+            self.analyzer.analyze_positions, phrases) if tokens]
 
         print(f"Query Tokens after stopword removal: {query_tokens}")
-        scores = {}
-        for doc_id in self.docmap:
-            score = 0.0
-            for token in query_tokens:
-                score += self.bm25(doc_id, token)
-            scores[doc_id] = score
-
-        sorted_docs = sorted(scores.items(), key=lambda x: x[1], reverse=True)
 
+        if (phrase_tokens or proximity) and not self.positions:
+            raise ValueError(
+                "Phrase and proximity queries need positions, rebuild the index with --positions")
+
+        key = ("bm25", tuple(query_tokens), tuple(map(tuple, phrase_tokens)),
+               limit, proximity, BM25_K1, BM25_B)
+        generation = self.generation
+        top_docs = self.__cached(key, generation)
+        if top_docs is not None:
+            return self.__format_results(top_docs)
+
+        candidates = limit * SEARCH_LIMIT_MULTIPLIER if proximity else limit
+        if phrase_tokens:
+            top_docs = self.__phrase_top_k(
+                query_tokens, phrase_tokens, candidates)
+        elif prune:
+            top_docs = self.__bm25_top_k(query_tokens, candidates)
+        else:
+            top_docs = self.__bm25_exhaustive(query_tokens, candidates)
+
+        if proximity:
+            top_docs = self.__proximity_rerank(query_tokens, top_docs)[:limit]
+
+        self.__cache(key, generation, top_docs)
+        return self.__format_results(top_docs)
+
+    def bm25f_search(self, query: str, limit: int = DEFAULT_SEARCH_LIMIT,
+                     field_weights: dict[str, float] | None = None) -> list[dict]:
+        """BM25F top-k over the title / description fields.
+
+        Each field's tf is normalized by that field's length and weighted
+        (BM25F_WEIGHTS unless overridden) before a single saturation, so a
+        title hit counts more than the same hit in a long description. Uses
+        the same pruned single pass over the postings as bm25_search.
+        """
+        field_weights = [(field_weights or {}).get(field, BM25F_WEIGHTS[field])
+                         for field in INDEX_FIELDS]
+        # block bounds assume every weighted tf adds to the score
+        for field, weight in zip(INDEX_FIELDS, field_weights):
+            if not weight > 0:
+                raise ValueError(
+                    f"The {field} weight must be positive, got {weight}")
+        query_tokens = self.analyzer.analyze(query)
+
+        key = ("bm25f", tuple(query_tokens), limit, tuple(field_weights),
+               tuple(BM25F_B[field] for field in INDEX_FIELDS), BM25_K1)
+        generation = self.generation
+        top_docs = self.__cached(key, generation)
+        if top_docs is not None:
+            return self.__format_results(top_docs)
+
+        cursors = []
+        for postings, weight in self.__query_weights(query_tokens).values():
+            for segment, part in postings.parts:
+                scorer = partial(self.__field_posting_score,
+                                 weight, field_weights, segment)
+                block_bound = partial(
+                    self.__field_block_bound, weight, field_weights, segment)
+                cursors.append(PostingCursor(
+                    part, scorer, block_bound, segment.deleted, fields=True))
+
+        top_docs = max_score_top_k(cursors, limit)
+        self.__cache(key, generation, top_docs)
+        return self.__format_results(top_docs)
+
+    def __cached(self, key: tuple, generation: int) -> list[tuple[int, float]] | None:
+        # an unsaved build has no generation of its own yet, never cache it
+        if not self.__is_saved():
+            return None
+        return self.query_cache.get(key, generation)
+
+    def __cache(self, key: tuple, generation: int, top_docs: list[tuple[int, float]]) -> None:
+        # keyed on the generation read before scoring, so a concurrent update
+        # can't file old results under the new generation
+        if self.__is_saved():
+            self.query_cache.put(key, generation, top_docs)
+
+    def __format_results(self, top_docs: list[tuple[int, float]]) -> list[dict]:
         results = []
-        for doc_id, score in sorted_docs[:limit]:
+        for doc_id, score in top_docs:
             doc = self.docmap[doc_id]
             formatted_result = format_search_result(
                 doc_id=doc["id"],
@@ -217,8 +624,207 @@ class InvertedIndex:
 
         return results
 
-
-def build_command() -> None:
+    def load_or_build_artifact(self, artifact_class, path: str, cached=None,
+                               is_current: Callable[[Any], bool] = lambda artifact: True):
+        """An `artifact_class` derived from the index (it has a `generation`,
+        `from_index`, `save` and `load`) for the current generation.
+
+        Reuses `cached`, then the copy saved at `path`, if they were built for
+        this generation and pass `is_current`; otherwise builds a new one and,
+        if the index is saved, saves it to `path`.
+        """
+        saved = self.__is_saved()
+        if cached is not None and cached.generation == self.generation and saved:
+            return cached
+
+        if saved and os.path.exists(path):
+            artifact = artifact_class.load(path)
+            if artifact.generation == self.generation and is_current(artifact):
+                return artifact
+
+        artifact = artifact_class.from_index(self)
+        if saved:
+            artifact.save(path)
+        return artifact
+
+    def bm25_matrix(self) -> BM25Matrix:
+        """The BM25 weight matrix for the current generation, loaded from or written to the cache."""
+        self.matrix = self.load_or_build_artifact(
+            BM25Matrix, self.bm25_matrix_path, self.matrix)
+        return self.matrix
+
+    def prefix_completer(self) -> Autocomplete:
+        """The type-ahead completions for the current generation, loaded from or written to the cache."""
+        self.completer = self.load_or_build_artifact(
+            Autocomplete, self.autocomplete_path, self.completer)
+        return self.completer
+
+    def autocomplete(self, prefix: str, limit: int = DEFAULT_SEARCH_LIMIT) -> dict[str, list[tuple[str, int]]]:
+        """Top completions of the word being typed and of the prefix as a movie title."""
+        return self.prefix_completer().complete(prefix, limit)
+
+    def bm25_search_many(self, queries: list[str], limit: int = DEFAULT_SEARCH_LIMIT) -> list[list[dict]]:
+        """BM25 top-k for a batch of queries, scored together with the weight matrix.
+
+        Same scores as bm25_search; quotes are ignored (no phrase matching).
+        """
+        top_docs = self.bm25_matrix().search_many(
+            [self.analyzer.analyze(query) for query in queries], limit)
+
+        return [self.__format_results(query_top_docs) for query_top_docs in top_docs]
+
+    def __query_weights(self, query_tokens: list[str]) -> dict[str, tuple[LivePostings, float]]:
+        """token -> (live postings, query tf * BM25 idf) for the query tokens in the index."""
+        weights = {}
+        for token, query_tf in Counter(query_tokens).items():
+            postings = self.index.get(token)
+            if postings:
+                weights[token] = (
+                    postings, query_tf * self.__bm25_idf(len(postings)))
+        return weights
+
+    def __bm25_top_k(self, query_tokens: list[str], limit: int) -> list[tuple[int, float]]:
+        cursors = []
+        for postings, weight in self.__query_weights(query_tokens).values():
+            block_bound = partial(self.__block_bound, weight)
+            # one cursor per segment, a doc is live in only one of them
+            for segment, part in postings.parts:
+                scorer = partial(self.__posting_score,
+                                 weight, segment.doc_length)
+                cursors.append(PostingCursor(
+                    part, scorer, block_bound, segment.deleted))
+
+        return max_score_top_k(cursors, limit)
+
+    def __phrase_top_k(self, query_tokens: list[str], phrases: list[list[tuple[str, int]]],
+                       limit: int) -> list[tuple[int, float]]:
+        """Full BM25 of the query over the docs that contain every phrase."""
+        weights = self.__query_weights(query_tokens)
+        scores = []
+        for segment in self.segments:
+            cursors = []
+            for token, (_, weight) in weights.items():
+                postings = segment.postings.get(token)
+                if postings is not None:
+                    cursors.append(PostingCursor(postings, partial(
+                        self.__posting_score, weight, segment.doc_length), deleted=segment.deleted))
+
+            for doc_id in self.__phrase_matches(segment, phrases):
+                score = 0.0
+                for cursor in cursors:
+                    if cursor.next_geq(doc_id) == doc_id:
+                        score += cursor.score()
+                scores.append((doc_id, score))
+
+        return heapq.nlargest(limit, scores, key=lambda x: (x[1], -x[0]))
+
+    def __phrase_matches(self, segment: IndexSegment | MemorySegment,
+                         phrases: list[list[tuple[str, int]]]) -> Iterator[int]:
+        # docs holding every phrase term are found first by skipping through
+        # the posting lists, only then are their positions decoded and checked
+        phrase_cursors = []
+        for phrase in phrases:
+            cursors = []
+            for token, _ in phrase:
+                postings = segment.postings.get(token)
+                if postings is None:
+                    return
+                cursors.append(PostingCursor(
+                    postings, deleted=segment.deleted))
+            offsets = [position - phrase[0][1] for _, position in phrase]
+            phrase_cursors.append((cursors, offsets))
+
+        all_cursors = [cursor for cursors, _ in phrase_cursors for cursor in cursors]
+        for doc_id in intersect_cursors(all_cursors):
+            if all(phrase_occurs([cursor.positions() for cursor in cursors], offsets)
+                   for cursors, offsets in phrase_cursors):
+                yield doc_id
+
+    def __proximity_rerank(self, query_tokens: list[str],
+                           top_docs: list[tuple[int, float]]) -> list[tuple[int, float]]:
+        """Add a BM25-style bonus for every pair of query terms that co-occur
+        within PROXIMITY_WINDOW tokens (Rasolofo & Savoy), weighted by the
+        rarer term of the pair."""
+        weights = {token: weight for token, (_, weight)
+                   in self.__query_weights(query_tokens).items()}
+
+        reranked = []
+        for doc_id, score in top_docs:
+            segment = self.__live_segment(doc_id)
+            positions = {}
+            for token in weights:
+                postings = segment.postings.get(token)
+                if postings is not None:
+                    doc_positions = postings.doc_positions(doc_id)
+                    if doc_positions:
+                        positions[token] = doc_positions
+
+            doc_length = segment.doc_length[doc_id]
+            for token, other in combinations(positions, 2):
+                frequency = proximity_frequency(
+                    positions[token], positions[other], PROXIMITY_WINDOW)
+                if frequency:
+                    score += min(weights[token], weights[other]) * \
+                        self.__bm25_tf(frequency, doc_length)
+            reranked.append((doc_id, score))
+
+        return sorted(reranked, key=lambda x: (-x[1], x[0]))
+
+    def __live_segment(self, doc_id: int) -> IndexSegment | MemorySegment:
+        for segment in reversed(self.segments):
+            if doc_id in segment.docmap and doc_id not in segment.deleted:
+                return segment
+        raise KeyError(doc_id)
+
+    def __posting_score(self, weight: float, doc_length: Mapping[int, int], doc_id: int, tf: int) -> float:
+        return weight * self.__bm25_tf(tf, doc_length[doc_id])
+
+    def __block_bound(self, weight: float, max_tf: int, min_doc_length: int) -> float:
+        return weight * self.__bm25_tf(max_tf, min_doc_length)
+
+    def __bm25f_tf(self, field_weights: list[float], field_tfs: list[int], field_lengths: list[int]) -> float:
+        return bm25f_tf(field_tfs, field_lengths, self.avg_field_lengths, field_weights,
+                        [BM25F_B[field] for field in INDEX_FIELDS])
+
+    def __field_posting_score(self, weight: float, field_weights: list[float], segment,
+                              doc_id: int, tf: int, field_tfs: list[int]) -> float:
+        # the last field holds whatever the leading ones don't
+        field_lengths = segment.field_length[doc_id]
+        return weight * self.__bm25f_tf(field_weights, [*field_tfs, tf - sum(field_tfs)],
+                                        [*field_lengths, segment.doc_length[doc_id] - sum(field_lengths)])
+
+    def __field_block_bound(self, weight: float, field_weights: list[float], segment,
+                            max_tf: int, min_doc_length: int, max_field_tfs: list[int]) -> float:
+        # every field at its shortest: the leading ones at the segment minimum,
+        # the last one at what the block's shortest doc leaves beside the
+        # longest leading fields
+        shortest = [low for low, _ in segment.field_length_ranges]
+        longest = sum(high for _, high in segment.field_length_ranges)
+        return weight * self.__bm25f_tf(field_weights, [*max_field_tfs, max_tf],
+                                        [*shortest, max(0, min_doc_length - longest)])
+
+    def __bm25_exhaustive(self, query_tokens: list[str], limit: int) -> list[tuple[int, float]]:
+        # term-at-a-time: only the posting lists of the query terms are walked,
+        # so documents that match none of them are never scored
+        scores: dict[int, float] = defaultdict(float)
+        for token, query_tf in Counter(query_tokens).items():
+            postings = self.index.get(token)
+            if not postings:
+                continue
+
+            idf = self.__bm25_idf(len(postings))
+            for segment, part in postings.parts:
+                doc_length = segment.doc_length
+                for doc_id, tf in part:
+                    if doc_id not in segment.deleted:
+                        scores[doc_id] += query_tf * idf * \
+                            self.__bm25_tf(tf, doc_length[doc_id])
+
+        return heapq.nlargest(
+            limit, scores.items(), key=lambda x: (x[1], -x[0]))
+
+
+def build_command(workers: int = 1, positions: bool = False) -> None:
     idx = InvertedIndex()
-    idx.build()
+    idx.build(workers, positions)
     idx.save()
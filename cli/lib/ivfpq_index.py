@@ -0,0 +1,150 @@
+import math
+import os
+
+import numpy as np
+
+from lib.utils.constants import IVF_NPROBE, IVF_RERANK, IVF_TRAIN_SAMPLE, PQ_SUBVECTORS
+from lib.utils.math_utils import normalize_rows, top_k_indices
+
+PQ_CENTROIDS = 256  # one uint8 code per subvector
+PQ_TRAIN_SAMPLE = 64 * PQ_CENTROIDS
+KMEANS_ITERATIONS = 20
+ENCODE_BATCH_SIZE = 65536
+ASSIGN_CELLS = 1 << 24
+
+
+class IVFPQIndex:
+    """Inverted file with product quantization over L2-normalized vectors,
+    for approximate inner product (= cosine) search in a fraction of the memory.
+
+    k-means splits the vectors into `nlist` lists around coarse centroids.
+    Each vector's residual (vector - its centroid) is cut into
+    `subvectors` pieces, each stored as the uint8 id of the nearest of 256
+    centroids learned for that piece, so a 384-dim float32 vector (1536
+    bytes) costs `subvectors` bytes plus its id. A query scores only the
+    `nprobe` lists whose centroids are closest: q . x ~ q . centroid +
+    sum over pieces of q_piece . codeword, where the second term comes from
+    one small (subvectors x 256) table per query. The best candidates can
+    optionally be re-scored exactly against the original vectors.
+    """
+
+    def __init__(self, centroids: np.ndarray, codebooks: np.ndarray, codes: np.ndarray,
+                 ids: np.ndarray, offsets: np.ndarray) -> None:
+        self.centroids = centroids
+        # (subvectors, 256, piece dims)
+        self.codebooks = codebooks
+        # list by list: codes[offsets[l]:offsets[l + 1]] encode vectors ids[offsets[l]:offsets[l + 1]]
+        self.codes = codes
+        self.ids = ids
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, vectors: np.ndarray, nlist: int | None = None, subvectors: int = PQ_SUBVECTORS,
+              seed: int = 0) -> "IVFPQIndex":
+        """Train on a sample of `vectors` (which may be memory-mapped and are
+        normalized batch by batch) and encode all of them."""
+        count, dim = vectors.shape
+        if dim % subvectors:
+            raise ValueError(
+                f"{dim} dimensions can't be split into {subvectors} equal subvectors")
+        nlist = max(1, min(count, nlist or round(math.sqrt(count))))
+
+        rng = np.random.default_rng(seed)
+        sample_ids = np.sort(rng.choice(count, min(count, IVF_TRAIN_SAMPLE), replace=False))
+        sample = normalize_rows(vectors[sample_ids])
+
+        centroids = _kmeans(sample, nlist, rng)
+        # 256 codewords of a few dims each need far fewer points than the coarse lists
+        pq_sample = sample[:PQ_TRAIN_SAMPLE]
+        residuals = pq_sample - centroids[_nearest(pq_sample, centroids)]
+        pieces = residuals.reshape(len(pq_sample), subvectors, -1).transpose(1, 0, 2).copy()
+        codebooks = np.stack([_kmeans(piece, PQ_CENTROIDS, rng) for piece in pieces])
+
+        lists = np.empty(count, dtype=np.int64)
+        codes = np.empty((count, subvectors), dtype=np.uint8)
+        for start in range(0, count, ENCODE_BATCH_SIZE):
+            batch = normalize_rows(vectors[start:start + ENCODE_BATCH_SIZE])
+            batch_lists = _nearest(batch, centroids)
+            lists[start:start + len(batch)] = batch_lists
+            pieces = (batch - centroids[batch_lists]).reshape(len(batch), subvectors, -1)
+            for piece in range(subvectors):
+                codes[start:start + len(batch), piece] = _nearest(pieces[:, piece], codebooks[piece])
+
+        order = np.argsort(lists, kind="stable")
+        offsets = np.zeros(nlist + 1, dtype=np.int64)
+        np.cumsum(np.bincount(lists, minlength=nlist), out=offsets[1:])
+        return cls(centroids, codebooks, codes[order], order.astype(np.int32), offsets)
+
+    def search(self, query: np.ndarray, k: int, nprobe: int = IVF_NPROBE, vectors: np.ndarray | None = None,
+               rerank: int = IVF_RERANK) -> tuple[np.ndarray, np.ndarray]:
+        """(ids, scores) of the approximate k best vectors, best first. With
+        `vectors`, the best max(k, rerank) candidates are re-scored exactly."""
+        if k <= 0 or len(self.ids) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        coarse_scores = self.centroids @ query
+        probed = top_k_indices(coarse_scores, nprobe)
+        starts, ends = self.offsets[probed], self.offsets[probed + 1]
+        positions = np.concatenate([np.arange(start, end) for start, end in zip(starts.tolist(), ends.tolist())])
+
+        # q . codeword for every piece and codeword, then one gather per candidate
+        subvectors = len(self.codebooks)
+        table = np.einsum("pcd,pd->pc", self.codebooks, query.reshape(subvectors, -1))
+        scores = np.repeat(coarse_scores[probed], ends - starts) + \
+            table[np.arange(subvectors), self.codes[positions]].sum(axis=1)
+
+        if vectors is not None and rerank > 0:
+            candidates = np.sort(self.ids[positions[top_k_indices(scores, max(k, rerank))]])
+            exact = normalize_rows(vectors[candidates]) @ query
+            best = top_k_indices(exact, k)
+            return candidates[best].astype(np.int64), exact[best]
+
+        best = top_k_indices(scores, k)
+        return self.ids[positions[best]].astype(np.int64), scores[best].astype(np.float32)
+
+    def save(self, path: str) -> None:
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, centroids=self.centroids, codebooks=self.codebooks, codes=self.codes,
+                 ids=self.ids, offsets=self.offsets)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, vectors: np.ndarray) -> "IVFPQIndex":
+        with np.load(path) as data:
+            index = cls(data["centroids"], data["codebooks"], data["codes"], data["ids"], data["offsets"])
+        if len(index) != len(vectors):
+            raise ValueError(
+                f"IVF-PQ index at {path} covers {len(index)} vectors, expected {len(vectors)}")
+        return index
+
+
+def _nearest(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Index of the closest centroid (L2) of every vector."""
+    # |x - c|^2 = |x|^2 - 2 x.c + |c|^2, and |x|^2 doesn't change the argmin
+    half_norms = np.square(centroids).sum(axis=1) / 2
+    # rows at a time, so the distance block stays around ASSIGN_CELLS floats
+    step = max(1, ASSIGN_CELLS // len(centroids))
+    return np.concatenate([np.argmax(vectors[start:start + step] @ centroids.T - half_norms, axis=1)
+                           for start in range(0, len(vectors), step)] or [np.empty(0, dtype=np.int64)])
+
+
+def _kmeans(vectors: np.ndarray, k: int, rng: np.random.Generator) -> np.ndarray:
+    """Lloyd's k-means from k random points; empty clusters restart at a random point."""
+    k = min(k, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].astype(np.float32)
+    for _ in range(KMEANS_ITERATIONS):
+        assignment = _nearest(vectors, centroids)
+        counts = np.bincount(assignment, minlength=k)
+        filled = np.flatnonzero(counts)
+
+        # members of each cluster are contiguous once sorted, sum each run
+        order = np.argsort(assignment, kind="stable")
+        starts = np.concatenate(([0], np.cumsum(counts[filled])[:-1]))
+        centroids[filled] = np.add.reduceat(vectors[order], starts, axis=0) / counts[filled, None]
+
+        empty = counts == 0
+        centroids[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+    return centroids
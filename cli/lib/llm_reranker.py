@@ -1,17 +1,10 @@
+from functools import cache
 import json
-import os
-import time
 
-from dotenv import load_dotenv  # type: ignore
-from google import genai
-from lib.utils.common_utils import rate_limit
+from lib.utils.common_utils import get_genai_client, rate_limit
 
-from lib.utils.constants import DEFAULT_SEARCH_LIMIT, GEMINI_MODEL, RATE_TIME_SECONDS
-from sentence_transformers import CrossEncoder
+from lib.utils.constants import DEFAULT_SEARCH_LIMIT, GEMINI_MODEL
 
-load_dotenv()
-api_key = os.environ.get("GEMINI_API_KEY")
-client = genai.Client(api_key=api_key)
 model = GEMINI_MODEL
 
 
@@ -33,7 +26,7 @@ def llm_rerank_individual(query: str, documents: list, limit) -> list:
 
                   Score:"""
         rate_limit()
-        response = client.models.generate_content(model=model, contents=prompt)
+        response = get_genai_client().models.generate_content(model=model, contents=prompt)
         if response.text:
             try:
                 doc["re_rank_score"] = int(response.text.strip())
@@ -68,7 +61,7 @@ def llm_rerank_batch(query: str, documents: list, limit: int) -> list:
                 [75, 12, 34, 2, 1]
                 """
     rate_limit()
-    response = client.models.generate_content(model=model, contents=prompt)
+    response = get_genai_client().models.generate_content(model=model, contents=prompt)
     if response.text:
         ranked_ids = json.loads(response.text.strip())
 
@@ -85,6 +78,13 @@ def llm_rerank_batch(query: str, documents: list, limit: int) -> list:
     return sorted_results[:limit]
 
 
+@cache
+def get_cross_encoder():
+    from sentence_transformers import CrossEncoder
+
+    return CrossEncoder("cross-encoder/ms-marco-TinyBERT-L2-v2")
+
+
 def llm_rerank_cross_encoder(query: str, documents: list[dict], limit: int) -> list:
 
     pairs = []
@@ -93,7 +93,7 @@ def llm_rerank_cross_encoder(query: str, documents: list[dict], limit: int) -> l
             [query, f"{doc.get('title', '')} - {doc.get('document', '')}"])
 
     rate_limit()
-    cross_encoder = CrossEncoder("cross-encoder/ms-marco-TinyBERT-L2-v2")
+    cross_encoder = get_cross_encoder()
 
     # scores is a list of numbers, one for each pair
     scores = cross_encoder.predict(pairs)
@@ -154,7 +154,7 @@ def evaluate_results(query: str, results: list[dict]) -> list[int]:
                 Return EXACTLY in this format:
                 [2, 0, 3, 2, 0, 1]"""
     rate_limit()
-    response = client.models.generate_content(model=model, contents=prompt)
+    response = get_genai_client().models.generate_content(model=model, contents=prompt)
 
     if response.text:
         try:
@@ -1,8 +1,9 @@
-from unittest import result
-from PIL import Image
-from sentence_transformers import SentenceTransformer
+from functools import partial
+
+import numpy as np
 
 from lib.utils.constants import DEFAULT_SEARCH_LIMIT
+from lib.utils.embedding_utils import LazyModel, encode_in_batches, load_sentence_transformer
 from lib.utils.math_utils import cosine_similarity
 from lib.utils.search_utils import format_search_result, load_movies
 
@@ -11,15 +12,29 @@ class MultiModalSearch:
 
     def __init__(self, model_name="clip-ViT-B-32", document=[]):
         self.model_name = model_name
-        self.model = SentenceTransformer(
-            self.model_name, model_kwargs={'use_fast': False})
+        self.model = LazyModel(partial(
+            load_sentence_transformer, self.model_name, model_kwargs={'use_fast': False}))
         self.document = document
-        self.texts = [
-            f"{doc['title']}: {doc['description']}" for doc in self.document]
-        self.text_embeddings = self.model.encode(
-            self.texts, show_progress_bar=True)
+        # encoded on the first search, so building the searcher (or only
+        # embedding an image) never encodes the catalog
+        self.text_embeddings: np.ndarray | None = None
+
+    def __encode_documents(self) -> np.ndarray:
+        texts = (f"{doc['title']}: {doc['description']}"
+                 for doc in self.document)
+        # each batch is copied into place as it is encoded, never all of them at once
+        text_embeddings = np.empty((0, 0), dtype=np.float32)
+        start = 0
+        for batch in encode_in_batches(self.model, texts):
+            if start == 0:
+                text_embeddings = np.empty((len(self.document), batch.shape[1]), dtype=np.float32)
+            text_embeddings[start:start + len(batch)] = batch
+            start += len(batch)
+        return text_embeddings
 
     def embed_image(self, image_path: str):
+        from PIL import Image
+
         image = Image.open(image_path)
         image_embeddings = self.model.encode([image], show_progress_bar=True)
 
@@ -27,6 +42,8 @@ class MultiModalSearch:
 
     def search_with_image(self, image_path: str) -> list[dict]:
         image_embedding = self.embed_image(image_path)
+        if self.text_embeddings is None:
+            self.text_embeddings = self.__encode_documents()
 
         result = []
         for i, embedding in enumerate(self.text_embeddings):
@@ -0,0 +1,71 @@
+from bisect import bisect_left, bisect_right
+import re
+from typing import Iterator
+
+from lib.dynamic_pruning import END_OF_POSTINGS, PostingCursor
+from lib.posting_list import gallop
+
+
+PHRASE_PATTERN = re.compile(r'"([^"]*)"')
+
+
+def parse_phrases(query: str) -> tuple[str, list[str]]:
+    """Split out the quoted phrases of a query; the returned text keeps their words for scoring."""
+    phrases = [phrase for phrase in PHRASE_PATTERN.findall(
+        query) if phrase.strip()]
+    return query.replace('"', " "), phrases
+
+
+def intersect_cursors(cursors: list[PostingCursor]) -> Iterator[int]:
+    """Doc ids present in every cursor, leapfrogging with `next_geq` so each
+    list skips whole blocks up to the current candidate."""
+    if not cursors:
+        return
+
+    doc = max(cursor.doc() for cursor in cursors)
+    while doc != END_OF_POSTINGS:
+        for cursor in cursors:
+            found = cursor.next_geq(doc)
+            if found != doc:
+                doc = found
+                break
+        else:
+            yield doc
+            doc = cursors[0].next_geq(doc + 1)
+
+
+def intersect_galloping(small: list[int], large: list[int]) -> list[int]:
+    result = []
+    low = 0
+    for value in small:
+        low = gallop(large, value, low)
+        if low == len(large):
+            break
+        if large[low] == value:
+            result.append(value)
+    return result
+
+
+def phrase_occurs(position_lists: list[list[int]], offsets: list[int]) -> bool:
+    """Whether the terms appear at their phrase offsets from a common start position."""
+    starts = sorted(([position - offset for position in positions]
+                     for positions, offset in zip(position_lists, offsets)), key=len)
+
+    matches = starts[0]
+    for candidates in starts[1:]:
+        matches = intersect_galloping(matches, candidates)
+        if not matches:
+            return False
+    return True
+
+
+def proximity_frequency(positions: list[int], other_positions: list[int], window: int) -> float:
+    """Sum of 1 / distance^2 over occurrence pairs of two terms at most `window` apart."""
+    frequency = 0.0
+    for position in positions:
+        start = bisect_left(other_positions, position - window)
+        end = bisect_right(other_positions, position + window)
+        for other in other_positions[start:end]:
+            if other != position:
+                frequency += 1.0 / (other - position) ** 2
+    return frequency
@@ -0,0 +1,326 @@
+from array import array
+from bisect import bisect_left
+from itertools import accumulate
+from typing import Iterator
+
+from lib.utils.constants import INDEX_FIELDS, POSTING_BLOCK_SIZE
+
+
+# fields with their own tfs; the last field's tf is the rest of the total
+LEADING_FIELDS = len(INDEX_FIELDS) - 1
+
+
+def encode_varints(values, out: bytearray) -> None:
+    for value in values:
+        while value >= 0x80:
+            out.append((value & 0x7F) | 0x80)
+            value >>= 7
+        out.append(value)
+
+
+def gallop(values, target: int, low: int = 0) -> int:
+    """bisect_left from `low`, probing 1, 2, 4, ... ahead first so targets close to `low` are found in O(log distance)."""
+    high = len(values)
+    step = 1
+    while low + step < high and values[low + step] < target:
+        low += step
+        step *= 2
+    return bisect_left(values, target, low, min(low + step + 1, high))
+
+
+def decode_varints(data: bytes, offset: int, count: int) -> tuple[list[int], int]:
+    values = []
+    for _ in range(count):
+        value = 0
+        shift = 0
+        while True:
+            byte = data[offset]
+            offset += 1
+            value |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                break
+            shift += 7
+        values.append(value)
+    return values, offset
+
+
+class PostingList:
+    """Sorted doc ids with parallel term frequencies, compressed in blocks.
+
+    Every block of POSTING_BLOCK_SIZE postings is stored as varint doc id
+    deltas followed by varint tfs. The first delta of a block is relative to
+    the last doc id of the previous block, so a block decodes on its own and
+    `block_last_docs` doubles as a skip list.
+
+    For pruning, each block also keeps its largest tf and its shortest doc
+    length. BM25 is increasing in tf and decreasing in length, so the pair
+    bounds every score in the block for whatever N / avgdl / df the corpus
+    has at query time, and stays valid as segments are added or deleted.
+
+    Token positions are optional and live in a separate varint stream (gaps
+    within each posting, offsets per block), so queries that don't need them
+    never read them.
+
+    Per-field tfs (for BM25F) are a third stream holding, for every field but
+    the last, only the postings with a non-zero tf in that field as (index
+    gap, tf) pairs; the last field's tf is the remainder of the total. Title
+    hits are rare next to description hits, so this usually costs a byte or
+    two per block. Each block also keeps its largest tf in those fields.
+    """
+
+    __slots__ = ("doc_count", "data", "block_offsets", "block_last_docs", "block_max_tfs",
+                 "block_min_lengths", "positions", "block_position_offsets", "field_tfs",
+                 "block_field_offsets", "block_max_field_tfs")
+
+    def __init__(self, doc_ids: list[int], tfs: list[int], doc_lengths: list[int],
+                 positions: list[list[int]] | None = None, field_tfs: list[int] | None = None) -> None:
+        """`field_tfs` holds the LEADING_FIELDS tfs of every posting back to back."""
+        encoder = PostingListEncoder(
+            positions is not None, field_tfs is not None)
+        for start in range(0, len(doc_ids), POSTING_BLOCK_SIZE):
+            end = start + POSTING_BLOCK_SIZE
+            encoder.add_block(doc_ids[start:end], tfs[start:end], doc_lengths[start:end],
+                              positions[start:end] if positions is not None else None,
+                              field_tfs[start * LEADING_FIELDS:end * LEADING_FIELDS] if field_tfs is not None else None)
+        encoder.encode_into(self)
+
+    @classmethod
+    def from_buffers(cls, doc_count: int, data, block_offsets, block_last_docs, block_max_tfs,
+                     block_min_lengths, positions=b"", block_position_offsets=(), field_tfs=b"",
+                     block_field_offsets=(), block_max_field_tfs=()) -> "PostingList":
+        """Wrap already encoded buffers (e.g. memoryviews over a mapped segment) without copying."""
+        postings = cls.__new__(cls)
+        postings.doc_count = doc_count
+        postings.data = data
+        postings.block_offsets = block_offsets
+        postings.block_last_docs = block_last_docs
+        postings.block_max_tfs = block_max_tfs
+        postings.block_min_lengths = block_min_lengths
+        postings.positions = positions
+        postings.block_position_offsets = block_position_offsets
+        postings.field_tfs = field_tfs
+        postings.block_field_offsets = block_field_offsets
+        postings.block_max_field_tfs = block_max_field_tfs
+        return postings
+
+    def __len__(self) -> int:
+        return self.doc_count
+
+    def __bool__(self) -> bool:
+        return self.doc_count > 0
+
+    def __iter__(self) -> Iterator[tuple[int, int]]:
+        for block in range(len(self.block_offsets)):
+            doc_ids, tfs = self.decode_block(block)
+            yield from zip(doc_ids, tfs)
+
+    def block_count(self) -> int:
+        return len(self.block_offsets)
+
+    def has_positions(self) -> bool:
+        return len(self.block_position_offsets) > 0
+
+    def has_field_tfs(self) -> bool:
+        return len(self.block_field_offsets) > 0
+
+    def decode_block(self, block: int) -> tuple[list[int], list[int]]:
+        count = min(POSTING_BLOCK_SIZE, self.doc_count -
+                    block * POSTING_BLOCK_SIZE)
+        start = self.block_offsets[block]
+        end = self.block_offsets[block + 1] if block + \
+            1 < len(self.block_offsets) else len(self.data)
+        base = self.block_last_docs[block - 1] if block > 0 else 0
+
+        if end - start == 2 * count:
+            # every delta and tf fits in one byte, the common case
+            deltas = self.data[start:start + count]
+            tfs = list(self.data[start + count:end])
+        else:
+            deltas, offset = decode_varints(self.data, start, count)
+            tfs, _ = decode_varints(self.data, offset, count)
+
+        return list(accumulate(deltas, initial=base))[1:], tfs
+
+    def decode_positions(self, block: int, tfs: list[int]) -> list[list[int]]:
+        """Positions of every posting in a block, given the block's tfs."""
+        gaps, _ = decode_varints(
+            self.positions, self.block_position_offsets[block], sum(tfs))
+        positions = []
+        start = 0
+        for tf in tfs:
+            positions.append(list(accumulate(gaps[start:start + tf])))
+            start += tf
+        return positions
+
+    def decode_field_tfs(self, block: int, count: int) -> list[list[int]]:
+        """The LEADING_FIELDS tfs of every posting in a block of `count` postings."""
+        field_tfs = [[0] * LEADING_FIELDS for _ in range(count)]
+        offset = self.block_field_offsets[block]
+        for field in range(LEADING_FIELDS):
+            (entry_count,), offset = decode_varints(self.field_tfs, offset, 1)
+            entries, offset = decode_varints(
+                self.field_tfs, offset, 2 * entry_count)
+            index = 0
+            for gap, tf in zip(entries[::2], entries[1::2]):
+                index += gap
+                field_tfs[index][field] = tf
+        return field_tfs
+
+    def block_field_bounds(self, block: int) -> list[int]:
+        return list(self.block_max_field_tfs[block * LEADING_FIELDS:(block + 1) * LEADING_FIELDS])
+
+    def with_positions(self) -> Iterator[tuple[int, int, list[int]]]:
+        for block in range(len(self.block_offsets)):
+            doc_ids, tfs = self.decode_block(block)
+            yield from zip(doc_ids, tfs, self.decode_positions(block, tfs))
+
+    def doc_ids(self) -> Iterator[int]:
+        for block in range(len(self.block_offsets)):
+            yield from self.decode_block(block)[0]
+
+    def find_block(self, doc_id: int, start_block: int = 0) -> int:
+        """Index of the first block whose last doc id is >= doc_id."""
+        return bisect_left(self.block_last_docs, doc_id, start_block)
+
+    def tf(self, doc_id: int) -> int:
+        block = self.find_block(doc_id)
+        if block >= len(self.block_offsets):
+            return 0
+
+        doc_ids, tfs = self.decode_block(block)
+        position = bisect_left(doc_ids, doc_id)
+        if position < len(doc_ids) and doc_ids[position] == doc_id:
+            return tfs[position]
+        return 0
+
+    def doc_positions(self, doc_id: int) -> list[int]:
+        block = self.find_block(doc_id)
+        if block >= len(self.block_offsets) or not self.has_positions():
+            return []
+
+        doc_ids, tfs = self.decode_block(block)
+        position = bisect_left(doc_ids, doc_id)
+        if position < len(doc_ids) and doc_ids[position] == doc_id:
+            return self.decode_positions(block, tfs[:position + 1])[position]
+        return []
+
+
+class PostingListEncoder:
+    """Builds a PostingList one posting at a time, encoding every block as
+    soon as it fills up, so only compressed bytes are ever held."""
+
+    def __init__(self, with_positions: bool = False, with_field_tfs: bool = False) -> None:
+        self.with_positions = with_positions
+        self.with_field_tfs = with_field_tfs
+        self.doc_count = 0
+        self.data = bytearray()
+        self.position_data = bytearray()
+        self.field_data = bytearray()
+        self.block_offsets = array("I")
+        self.block_last_docs = array("I")
+        self.block_max_tfs = array("I")
+        self.block_min_lengths = array("I")
+        self.block_position_offsets = array("I")
+        self.block_field_offsets = array("I")
+        self.block_max_field_tfs = array("I")
+        self.previous = 0
+
+        # postings not yet encoded, less than a block once every call returns
+        self.pending_docs: list[int] = []
+        self.pending_tfs: list[int] = []
+        self.pending_lengths: list[int] = []
+        self.pending_positions: list[list[int]] = []
+        self.pending_field_tfs: list[int] = []
+
+    def add(self, doc_id: int, tf: int, doc_length: int, positions: list[int] | None = None,
+            field_tfs: list[int] | None = None) -> None:
+        self.pending_docs.append(doc_id)
+        self.pending_tfs.append(tf)
+        self.pending_lengths.append(doc_length)
+        if self.with_positions:
+            self.pending_positions.append(positions)
+        if self.with_field_tfs:
+            self.pending_field_tfs.extend(field_tfs)
+        if len(self.pending_docs) == POSTING_BLOCK_SIZE:
+            self.__flush()
+
+    def extend(self, doc_ids: list[int], tfs: list[int], doc_lengths: list[int],
+               positions: list[list[int]] | None = None, field_tfs: list[int] | None = None) -> None:
+        self.pending_docs.extend(doc_ids)
+        self.pending_tfs.extend(tfs)
+        self.pending_lengths.extend(doc_lengths)
+        if self.with_positions:
+            self.pending_positions.extend(positions)
+        if self.with_field_tfs:
+            self.pending_field_tfs.extend(field_tfs)
+        while len(self.pending_docs) >= POSTING_BLOCK_SIZE:
+            self.__flush()
+
+    def add_block(self, doc_ids: list[int], tfs: list[int], doc_lengths: list[int],
+                  positions: list[list[int]] | None = None, field_tfs: list[int] | None = None) -> None:
+        """Encode one full block (or the final, shorter one) directly."""
+        deltas = []
+        for doc_id in doc_ids:
+            deltas.append(doc_id - self.previous)
+            self.previous = doc_id
+
+        self.block_offsets.append(len(self.data))
+        self.block_last_docs.append(doc_ids[-1])
+        self.block_max_tfs.append(max(tfs))
+        self.block_min_lengths.append(min(doc_lengths))
+        encode_varints(deltas, self.data)
+        encode_varints(tfs, self.data)
+        self.doc_count += len(doc_ids)
+
+        if self.with_positions:
+            self.block_position_offsets.append(len(self.position_data))
+            for doc_positions in positions:
+                encode_varints((position - previous for previous, position in
+                                zip([0] + doc_positions, doc_positions)), self.position_data)
+
+        if self.with_field_tfs:
+            self.block_field_offsets.append(len(self.field_data))
+            for field in range(LEADING_FIELDS):
+                column = field_tfs[field::LEADING_FIELDS]
+                self.block_max_field_tfs.append(max(column))
+                entries = [(index, tf)
+                           for index, tf in enumerate(column) if tf]
+                encode_varints([len(entries)], self.field_data)
+                previous = 0
+                for index, tf in entries:
+                    encode_varints((index - previous, tf), self.field_data)
+                    previous = index
+
+    def __flush(self) -> None:
+        if not self.pending_docs:
+            return
+        block = [values[:POSTING_BLOCK_SIZE] for values in (
+            self.pending_docs, self.pending_tfs, self.pending_lengths, self.pending_positions)]
+        block.append(self.pending_field_tfs[:POSTING_BLOCK_SIZE * LEADING_FIELDS])
+        for values in (self.pending_docs, self.pending_tfs, self.pending_lengths, self.pending_positions):
+            del values[:POSTING_BLOCK_SIZE]
+        del self.pending_field_tfs[:POSTING_BLOCK_SIZE * LEADING_FIELDS]
+        self.add_block(*block[:3], block[3] if self.with_positions else None,
+                       block[4] if self.with_field_tfs else None)
+
+    def __len__(self) -> int:
+        return self.doc_count + len(self.pending_docs)
+
+    def encode_into(self, postings: PostingList) -> None:
+        self.__flush()
+        postings.doc_count = self.doc_count
+        postings.data = bytes(self.data)
+        postings.block_offsets = self.block_offsets
+        postings.block_last_docs = self.block_last_docs
+        postings.block_max_tfs = self.block_max_tfs
+        postings.block_min_lengths = self.block_min_lengths
+        postings.positions = bytes(self.position_data)
+        postings.block_position_offsets = self.block_position_offsets
+        postings.field_tfs = bytes(self.field_data)
+        postings.block_field_offsets = self.block_field_offsets
+        postings.block_max_field_tfs = self.block_max_field_tfs
+
+    def finish(self) -> PostingList:
+        postings = PostingList.__new__(PostingList)
+        self.encode_into(postings)
+        return postings
@@ -0,0 +1,168 @@
+from collections import OrderedDict, defaultdict
+import json
+import os
+import threading
+
+from lib.utils.constants import QUERY_CACHE_POLICY, QUERY_CACHE_SIZE
+
+QUERY_CACHE_POLICIES = ("lru", "lfu")
+
+TopDocs = list[tuple[int, float]]
+
+
+class QueryCache:
+    """Bounded cache of top-k results, keyed on the analyzed query and its parameters.
+
+    Entries belong to one index generation: the first lookup made with a
+    newer generation drops them all, so results never outlive the index they
+    were scored on, and results of an older generation are never stored.
+    `policy` picks the entry evicted when full: "lru" the least recently
+    used, "lfu" the least frequently used (oldest of those).
+    """
+
+    def __init__(self, capacity: int = QUERY_CACHE_SIZE, policy: str = QUERY_CACHE_POLICY) -> None:
+        if policy not in QUERY_CACHE_POLICIES:
+            raise ValueError(
+                f"Unknown cache policy '{policy}', expected one of {QUERY_CACHE_POLICIES}")
+        self.capacity = capacity
+        self.policy = policy
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+        # in eviction order for lru
+        self.entries: OrderedDict[tuple, TopDocs] = OrderedDict()
+
+        # lfu: use count per key, and the keys of each count in eviction order
+        self.counts: dict[tuple, int] = {}
+        self.buckets: defaultdict[int, OrderedDict[tuple, None]] = defaultdict(OrderedDict)
+        self.min_count = 0
+
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key: tuple, generation: int) -> TopDocs | None:
+        with self.lock:
+            top_docs = self.entries.get(key) if self.__current(generation) else None
+            if top_docs is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.__touch(key)
+            return top_docs
+
+    def put(self, key: tuple, generation: int, top_docs: TopDocs, count: int = 1) -> None:
+        with self.lock:
+            if not self.__current(generation) or self.capacity <= 0:
+                return
+            if key in self.entries:
+                self.entries[key] = top_docs
+                self.__touch(key)
+                return
+            if len(self.entries) >= self.capacity:
+                self.__evict()
+            self.entries[key] = top_docs
+            if self.policy == "lfu":
+                self.counts[key] = count
+                self.buckets[count][key] = None
+                self.min_count = count if len(self.entries) == 1 else min(self.min_count, count)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.__clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "policy": self.policy,
+            "capacity": self.capacity,
+            "size": len(self.entries),
+            "generation": self.generation,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def __current(self, generation: int) -> bool:
+        """Move on to a newer generation; false for one older than the cached one."""
+        if generation > self.generation:
+            self.__clear()
+            self.generation = generation
+        return generation == self.generation
+
+    def __clear(self) -> None:
+        self.entries.clear()
+        self.counts.clear()
+        self.buckets.clear()
+        self.min_count = 0
+
+    def __touch(self, key: tuple) -> None:
+        if self.policy == "lru":
+            self.entries.move_to_end(key)
+            return
+
+        count = self.counts[key]
+        bucket = self.buckets[count]
+        del bucket[key]
+        if not bucket:
+            del self.buckets[count]
+            if self.min_count == count:
+                self.min_count = count + 1
+        self.counts[key] = count + 1
+        self.buckets[count + 1][key] = None
+
+    def __evict(self) -> None:
+        if self.policy == "lru":
+            self.entries.popitem(last=False)
+            return
+
+        bucket = self.buckets[self.min_count]
+        key, _ = bucket.popitem(last=False)
+        if not bucket:
+            del self.buckets[self.min_count]
+            self.min_count = min(self.buckets, default=0)
+        del self.counts[key]
+        del self.entries[key]
+
+    def __ordered_keys(self) -> list[tuple]:
+        """Keys in eviction order, so reinserting them rebuilds the same cache."""
+        if self.policy == "lru":
+            return list(self.entries)
+        return [key for count in sorted(self.buckets) for key in self.buckets[count]]
+
+    def save(self, path: str) -> None:
+        with self.lock:
+            state = {
+                "generation": self.generation,
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": [[key, self.entries[key], self.counts.get(key, 1)]
+                            for key in self.__ordered_keys()],
+            }
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, capacity: int = QUERY_CACHE_SIZE, policy: str = QUERY_CACHE_POLICY) -> "QueryCache":
+        with open(path, "r") as f:
+            state = json.load(f)
+
+        cache = cls(capacity, policy)
+        cache.generation = state["generation"]
+        cache.hits = state["hits"]
+        cache.misses = state["misses"]
+        for key, top_docs, count in state["entries"]:
+            cache.put(_freeze(key), cache.generation,
+                      [(doc_id, score) for doc_id, score in top_docs], count)
+        return cache
+
+
+def _freeze(value):
+    """JSON turns the tuples of a key into lists, turn them back so the key hashes."""
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
@@ -0,0 +1,200 @@
+from collections import OrderedDict
+from functools import cache
+import atexit
+import json
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+
+from lib.utils.constants import CACHE_DIR, QUERY_EMBEDDING_CACHE_SIZE
+from lib.utils.embedding_utils import TEXT_KEY_BYTES, text_key
+
+MAGIC = b"QEMB"
+HEADER = struct.Struct("<4sI")  # magic, vector dimension
+
+
+class QueryEmbeddingCache:
+    """Query embeddings keyed by (model name, whitespace-normalized text): an
+    in-process LRU of `capacity` vectors in front of an append-only file
+    shared by every process.
+
+    The file is a header followed by fixed-size records, a text key and its
+    float32 vector. A record is appended with a single write and never
+    changed, so a process reads other processes' records by mapping past the
+    last one it has seen. Each process appends its hit / miss counters and
+    encode time to a stats file next to it on exit.
+    """
+
+    def __init__(self, path: str, capacity: int = QUERY_EMBEDDING_CACHE_SIZE) -> None:
+        self.path = path
+        self.stats_path = f"{os.path.splitext(path)[0]}_stats.jsonl"
+        self.capacity = capacity
+
+        self.memory: OrderedDict[bytes, np.ndarray] = OrderedDict()
+        # key -> record number in the file, for the records read so far
+        self.records_by_key: dict[bytes, int] = {}
+        self.records: np.ndarray | None = None
+        self.dim: int | None = None
+
+        # since the stats were last saved
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.encode_seconds = 0.0
+
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        self.__refresh()
+        return len(self.records_by_key)
+
+    def get_or_encode(self, model, model_name: str, text: str) -> np.ndarray:
+        key = text_key(model_name, text)
+        with self.lock:
+            vector = self.__lookup(key)
+        if vector is not None:
+            return vector
+
+        start = time.perf_counter()
+        vector = np.asarray(model.encode([text])[0], dtype=np.float32)
+        elapsed = time.perf_counter() - start
+
+        with self.lock:
+            self.misses += 1
+            self.encode_seconds += elapsed
+            self.__remember(key, vector)
+            self.__append(key, vector)
+        return vector
+
+    def __lookup(self, key: bytes) -> np.ndarray | None:
+        vector = self.memory.get(key)
+        if vector is not None:
+            self.hits += 1
+            self.memory.move_to_end(key)
+            return vector
+
+        record = self.records_by_key.get(key)
+        if record is None:
+            # another process may have encoded it since
+            self.__refresh()
+            record = self.records_by_key.get(key)
+        if record is None:
+            return None
+
+        self.disk_hits += 1
+        vector = np.array(self.records[record]["vector"])
+        self.__remember(key, vector)
+        return vector
+
+    def __remember(self, key: bytes, vector: np.ndarray) -> None:
+        if self.capacity <= 0:
+            return
+        self.memory[key] = vector
+        self.memory.move_to_end(key)
+        if len(self.memory) > self.capacity:
+            self.memory.popitem(last=False)
+
+    def __record_dtype(self) -> np.dtype:
+        return np.dtype([("key", f"V{TEXT_KEY_BYTES}"), ("vector", "<f4", (self.dim,))])
+
+    def __refresh(self) -> None:
+        """Map the records appended since the last look at the file."""
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if size < HEADER.size:
+            return
+
+        if self.dim is None:
+            with open(self.path, "rb") as f:
+                magic, dim = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError(f"{self.path} is not a query embedding cache")
+            self.dim = dim
+
+        dtype = self.__record_dtype()
+        count = (size - HEADER.size) // dtype.itemsize
+        seen = len(self.records) if self.records is not None else 0
+        if count <= seen:
+            return
+
+        self.records = np.memmap(self.path, dtype=dtype, mode="r", offset=HEADER.size, shape=(count,))
+        for record, key in enumerate(self.records["key"][seen:].tolist(), seen):
+            self.records_by_key.setdefault(key, record)
+
+    def __append(self, key: bytes, vector: np.ndarray) -> None:
+        if self.dim is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            try:
+                fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+                with os.fdopen(fd, "wb") as f:
+                    f.write(HEADER.pack(MAGIC, len(vector)))
+            except FileExistsError:
+                pass
+            self.__refresh()
+        if self.dim != len(vector):
+            # written by a model of another size, keep this one in memory only
+            return
+
+        # O_APPEND and one write per record, so concurrent writers never interleave
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+        try:
+            os.write(fd, key + vector.tobytes())
+        finally:
+            os.close(fd)
+
+    def stats(self) -> dict:
+        """Counters of every process so far, this one included."""
+        saved = self.__saved_stats()
+        hits = saved["hits"] + self.hits
+        disk_hits = saved["disk_hits"] + self.disk_hits
+        misses = saved["misses"] + self.misses
+        encode_seconds = saved["encode_seconds"] + self.encode_seconds
+
+        lookups = hits + disk_hits + misses
+        seconds_per_encode = encode_seconds / misses if misses else 0.0
+        return {
+            "entries": len(self),
+            "hits": hits,
+            "disk_hits": disk_hits,
+            "misses": misses,
+            "hit_rate": (hits + disk_hits) / lookups if lookups else 0.0,
+            "encode_seconds": encode_seconds,
+            "saved_seconds": (hits + disk_hits) * seconds_per_encode,
+        }
+
+    def __saved_stats(self) -> dict:
+        stats = {"hits": 0, "disk_hits": 0, "misses": 0, "encode_seconds": 0.0}
+        if os.path.exists(self.stats_path):
+            with open(self.stats_path, "r") as f:
+                for line in f:
+                    for name, value in json.loads(line).items():
+                        stats[name] += value
+        return stats
+
+    def save_stats(self) -> None:
+        """Append this process's counters to the stats file and reset them."""
+        with self.lock:
+            if not (self.hits or self.disk_hits or self.misses):
+                return
+            line = json.dumps({"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses,
+                               "encode_seconds": self.encode_seconds}) + "\n"
+            self.hits = self.disk_hits = self.misses = 0
+            self.encode_seconds = 0.0
+
+        # a line per process and one write each, concurrent exits lose nothing
+        os.makedirs(os.path.dirname(self.stats_path), exist_ok=True)
+        fd = os.open(self.stats_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line.encode())
+        finally:
+            os.close(fd)
+
+
+@cache
+def get_query_embedding_cache() -> QueryEmbeddingCache:
+    """The process-wide cache over cache/query_embeddings.bin; its stats are saved at exit."""
+    query_cache = QueryEmbeddingCache(os.path.join(CACHE_DIR, "query_embeddings.bin"))
+    atexit.register(query_cache.save_stats)
+    return query_cache
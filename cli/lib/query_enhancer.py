@@ -1,26 +1,44 @@
-import os
-
-from dotenv import load_dotenv  # type: ignore
-from google import genai
-
+from lib.spell_corrector import get_spell_corrector
 from lib.utils.constants import GEMINI_MODEL  # type: ignore
-from lib.utils.common_utils import rate_limit
+from lib.utils.common_utils import get_genai_client, rate_limit
 
-load_dotenv()
-api_key = os.environ.get("GEMINI_API_KEY")
-client = genai.Client(api_key=api_key)
 model = GEMINI_MODEL
 
 
+ENHANCE_METHODS = ("local_spell", "spell", "rewrite", "expand")
+
+
+def local_spell_correction(query: str) -> str | None:
+    """Correct the query against the index vocabulary, without an API call.
+
+    None when the index is missing or some word has no close match.
+    """
+    try:
+        corrector = get_spell_corrector()
+    except FileNotFoundError:
+        return None
+    corrected, resolved = corrector.correct(query)
+    return corrected if resolved else None
+
+
 def query_enhancer(method: str, query: str) -> str | None:
 
     if not query.strip():
         raise ValueError("Query cannot be empty or whitespace.")
-    if method not in {"spell", "rewrite", "expand"}:
+    if method not in ENHANCE_METHODS:
         raise ValueError(
-            f"Unsupported method: {method}. Choose 'spell' or 'rewrite' or 'expand'.")
+            f"Unsupported method: {method}. Choose one of {', '.join(ENHANCE_METHODS)}.")
     print(f"Enhancing query using method '{method}': {query}")
 
+    if method == "local_spell":
+        corrected = local_spell_correction(query)
+        if corrected is not None:
+            print(f"Enhanced query: {corrected}")
+            return corrected
+        # a word the catalog has nothing close to, let the LLM have a go
+        print("No local correction for every word, falling back to the LLM")
+        method = "spell"
+
     match method:
         case "spell":
             prompt = f"""Fix any spelling errors in this movie search query.
@@ -70,7 +88,7 @@ def query_enhancer(method: str, query: str) -> str | None:
             return query
 
     rate_limit()
-    response = client.models.generate_content(model=model, contents=prompt)
+    response = get_genai_client().models.generate_content(model=model, contents=prompt)
 
     if response.text:
         enhanced_query = response.text.strip()
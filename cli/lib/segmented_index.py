@@ -0,0 +1,278 @@
+from collections.abc import Mapping
+import heapq
+from itertools import groupby
+from typing import AbstractSet, Iterator
+
+from lib.index_segment import SegmentWriter
+from lib.posting_list import LEADING_FIELDS, PostingList, PostingListEncoder
+from lib.utils.constants import MERGE_DELETED_RATIO, MERGE_FACTOR
+
+
+class MemorySegment:
+    """A freshly built segment that has not been written to disk yet.
+
+    Exposes the same `postings` / `docmap` / `doc_length` views as an
+    IndexSegment so the index can treat both alike.
+    """
+
+    def __init__(self, postings: dict[str, PostingList], docmap: dict[int, dict],
+                 doc_length: dict[int, int], field_length: dict[int, tuple[int, ...]]) -> None:
+        self.postings = postings
+        self.docmap = docmap
+        self.doc_length = doc_length
+        self.field_length = field_length
+        self.doc_ids = sorted(doc_length)
+        self.doc_count = len(doc_length)
+        self.total_doc_length = sum(doc_length.values())
+        columns = list(zip(*field_length.values())) or [()] * LEADING_FIELDS
+        self.total_field_lengths = [sum(column) for column in columns]
+        self.field_length_ranges = [(min(column, default=0), max(column, default=0))
+                                    for column in columns]
+        self.deleted: set[int] = set()
+
+
+def live_doc_count(segment) -> int:
+    return segment.doc_count - len(segment.deleted)
+
+
+class LivePostings:
+    """The postings of one term across every segment, minus tombstoned docs.
+
+    A doc id is live in at most one segment, so the parts never overlap and
+    iterating them merged by doc id yields the same (doc_id, tf) stream as a
+    single rebuilt posting list.
+    """
+
+    def __init__(self, parts: list[tuple[object, PostingList]]) -> None:
+        # (segment, postings of the term in that segment)
+        self.parts = parts
+        self.doc_count: int | None = None
+
+    def __len__(self) -> int:
+        if self.doc_count is None:
+            self.doc_count = sum(len(postings) - sum(1 for doc_id in segment.deleted if postings.tf(doc_id))
+                                 for segment, postings in self.parts)
+        return self.doc_count
+
+    def __bool__(self) -> bool:
+        return len(self) > 0
+
+    def __iter__(self) -> Iterator[tuple[int, int]]:
+        streams = [postings if not segment.deleted else _without_deleted(postings, segment.deleted)
+                   for segment, postings in self.parts]
+        if len(streams) == 1:
+            return iter(streams[0])
+        return heapq.merge(*streams)
+
+    def doc_ids(self) -> Iterator[int]:
+        for doc_id, _ in self:
+            yield doc_id
+
+    def tf(self, doc_id: int) -> int:
+        for segment, postings in self.parts:
+            if doc_id not in segment.deleted:
+                tf = postings.tf(doc_id)
+                if tf:
+                    return tf
+        return 0
+
+
+class LiveVocabulary(Mapping):
+    """term -> LivePostings over a list of segments."""
+
+    def __init__(self, segments: list) -> None:
+        self.segments = segments
+        self.term_count: int | None = None
+
+    def __getitem__(self, term: str) -> LivePostings:
+        parts = []
+        for segment in self.segments:
+            postings = segment.postings.get(term)
+            if postings is not None:
+                parts.append((segment, postings))
+        if not parts:
+            raise KeyError(term)
+        return LivePostings(parts)
+
+    def __iter__(self) -> Iterator[str]:
+        if len(self.segments) == 1:
+            yield from self.segments[0].postings
+            return
+
+        previous = None
+        for term in heapq.merge(*(sorted(segment.postings) if isinstance(segment.postings, dict)
+                                  else segment.postings for segment in self.segments)):
+            if term != previous:
+                yield term
+                previous = term
+
+    def __len__(self) -> int:
+        if self.term_count is None:
+            self.term_count = sum(1 for _ in self)
+        return self.term_count
+
+
+class LiveDocs(Mapping):
+    """doc id -> value of one per-segment doc view (`docmap` or `doc_length`), skipping tombstones."""
+
+    def __init__(self, segments: list, view: str) -> None:
+        self.segments = segments
+        self.view = view
+
+    def __getitem__(self, doc_id: int):
+        # newest first, an updated doc is only live in the segment it was re-added to
+        for segment in reversed(self.segments):
+            docs = getattr(segment, self.view)
+            if doc_id in docs and doc_id not in segment.deleted:
+                return docs[doc_id]
+        raise KeyError(doc_id)
+
+    def __contains__(self, doc_id: object) -> bool:
+        return any(doc_id in getattr(segment, self.view) and doc_id not in segment.deleted
+                   for segment in self.segments)
+
+    def __iter__(self) -> Iterator[int]:
+        return heapq.merge(*(_live_doc_ids(segment) for segment in self.segments))
+
+    def __len__(self) -> int:
+        return sum(live_doc_count(segment) for segment in self.segments)
+
+
+def _live_doc_ids(segment) -> Iterator[int]:
+    for doc_id in segment.doc_ids:
+        if doc_id not in segment.deleted:
+            yield doc_id
+
+
+def select_merge(segments: list) -> list:
+    """Merge policy: which segments to compact next, if any.
+
+    A segment whose share of tombstoned docs reaches MERGE_DELETED_RATIO is
+    rewritten on its own to reclaim the space. Otherwise, once there are more
+    than MERGE_FACTOR segments the MERGE_FACTOR smallest are merged, so small
+    update segments get folded together long before they reach the base one.
+    """
+    for segment in segments:
+        if segment.doc_count and len(segment.deleted) / segment.doc_count >= MERGE_DELETED_RATIO:
+            return [segment]
+
+    if len(segments) > MERGE_FACTOR:
+        return sorted(segments, key=live_doc_count)[:MERGE_FACTOR]
+
+    return []
+
+
+def merge_segments(parts: list[tuple[object, AbstractSet[int]]], path: str) -> int:
+    """Write the live docs of (segment, tombstones) pairs into one segment
+    file at `path`, returning its doc count.
+
+    Docs and postings (and positions, when indexed) are streamed in doc id
+    order, nothing is re-analyzed and only one term's merged postings are
+    held at a time. If a doc id is live in several parts the latest part
+    wins, which lets a build merge batches that repeat an id.
+    """
+    deleted = [set(segment_deleted) for _, segment_deleted in parts]
+
+    with SegmentWriter(path) as writer:
+        pending = None
+        for doc_id, part in heapq.merge(*(_tagged_doc_ids(segment, deleted[part], part)
+                                          for part, (segment, _) in enumerate(parts))):
+            if pending is not None and pending[0] == doc_id:
+                deleted[pending[1]].add(doc_id)
+            elif pending is not None:
+                _copy_document(writer, parts[pending[1]][0], pending[0])
+            pending = (doc_id, part)
+        if pending is not None:
+            _copy_document(writer, parts[pending[1]][0], pending[0])
+
+        # every segment's vocabulary is walked once, in term order
+        term_streams = heapq.merge(*(_tagged_postings(segment, part) for part, (segment, _) in enumerate(parts)),
+                                   key=lambda entry: entry[:2])
+        for term, entries in groupby(term_streams, key=lambda entry: entry[0]):
+            term_parts = [(part, postings) for _, part, postings in entries]
+            if len(term_parts) == 1 and not deleted[term_parts[0][0]]:
+                # nothing to merge or drop, the encoded list is copied as is
+                writer.add_term(term, term_parts[0][1])
+                continue
+
+            with_positions = all(postings.has_positions() for _, postings in term_parts)
+            with_field_tfs = all(postings.has_field_tfs() for _, postings in term_parts)
+
+            encoder = PostingListEncoder(with_positions, with_field_tfs)
+            if _disjoint([postings for _, postings in term_parts]):
+                # parts cover increasing doc id ranges (batches of a sorted
+                # catalog), so their blocks are simply appended in order
+                for part, postings in term_parts:
+                    for block in _live_blocks(parts[part][0], deleted[part], postings,
+                                              with_positions, with_field_tfs):
+                        encoder.extend(*block)
+            else:
+                streams = [_live_postings(parts[part][0], deleted[part], postings, with_positions, with_field_tfs)
+                           for part, postings in term_parts]
+                for posting in heapq.merge(*streams, key=lambda posting: posting[0]):
+                    encoder.add(*posting)
+            if len(encoder):
+                writer.add_term(term, encoder.finish())
+
+        return writer.doc_count()
+
+
+def _tagged_doc_ids(segment, deleted: AbstractSet[int], part: int) -> Iterator[tuple[int, int]]:
+    for doc_id in segment.doc_ids:
+        if doc_id not in deleted:
+            yield doc_id, part
+
+
+def _tagged_postings(segment, part: int) -> Iterator[tuple[str, int, PostingList]]:
+    items = sorted(segment.postings.items()) if isinstance(
+        segment.postings, dict) else segment.postings.items()
+    for term, postings in items:
+        yield term, part, postings
+
+
+def _disjoint(postings_lists: list[PostingList]) -> bool:
+    return all(previous.block_last_docs[-1] < postings.decode_block(0)[0][0]
+               for previous, postings in zip(postings_lists, postings_lists[1:]))
+
+
+def _live_blocks(segment, deleted: AbstractSet[int], postings: PostingList, with_positions: bool,
+                 with_field_tfs: bool) -> Iterator[tuple[list[int], list[int], list[int], list | None, list | None]]:
+    doc_length = segment.doc_length
+    for block in range(postings.block_count()):
+        doc_ids, tfs = postings.decode_block(block)
+        positions = postings.decode_positions(
+            block, tfs) if with_positions else None
+        field_tfs = postings.decode_field_tfs(
+            block, len(doc_ids)) if with_field_tfs else None
+        if deleted:
+            live = [i for i, doc_id in enumerate(doc_ids) if doc_id not in deleted]
+            doc_ids = [doc_ids[i] for i in live]
+            tfs = [tfs[i] for i in live]
+            if with_positions:
+                positions = [positions[i] for i in live]
+            if with_field_tfs:
+                field_tfs = [field_tfs[i] for i in live]
+        if with_field_tfs:
+            field_tfs = [tf for posting in field_tfs for tf in posting]
+        yield doc_ids, tfs, [doc_length[doc_id] for doc_id in doc_ids], positions, field_tfs
+
+
+def _copy_document(writer: SegmentWriter, segment, doc_id: int) -> None:
+    writer.add_document(doc_id, segment.docmap[doc_id],
+                        segment.doc_length[doc_id], segment.field_length[doc_id])
+
+
+def _without_deleted(postings: PostingList, deleted: AbstractSet[int]) -> Iterator[tuple[int, int]]:
+    for doc_id, tf in postings:
+        if doc_id not in deleted:
+            yield doc_id, tf
+
+
+def _live_postings(segment, deleted: AbstractSet[int], postings: PostingList, with_positions: bool,
+                   with_field_tfs: bool) -> Iterator[tuple[int, int, int, list[int] | None, list[int] | None]]:
+    for doc_ids, tfs, doc_lengths, positions, field_tfs in _live_blocks(
+            segment, deleted, postings, with_positions, with_field_tfs):
+        for i, doc_id in enumerate(doc_ids):
+            yield (doc_id, tfs[i], doc_lengths[i], positions[i] if with_positions else None,
+                   field_tfs[i * LEADING_FIELDS:(i + 1) * LEADING_FIELDS] if with_field_tfs else None)
+
@@ -1,65 +1,127 @@
 
+from functools import partial
 import os
-from sentence_transformers import SentenceTransformer
+
 import numpy as np
 
-from lib.utils.constants import CACHE_DIR
+from lib.hnsw_index import HNSWIndex
+from lib.ivfpq_index import IVFPQIndex
+from lib.query_embedding_cache import get_query_embedding_cache
+from lib.utils.constants import CACHE_DIR, EMBEDDING_ENCODER, EMBEDDING_STORAGE, HNSW_EF_SEARCH, IVF_NPROBE, SEMANTIC_BACKEND
+from lib.utils.embedding_utils import EmbeddingMatrix, LazyModel, load_embeddings, load_sentence_transformer, update_embeddings
 from lib.utils.search_utils import format_search_result
-from lib.utils.math_utils import cosine_similarity
+from lib.utils.math_utils import normalize_rows, top_k_indices
+
+SEMANTIC_BACKENDS = ("exact", "hnsw", "ivfpq")
 
 
 class SemanticSearch:
 
-    def __init__(self, model_name="all-MiniLM-L6-v2") -> None:
-        self.model = SentenceTransformer(model_name)
+    def __init__(self, model_name="all-MiniLM-L6-v2", backend: str = SEMANTIC_BACKEND,
+                 ef_search: int = HNSW_EF_SEARCH, nprobe: int = IVF_NPROBE,
+                 storage: str = EMBEDDING_STORAGE, encoder: str = EMBEDDING_ENCODER) -> None:
+        if backend not in SEMANTIC_BACKENDS:
+            raise ValueError(
+                f"Unknown semantic backend '{backend}', expected one of {SEMANTIC_BACKENDS}")
+
+        # loaded on the first encode, cached queries and embeddings never need it;
+        # run by PyTorch, or by ONNX Runtime with float32 or int8 weights
+        self.model = LazyModel(partial(load_sentence_transformer, model_name, encoder))
+        self.model_name = model_name
+        self.encoder = encoder
+        # every row L2-normalized so scoring is one matrix-vector product;
+        # float32, or a memory-mapped EmbeddingMatrix in float16 / int8 storage
         self.embeddings = None
+        self.storage = storage
         self.documents = None
         self.document_map: dict[int, dict] = {}
         self.embeddings_path = os.path.join(CACHE_DIR, "movie_embeddings.npy")
 
+        # "exact" scans every vector, "hnsw" walks an approximate nearest
+        # neighbour graph, "ivfpq" scores compressed codes of the `nprobe`
+        # closest lists and leaves the vectors on disk
+        self.backend = backend
+        self.ef_search = ef_search
+        self.nprobe = nprobe
+        self.vector_index: HNSWIndex | IVFPQIndex | None = None
+        self.vector_index_path = self._vector_index_path("movie")
+
     def build_embeddings(self, documents):
         self.documents = documents
 
-        document_list = []
         for doc in self.documents:
             self.document_map[doc["id"]] = doc
-            document_list.append(f"{doc['title']}: {doc['description']}")
 
-        self.embeddings = self.model.encode(
-            document_list, show_progress_bar=True)
-
-        with open(self.embeddings_path, "wb") as f:
-            np.save(f, self.embeddings)
+        # only documents whose text is new or changed since the last build
+        # are encoded, the other vectors are reused by text hash
+        document_texts = (f"{doc['title']}: {doc['description']}"
+                          for doc in self.documents)
+        _, encoded = update_embeddings(
+            self.embeddings_path, self.model, self.model_name, document_texts, self.storage, self.encoder)
+        self.embeddings = self._load_vectors(self.embeddings_path)
+
+        if encoded is not None:
+            print(f"Encoded {encoded} new or changed documents, reused {len(self.embeddings) - encoded}")
+            self._remove_vector_indexes("movie")
+        if self.backend != "exact":
+            self.vector_index = self._load_or_create_vector_index(
+                self.embeddings, self.vector_index_path)
 
         return self.embeddings
 
     def load_or_create_embeddings(self, documents):
-        self.documents = documents
-
-        document_list = []
-        for doc in self.documents:
-            self.document_map[doc["id"]] = doc
-            document_list.append(f"{doc['title']}: {doc['description']}")
-
-        if os.path.exists(self.embeddings_path):
-            with open(self.embeddings_path, "rb") as f:
-                self.embeddings = np.load(f)
-
-            if len(self.embeddings) == len(self.documents):
-                return self.embeddings
-
-        return self.build_embeddings(self.documents)
+        return self.build_embeddings(documents)
+
+    def _load_vectors(self, path: str) -> np.ndarray | EmbeddingMatrix:
+        # rows are L2-normalized when encoded, so they are scored straight
+        # from the mapped pages, one page-cache copy shared by every process
+        return load_embeddings(path, self.storage)
+
+    def _vector_index_path(self, name: str, backend: str | None = None) -> str:
+        return os.path.join(CACHE_DIR, f"{name}_{backend or self.backend}.npz")
+
+    def _remove_vector_indexes(self, name: str) -> None:
+        """Drop the approximate indexes of `name`'s previous vectors, they are stale."""
+        for backend in SEMANTIC_BACKENDS[1:]:
+            path = self._vector_index_path(name, backend)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _load_or_create_vector_index(self, vectors: np.ndarray, path: str) -> HNSWIndex | IVFPQIndex:
+        index_class = HNSWIndex if self.backend == "hnsw" else IVFPQIndex
+        if os.path.exists(path):
+            try:
+                return index_class.load(path, vectors)
+            except ValueError as e:
+                print(f"{e}, rebuilding it")
+
+        print(f"Building {self.backend} index over {len(vectors)} vectors...")
+        if self.backend == "hnsw":
+            index = HNSWIndex(vectors).build()
+        else:
+            index = IVFPQIndex.build(vectors)
+        index.save(path)
+        return index
+
+    def _vector_search(self, index: HNSWIndex | IVFPQIndex, vectors: np.ndarray, query: np.ndarray,
+                       k: int) -> tuple[np.ndarray, np.ndarray]:
+        """(ids, scores) of the approximate k nearest `vectors` from the backend's index."""
+        if self.backend == "hnsw":
+            return index.search(query, k, max(self.ef_search, k))
+        return index.search(query, k, self.nprobe, vectors)
 
     def generate_embedding(self, text):
         if len(text) == 0:
             raise ValueError("search text cannot be empty")
 
-        embeddings = self.model.encode([text])
+        # repeated queries are served from the shared query embedding cache
+        embedding = get_query_embedding_cache().get_or_encode(
+            self.model, self.model_name, text)
 
         print(
-            f"Generated embedding for text: {text[:30]}... -> {embeddings[0][:5]}...")
+            f"Generated embedding for text: {text[:30]}... -> {embedding[:5]}...")
 
-        return embeddings[0]
+        return embedding
 
     def search(self, query: str, limit: int) -> list:
 
@@ -71,17 +133,20 @@ class SemanticSearch:
             raise ValueError(
                 "No documents loaded. Call `load_or_create_embeddings` first.")
 
-        query_emb = self.generate_embedding(query)
-
-        results = []
-        for i, embedding in enumerate(self.embeddings):
-            score = cosine_similarity(query_emb, embedding)
-            results.append((score, self.documents[i]))
+        query_emb = normalize_rows(self.generate_embedding(query))
 
-        results.sort(key=lambda item: item[0], reverse=True)
+        if self.backend == "exact":
+            # cosine similarity with every document at once
+            scores = self.embeddings @ query_emb
+            top_ids = top_k_indices(scores, limit)
+            top_scores = scores[top_ids]
+        else:
+            top_ids, top_scores = self._vector_search(
+                self.vector_index, self.embeddings, query_emb, limit)
 
         output = []
-        for i, (score, doc) in enumerate(results[:limit]):
+        for i, score in zip(top_ids.tolist(), top_scores.tolist()):
+            doc = self.documents[i]
             formatted_result = format_search_result(
                 doc_id=doc["id"],
                 title=doc["title"],
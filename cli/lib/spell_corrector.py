@@ -0,0 +1,175 @@
+from collections import defaultdict
+from functools import cache
+import json
+import os
+from typing import Iterator
+
+from lib.inverted_index import InvertedIndex
+from lib.utils.constants import CACHE_DIR, SPELL_MAX_EDIT_DISTANCE, SPELL_PREFIX_LENGTH
+
+
+class SpellCorrector:
+    """SymSpell-style spelling correction over the words of the indexed catalog.
+
+    Every word is stored under each string obtained by deleting up to
+    `max_distance` characters from its first `prefix_length` characters. A
+    typo within that distance shares at least one of those deletes with the
+    word, so lookup only generates the deletes of the query word and verifies
+    the few words filed under them with an edit distance. Candidates are
+    ranked by distance, then by document frequency.
+    """
+
+    def __init__(self, words: dict[str, int], generation: int = 0, deletes: dict[str, list[str]] | None = None,
+                 max_distance: int = SPELL_MAX_EDIT_DISTANCE, prefix_length: int = SPELL_PREFIX_LENGTH) -> None:
+        self.words = words
+        self.generation = generation
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+
+        if deletes is None:
+            deletes = defaultdict(list)
+            for word in words:
+                for delete in self.__deletes(word):
+                    deletes[delete].append(word)
+        self.deletes = deletes
+
+    @classmethod
+    def from_index(cls, index) -> "SpellCorrector":
+        """Words are the index's vocabulary words. Stopwords are kept (with a
+        zero count) so they are never corrected away."""
+        words = dict.fromkeys(index.analyzer.stopwords, 0)
+        words.update(index.vocabulary_words())
+        return cls(words, index.generation)
+
+    def __deletes(self, word: str) -> set[str]:
+        return set().union(*self.__delete_levels(word))
+
+    def __delete_levels(self, word: str) -> Iterator[set[str]]:
+        """The deletes of the word's prefix, by number of deleted characters."""
+        level = {word[:self.prefix_length]}
+        seen = set(level)
+        yield level
+        for _ in range(self.max_distance):
+            level = {edit[:i] + edit[i + 1:]
+                     for edit in level if len(edit) > 1 for i in range(len(edit))} - seen
+            seen |= level
+            yield level
+
+    def suggest(self, word: str) -> str | None:
+        """The closest, most frequent word within `max_distance` edits, or None."""
+        if word in self.words:
+            return word
+
+        best, best_key = None, None
+        seen = set()
+        for level, deletes in enumerate(self.__delete_levels(word)):
+            for delete in deletes:
+                for candidate in self.deletes.get(delete, ()):
+                    if candidate in seen:
+                        continue
+                    seen.add(candidate)
+                    max_distance = best_key[0] if best_key else self.max_distance
+                    if abs(len(candidate) - len(word)) > max_distance:
+                        continue
+                    distance = edit_distance(word, candidate, max_distance)
+                    if distance > max_distance:
+                        continue
+                    key = (distance, -self.words[candidate], candidate)
+                    if best_key is None or key < best_key:
+                        best, best_key = candidate, key
+            # every word within `level` edits shares a delete of at most `level` characters
+            if best_key is not None and best_key[0] <= level:
+                break
+        return best
+
+    def correct(self, query: str) -> tuple[str, bool]:
+        """Correct each word of the query; returns (corrected query, whether
+        every word was resolved). Numbers and other non-alphabetic words are
+        left alone, as are words with no suggestion."""
+        corrected, resolved = [], True
+        for word in query.split():
+            stripped = word.strip(".,!?;:'\"()").lower()
+            if not stripped.isalpha():
+                corrected.append(word)
+                continue
+            suggestion = self.suggest(stripped)
+            if suggestion is None:
+                resolved = False
+                corrected.append(word)
+            elif suggestion == stripped:
+                corrected.append(word)
+            else:
+                corrected.append(suggestion)
+        return " ".join(corrected), resolved
+
+    def save(self, path: str) -> None:
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"generation": self.generation, "max_distance": self.max_distance,
+                       "prefix_length": self.prefix_length, "words": self.words, "deletes": self.deletes}, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "SpellCorrector":
+        with open(path, "r") as f:
+            state = json.load(f)
+        return cls(state["words"], state["generation"], state["deletes"],
+                   state["max_distance"], state["prefix_length"])
+
+
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+    """Optimal string alignment distance (adjacent transpositions count as one
+    edit), or max_distance + 1 as soon as it is known to exceed max_distance."""
+    # only the differing middle needs the dynamic program
+    start = 0
+    while start < len(a) and start < len(b) and a[start] == b[start]:
+        start += 1
+    end = 0
+    while end < len(a) - start and end < len(b) - start and a[-1 - end] == b[-1 - end]:
+        end += 1
+    a, b = a[start:len(a) - end], b[start:len(b) - end]
+    if not a or not b:
+        return min(len(a) + len(b), max_distance + 1)
+
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+
+    # cells more than max_distance off the diagonal can't be on a path within
+    # max_distance, so only a band around it is computed
+    over = max_distance + 1
+    previous_previous = None
+    previous = [j if j <= max_distance else over for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        current = [over] * (len(b) + 1)
+        if i <= max_distance:
+            current[0] = i
+        char = a[i - 1]
+        row_min = current[0]
+        for j in range(max(1, i - max_distance), min(len(b), i + max_distance) + 1):
+            distance = previous[j - 1] if char == b[j - 1] else previous[j - 1] + 1
+            if previous[j] + 1 < distance:
+                distance = previous[j] + 1
+            if current[j - 1] + 1 < distance:
+                distance = current[j - 1] + 1
+            if i > 1 and j > 1 and char == b[j - 2] and a[i - 2] == b[j - 1] \
+                    and previous_previous[j - 2] + 1 < distance:
+                distance = previous_previous[j - 2] + 1
+            current[j] = distance if distance < over else over
+            if distance < row_min:
+                row_min = distance
+        if row_min > max_distance:
+            return over
+        previous_previous, previous = previous, current
+    return previous[-1]
+
+
+@cache
+def get_spell_corrector() -> SpellCorrector:
+    """The corrector of the saved index, rebuilt when the index generation moves on."""
+    index = InvertedIndex()
+    index.load()
+
+    return index.load_or_build_artifact(
+        SpellCorrector, os.path.join(CACHE_DIR, "spell_dictionary.json"),
+        is_current=lambda corrector: corrector.max_distance == SPELL_MAX_EDIT_DISTANCE
+        and corrector.prefix_length == SPELL_PREFIX_LENGTH)
@@ -0,0 +1,273 @@
+import contextlib
+from glob import glob
+import io
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from lib.chunked_semantic_search import ChunkedSemanticSearch
+from lib.hnsw_index import HNSWIndex
+from lib.index_builder import build_postings, document_fields
+from lib.inverted_index import InvertedIndex
+from lib.ivfpq_index import IVFPQIndex
+from lib.query_cache import QueryCache
+from lib.utils.constants import PROJECT_ROOT
+from lib.utils.embedding_utils import encode_bulk, load_sentence_transformer
+from lib.utils.evaluation_utils import precision_at_k, recall_at_k
+from lib.utils.math_utils import normalize_rows, top_k_indices
+from lib.utils.search_utils import get_analyzer, load_golden_dataset, load_movies
+
+
+def benchmark_index_build(worker_counts: list[int]) -> list[dict]:
+    """Time the postings build (no save) at each worker count, in docs/sec."""
+    movies = sorted(load_movies(), key=lambda m: m["id"])
+    documents = [(movie["id"], document_fields(movie)) for movie in movies]
+
+    results = []
+    for workers in worker_counts:
+        # start every run with cold stems so worker counts are comparable
+        get_analyzer().stem_cache.clear()
+
+        start = time.perf_counter()
+        build_postings(documents, workers)
+        elapsed = time.perf_counter() - start
+
+        results.append({
+            "workers": workers,
+            "seconds": elapsed,
+            "docs_per_sec": len(documents) / elapsed,
+        })
+
+    return results
+
+
+def benchmark_bm25_batch(query_count: int, limit: int) -> dict:
+    """Queries/sec of per-query bm25_search against one bm25_search_many batch.
+
+    Movie titles are used as the query set.
+    """
+    idx = InvertedIndex()
+    idx.load()
+    # measure scoring, not the query cache
+    idx.query_cache = QueryCache(capacity=0)
+    queries = [movie["title"] for movie in load_movies()[:query_count]]
+
+    start = time.perf_counter()
+    idx.bm25_matrix()
+    matrix_seconds = time.perf_counter() - start
+
+    # bm25_search prints its tokens, keep them out of the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        for query in queries:
+            idx.bm25_search(query, limit)
+        single_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    idx.bm25_search_many(queries, limit)
+    batch_seconds = time.perf_counter() - start
+
+    return {
+        "queries": len(queries),
+        "matrix_seconds": matrix_seconds,
+        "single_qps": len(queries) / single_seconds,
+        "batch_qps": len(queries) / batch_seconds,
+    }
+
+
+def benchmark_hnsw(query_count: int, k: int, ef_searches: list[int], M: int, ef_construction: int) -> dict:
+    """Recall@k and latency of HNSW chunk search at each ef_search, against the exact scan.
+
+    The graph is built fresh with the given M / ef_construction (not saved);
+    movie titles, encoded with the search model, are the queries.
+    """
+    searcher = ChunkedSemanticSearch()
+    movies = load_movies()
+    vectors = searcher.load_or_create_chunk_embeddings(movies)
+    queries = normalize_rows(searcher.model.encode(
+        [movie["title"] for movie in movies[:query_count]]))
+
+    start = time.perf_counter()
+    index = HNSWIndex(vectors, M, ef_construction).build()
+    build_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    exact = [top_k_indices(vectors @ query, k) for query in queries]
+    exact_seconds = time.perf_counter() - start
+
+    runs = []
+    for ef_search in ef_searches:
+        start = time.perf_counter()
+        found = [index.search(query, k, ef_search)[0] for query in queries]
+        seconds = time.perf_counter() - start
+
+        hits = sum(len(set(approximate.tolist()) & set(truth.tolist()))
+                   for approximate, truth in zip(found, exact))
+        runs.append({
+            "ef_search": ef_search,
+            "recall": hits / max(1, sum(len(truth) for truth in exact)),
+            "ms_per_query": seconds / len(queries) * 1000,
+        })
+
+    return {
+        "chunks": len(vectors),
+        "queries": len(queries),
+        "build_seconds": build_seconds,
+        "exact_ms_per_query": exact_seconds / len(queries) * 1000,
+        "runs": runs,
+    }
+
+
+def benchmark_ivfpq(query_count: int, k: int, nprobes: list[int], rerank: int, subvectors: int) -> dict:
+    """Recall@k and latency of IVF-PQ chunk search at each nprobe, against the
+    exact scan, with PQ scores only and with the top `rerank` re-scored exactly.
+
+    The index is built fresh (not saved); movie titles, encoded with the
+    search model, are the queries.
+    """
+    searcher = ChunkedSemanticSearch()
+    movies = load_movies()
+    vectors = searcher.load_or_create_chunk_embeddings(movies)
+    queries = normalize_rows(searcher.model.encode(
+        [movie["title"] for movie in movies[:query_count]]))
+
+    start = time.perf_counter()
+    index = IVFPQIndex.build(vectors, subvectors=subvectors)
+    build_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    exact = [top_k_indices(vectors @ query, k) for query in queries]
+    exact_seconds = time.perf_counter() - start
+
+    runs = []
+    for nprobe in nprobes:
+        for rescored in (0, rerank):
+            start = time.perf_counter()
+            found = [index.search(query, k, nprobe, vectors, rescored)[0] for query in queries]
+            seconds = time.perf_counter() - start
+
+            hits = sum(len(set(approximate.tolist()) & set(truth.tolist()))
+                       for approximate, truth in zip(found, exact))
+            runs.append({
+                "nprobe": nprobe,
+                "rerank": rescored,
+                "recall": hits / max(1, sum(len(truth) for truth in exact)),
+                "ms_per_query": seconds / len(queries) * 1000,
+            })
+
+    return {
+        "chunks": len(vectors),
+        "queries": len(queries),
+        "build_seconds": build_seconds,
+        "vector_bytes": vectors.nbytes,
+        "index_bytes": index.codes.nbytes + index.ids.nbytes + index.offsets.nbytes
+        + index.centroids.nbytes + index.codebooks.nbytes,
+        "exact_ms_per_query": exact_seconds / len(queries) * 1000,
+        "runs": runs,
+    }
+
+
+def benchmark_encoders(encoders: list[str], limit: int, model_name: str = "all-MiniLM-L6-v2") -> list[dict]:
+    """Load time, single-query latency, bulk throughput and golden dataset
+    precision / recall at `limit` of the search model on each encoder, and
+    the cosine of its movie vectors to the first encoder's.
+
+    Each encoder embeds the whole catalog in one process and is searched
+    exactly; the query embedding cache is bypassed.
+    """
+    movies = load_movies()
+    texts = [f"{movie['title']}: {movie['description']}" for movie in movies]
+    test_cases = load_golden_dataset()["test_cases"]
+    queries = [test_case["query"] for test_case in test_cases]
+
+    results = []
+    reference = None
+    for encoder in encoders:
+        start = time.perf_counter()
+        model = load_sentence_transformer(model_name, encoder)
+        load_seconds = time.perf_counter() - start
+        # the first call sets up the session / allocator, keep it out of the latency
+        model.encode(queries[:1])
+
+        latencies = []
+        query_vectors = []
+        for query in queries:
+            start = time.perf_counter()
+            query_vectors.append(model.encode([query])[0])
+            latencies.append(time.perf_counter() - start)
+        query_vectors = normalize_rows(np.array(query_vectors))
+
+        # encode_bulk prints its own throughput, keep it out of the report
+        with tempfile.TemporaryDirectory() as tmp_dir, contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            embeddings = np.array(encode_bulk(
+                os.path.join(tmp_dir, "embeddings.npy"), model, model_name, texts, encoder, workers=1))
+            encode_seconds = time.perf_counter() - start
+
+        precision = recall = 0.0
+        for test_case, query in zip(test_cases, query_vectors):
+            retrieved = [movies[i]["title"] for i in top_k_indices(embeddings @ query, limit)]
+            relevant = set(test_case["relevant_docs"])
+            precision += precision_at_k(retrieved, relevant, limit)
+            recall += recall_at_k(retrieved, relevant, limit)
+
+        if reference is None:
+            reference = embeddings
+        # both are L2-normalized, so the row-wise dot product is the cosine
+        cosines = np.einsum("ij,ij->i", embeddings, reference)
+
+        results.append({
+            "encoder": encoder,
+            "load_seconds": load_seconds,
+            "query_ms": statistics.median(latencies) * 1000,
+            "texts_per_sec": len(texts) / encode_seconds,
+            "precision": precision / len(test_cases),
+            "recall": recall / len(test_cases),
+            "min_cosine": float(cosines.min()),
+            "mean_cosine": float(cosines.mean()),
+        })
+    return results
+
+
+def benchmark_startup(runs: int, top: int = 3) -> list[dict]:
+    """Median time to start a fresh interpreter and import each CLI entry
+    point, with the `top` slowest top-level packages it pulls in (from
+    python -X importtime)."""
+    cli_dir = os.path.join(PROJECT_ROOT, "cli")
+
+    results = []
+    for path in sorted(glob(os.path.join(cli_dir, "*_cli.py"))):
+        module = os.path.splitext(os.path.basename(path))[0]
+        command = [sys.executable, "-c", f"import {module}"]
+
+        seconds = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            completed = subprocess.run(command, cwd=cli_dir, capture_output=True, text=True)
+            seconds.append(time.perf_counter() - start)
+            if completed.returncode:
+                break
+
+        profile = subprocess.run([sys.executable, "-X", "importtime", *command[1:]],
+                                 cwd=cli_dir, capture_output=True, text=True).stderr
+        packages = {}
+        for line in profile.splitlines():
+            if not line.startswith("import time:") or "|" not in line:
+                continue
+            _, cumulative, name = line.split("|")
+            name = name.strip()
+            if cumulative.strip().isdigit() and "." not in name and name != module:
+                packages[name] = max(packages.get(name, 0), int(cumulative))
+
+        results.append({
+            "entry_point": module,
+            "ms": statistics.median(seconds) * 1000,
+            "error": completed.stderr.strip().splitlines()[-1] if completed.returncode else None,
+            "slowest_imports": sorted(packages.items(), key=lambda item: -item[1])[:top],
+        })
+    return results
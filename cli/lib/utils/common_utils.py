@@ -1,3 +1,5 @@
+from functools import cache
+import os
 import time
 
 from lib.utils.constants import RATE_TIME_SECONDS
@@ -6,3 +8,13 @@ from lib.utils.constants import RATE_TIME_SECONDS
 def rate_limit():
     """Prevent exceeding API rate limits (15 RPM)"""
     time.sleep(RATE_TIME_SECONDS)
+
+
+@cache
+def get_genai_client():
+    """The Gemini client, created (and .env loaded) on first use instead of at import."""
+    from dotenv import load_dotenv  # type: ignore
+    from google import genai
+
+    load_dotenv()
+    return genai.Client(api_key=os.environ.get("GEMINI_API_KEY"))
@@ -3,13 +3,45 @@ import os
 
 PROJECT_ROOT = os.path.dirname(os.path.dirname(
     os.path.dirname(os.path.dirname(__file__))))
-print(f"Project Root Folder: {PROJECT_ROOT}")
 DATA_PATH = os.path.join(PROJECT_ROOT, "data", "movies.json")
 GOLDEN_DATASET_PATH = os.path.join(PROJECT_ROOT, "data", "golden_dataset.json")
 STOPWORDS_PATH = os.path.join(PROJECT_ROOT, "data", "stopwords.txt")
 CACHE_DIR = os.path.join(PROJECT_ROOT, "cache")
 BM25_K1 = 1.5
 BM25_B = 0.75
+# indexed fields, in token order; every field but the last keeps its own tfs and lengths
+INDEX_FIELDS = ("title", "description")
+BM25F_WEIGHTS = {"title": 3.0, "description": 1.0}
+BM25F_B = {"title": 0.5, "description": 0.75}
+POSTING_BLOCK_SIZE = 64
+STEM_CACHE_SIZE = 100_000
+MERGE_FACTOR = 10
+MERGE_DELETED_RATIO = 0.3
+PROXIMITY_WINDOW = 5
+BM25_BATCH_CELLS = 1 << 24
+QUERY_CACHE_SIZE = 1024
+QUERY_CACHE_POLICY = "lfu"  # or "lru"
+QUERY_EMBEDDING_CACHE_SIZE = 4096
+SPELL_MAX_EDIT_DISTANCE = 2
+SPELL_PREFIX_LENGTH = 7
+CORPUS_READ_SIZE = 1 << 20
+INDEX_BATCH_SIZE = 10_000
+EMBEDDING_BATCH_SIZE = 256
+EMBEDDING_BUILD_BATCH_SIZE = 50_000  # texts hashed, encoded and written at a time
+EMBEDDING_BATCH_TOKENS = 16_384  # estimated tokens per bulk encoding batch
+EMBEDDING_WORKERS = 4
+EMBEDDING_POOL_MIN_TEXTS = 4096  # fewer texts are encoded in-process
+EMBEDDING_ENCODER = "torch"  # "torch", "onnx" or "onnx-int8"
+ONNX_QUANTIZATION = "avx2"  # int8 kernels: "arm64", "avx2", "avx512" or "avx512_vnni"
+EMBEDDING_STORAGE = "float32"  # "float32", "float16" or "int8"
+SEMANTIC_BACKEND = "exact"  # "exact", "hnsw" or "ivfpq"
+HNSW_M = 16
+HNSW_EF_CONSTRUCTION = 100
+HNSW_EF_SEARCH = 64
+IVF_NPROBE = 8
+IVF_RERANK = 100  # candidates re-scored exactly, 0 keeps the PQ scores
+IVF_TRAIN_SAMPLE = 50_000
+PQ_SUBVECTORS = 48  # bytes per vector
 DEFAULT_SEARCH_LIMIT = 5
 DOCUMENT_PREVIEW_LIMIT = 100
 DEFAULT_WEIGHT = 0.5
@@ -0,0 +1,472 @@
+from glob import glob
+from itertools import batched, chain
+import hashlib
+import os
+import shutil
+import time
+from typing import Any, Callable, Iterable, Iterator
+
+import numpy as np
+
+from lib.utils.constants import (
+    CACHE_DIR,
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_BATCH_TOKENS,
+    EMBEDDING_BUILD_BATCH_SIZE,
+    EMBEDDING_ENCODER,
+    EMBEDDING_POOL_MIN_TEXTS,
+    EMBEDDING_STORAGE,
+    EMBEDDING_WORKERS,
+    ONNX_QUANTIZATION,
+)
+from lib.utils.math_utils import normalize_rows
+
+EMBEDDING_ENCODERS = ("torch", "onnx", "onnx-int8")
+EMBEDDING_STORAGES = ("float32", "float16", "int8")
+STORAGE_DTYPES = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+STORAGE_NAMES = {np.dtype(dtype): name for name, dtype in STORAGE_DTYPES.items()}
+# rows upcast at a time while scoring, 512 x 384 float32 stays in L2
+SCORE_BLOCK_ROWS = 512
+CONVERT_BATCH_ROWS = 65536
+TEXT_KEY_BYTES = 16
+# rough characters per wordpiece, enough to bucket texts by length
+CHARS_PER_TOKEN = 4
+HALF_EXPONENT_SCALE = np.float32(2.0 ** 112)
+
+
+class LazyModel:
+    """Stands in for a model and only builds it, importing its library, on
+    first use, so code paths that never encode never pay for loading it."""
+
+    def __init__(self, factory: Callable[[], Any]) -> None:
+        self.__factory = factory
+        self.__model = None
+
+    def load(self) -> Any:
+        if self.__model is None:
+            self.__model = self.__factory()
+        return self.__model
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith("_LazyModel__"):
+            # not set up yet, e.g. while unpickling
+            raise AttributeError(name)
+        return getattr(self.load(), name)
+
+    def __repr__(self) -> str:
+        return repr(self.load())
+
+
+def load_sentence_transformer(model_name: str, encoder: str = EMBEDDING_ENCODER, **kwargs):
+    """`model_name` run by PyTorch ("torch"), or by ONNX Runtime on the CPU
+    ("onnx"), optionally with dynamically int8-quantized weights ("onnx-int8").
+
+    Models without a shipped ONNX file are exported from their PyTorch
+    weights (which needs optimum), and quantized copies are written once
+    under cache/onnx/ for ONNX_QUANTIZATION kernels.
+    """
+    if encoder not in EMBEDDING_ENCODERS:
+        raise ValueError(f"Unknown encoder '{encoder}', expected one of {EMBEDDING_ENCODERS}")
+
+    from sentence_transformers import SentenceTransformer
+
+    if encoder == "torch":
+        return SentenceTransformer(model_name, **kwargs)
+
+    if encoder == "onnx":
+        return SentenceTransformer(model_name, backend="onnx", **kwargs)
+
+    export_dir = os.path.join(CACHE_DIR, "onnx", model_name.replace("/", "--"))
+    quantized = glob(os.path.join(export_dir, "onnx", f"model_*_{ONNX_QUANTIZATION}.onnx"))
+    if not quantized:
+        from sentence_transformers import export_dynamic_quantized_onnx_model
+
+        model = SentenceTransformer(model_name, backend="onnx", **kwargs)
+        # the tokenizer and pooling config go next to the quantized weights
+        model.save(export_dir)
+        export_dynamic_quantized_onnx_model(model, ONNX_QUANTIZATION, export_dir)
+        quantized = glob(os.path.join(export_dir, "onnx", f"model_*_{ONNX_QUANTIZATION}.onnx"))
+
+    model_kwargs = {**kwargs.pop("model_kwargs", {}),
+                    "file_name": os.path.relpath(quantized[0], export_dir).replace(os.sep, "/")}
+    return SentenceTransformer(export_dir, backend="onnx", model_kwargs=model_kwargs, **kwargs)
+
+
+def encode_in_batches(model, texts: Iterable[str], batch_size: int = EMBEDDING_BATCH_SIZE) -> Iterator[np.ndarray]:
+    """Encode a stream of texts, one fixed-size batch at a time."""
+    for batch in batched(texts, batch_size):
+        yield model.encode(list(batch))
+
+
+def length_batches(texts: list[str], max_batch_size: int = EMBEDDING_BATCH_SIZE,
+                   batch_tokens: int = EMBEDDING_BATCH_TOKENS) -> list[np.ndarray]:
+    """Row numbers of `texts` in batches of similar length, longest first.
+
+    Texts are sorted by estimated token count, so each batch pads to nearly
+    its own length, and a batch takes texts until it would pad past
+    `batch_tokens` (at most `max_batch_size`): short texts go in large
+    batches, long ones in small.
+    """
+    lengths = np.fromiter((len(text) for text in texts), dtype=np.int64, count=len(texts)) // CHARS_PER_TOKEN + 2
+    order = np.argsort(lengths, kind="stable")
+    sorted_lengths = lengths[order].tolist()
+
+    batches = []
+    start = 0
+    while start < len(order):
+        end = start + 1
+        while end < len(order) and end - start < max_batch_size \
+                and (end - start + 1) * sorted_lengths[end] <= batch_tokens:
+            end += 1
+        batches.append(order[start:end])
+        start = end
+    # the slowest batches first, so workers finish together
+    return batches[::-1]
+
+
+def encode_bulk(path: str, model, model_name: str, texts: list[str],
+                encoder: str = EMBEDDING_ENCODER, workers: int = EMBEDDING_WORKERS) -> np.ndarray:
+    """L2-normalized float32 embeddings of `texts` in order, saved at `path`
+    and memory-mapped.
+
+    Texts are encoded in length_batches. Above EMBEDDING_POOL_MIN_TEXTS the
+    batches are spread over a pool of `workers` processes, each loading its
+    own copy of `model_name` on `encoder` and limiting torch or ONNX
+    Runtime to its share of the CPUs.
+    Fewer texts are encoded here with `model`, which spares loading copies
+    for a small update. Prints the throughput.
+    """
+    start_time = time.perf_counter()
+    batches = length_batches(texts)
+    workers = min(workers, os.cpu_count() or 1, len(batches))
+    if len(texts) < EMBEDDING_POOL_MIN_TEXTS:
+        workers = 1
+
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        from multiprocessing import get_context
+
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        # spawn, a forked torch runtime can deadlock in the child
+        with ProcessPoolExecutor(workers, mp_context=get_context("spawn"), initializer=_init_encoder,
+                                 initargs=(model_name, encoder, threads)) as executor:
+            encoded = executor.map(_encode_batch, ([texts[row] for row in rows] for rows in batches))
+            embeddings = _write_in_order(path, len(texts), zip(batches, encoded))
+    else:
+        encoded = (normalize_rows(model.encode([texts[row] for row in rows], batch_size=len(rows)))
+                   for rows in batches)
+        embeddings = _write_in_order(path, len(texts), zip(batches, encoded))
+
+    seconds = time.perf_counter() - start_time
+    print(f"Encoded {len(texts)} texts in {seconds:.1f}s "
+          f"({len(texts) / max(seconds, 1e-9):.0f} texts/sec, {max(workers, 1)} worker(s))")
+    return embeddings
+
+
+def _write_in_order(path: str, count: int, results: Iterable[tuple[np.ndarray, np.ndarray]]) -> np.ndarray:
+    embeddings = None
+    for rows, vectors in results:
+        if embeddings is None:
+            embeddings = np.lib.format.open_memmap(
+                path, mode="w+", dtype=np.float32, shape=(count, vectors.shape[1]))
+        embeddings[rows] = vectors
+    if embeddings is not None:
+        embeddings.flush()
+        del embeddings
+    return np.load(path, mmap_mode="r")
+
+
+_worker_model = None
+
+
+def _init_encoder(model_name: str, encoder: str, threads: int) -> None:
+    global _worker_model
+    try:
+        import torch
+
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+    kwargs = {}
+    if encoder != "torch":
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        kwargs["model_kwargs"] = {"session_options": options}
+    _worker_model = load_sentence_transformer(model_name, encoder, **kwargs)
+
+
+def _encode_batch(texts: list[str]) -> np.ndarray:
+    return normalize_rows(_worker_model.encode(texts, batch_size=len(texts)))
+
+
+def save_embedding_batches(path: str, batches: Iterable[np.ndarray],
+                           storage: str = EMBEDDING_STORAGE) -> "np.ndarray | EmbeddingMatrix":
+    """Stream embedding batches into a .npy file in `storage` and return it memory-mapped.
+
+    The row count is only known at the end, so rows go to a raw side file
+    first and are copied behind the .npy header once complete. int8 rows
+    get a float32 scale each, kept in a second .npy next to them.
+    """
+    if storage not in EMBEDDING_STORAGES:
+        raise ValueError(
+            f"Unknown embedding storage '{storage}', expected one of {EMBEDDING_STORAGES}")
+
+    raw_path, raw_scales_path = f"{path}.raw", f"{path}.scales.raw"
+    rows, dim = 0, 0
+    with open(raw_path, "wb") as raw, open(raw_scales_path, "wb") as raw_scales:
+        for batch in batches:
+            values, scales = quantize_rows(batch, storage)
+            rows += len(values)
+            dim = values.shape[1]
+            raw.write(values.tobytes())
+            if scales is not None:
+                raw_scales.write(scales.tobytes())
+
+    if storage == "int8":
+        _write_npy(scales_path(path), raw_scales_path, (rows,), np.float32)
+    else:
+        os.remove(raw_scales_path)
+    _write_npy(path, raw_path, (rows, dim), STORAGE_DTYPES[storage])
+
+    return load_embeddings(path, storage)
+
+
+def _write_npy(path: str, raw_path: str, shape: tuple, dtype) -> None:
+    """Move the rows in `raw_path` behind a .npy header, then atomically to `path`."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f, open(raw_path, "rb") as raw:
+        np.lib.format.write_array_header_1_0(f, {
+            "descr": np.lib.format.dtype_to_descr(np.dtype(dtype)),
+            "fortran_order": False,
+            "shape": shape,
+        })
+        shutil.copyfileobj(raw, f)
+    os.remove(raw_path)
+    os.replace(tmp_path, path)
+
+
+def scales_path(path: str) -> str:
+    return f"{os.path.splitext(path)[0]}_scales.npy"
+
+
+def keys_path(path: str) -> str:
+    return f"{os.path.splitext(path)[0]}_keys.npy"
+
+
+def text_key(model_name: str, text: str) -> bytes:
+    """16-byte hash of the model and the whitespace-normalized text, so an
+    embedding can be reused wherever the same text shows up again. The
+    encoder is left out: ONNX vectors stay within tolerance of PyTorch's
+    (see `benchmark_cli encoders`), so switching re-encodes nothing."""
+    normalized = " ".join(text.split())
+    return hashlib.blake2b(f"{model_name}\0{normalized}".encode(), digest_size=TEXT_KEY_BYTES).digest()
+
+
+def update_embeddings(path: str, model, model_name: str, texts: Iterable[str],
+                      storage: str = EMBEDDING_STORAGE, encoder: str = EMBEDDING_ENCODER
+                      ) -> tuple["np.ndarray | EmbeddingMatrix", int | None]:
+    """(embeddings of `texts` in order, saved at `path`, and how many texts
+    were encoded, None if the saved embeddings were already those).
+
+    Every row's text key is kept next to the embeddings. `texts` are
+    streamed in batches of EMBEDDING_BUILD_BATCH_SIZE: rows of texts that are
+    already there are copied over, only new or changed texts are encoded
+    (each distinct text once across the corpus, kept in `{path}.new*.npy`
+    until the build ends) and the batch is written out before the next is
+    read, so memory doesn't grow with the corpus. Rows whose text is gone are
+    dropped with the old file.
+    """
+    old_keys = []
+    if os.path.exists(path) and os.path.exists(keys_path(path)):
+        old_keys = [key.tobytes() for key in np.load(keys_path(path))]
+    old = load_embeddings(path, storage) if old_keys else None
+    if old is not None and len(old) != len(old_keys):
+        old, old_keys = None, []
+
+    # batches that match the saved rows one for one need no encoding or
+    # copying until one differs
+    batches = (([text_key(model_name, text) for text in batch], batch)
+               for batch in batched(texts, EMBEDDING_BUILD_BATCH_SIZE))
+    keys = []
+    changed = None
+    for batch_keys, batch in batches:
+        if batch_keys != old_keys[len(keys):len(keys) + len(batch_keys)]:
+            changed = (batch_keys, batch)
+            break
+        keys.extend(batch_keys)
+    if changed is None and len(keys) == len(old_keys) and old is not None:
+        return old, None
+
+    old_rows = {}
+    for row, key in enumerate(old_keys):
+        old_rows.setdefault(key, row)
+    unchanged = len(keys)
+    encoded = 0
+    # key -> (encoded batch, row) of every text encoded so far, so a text
+    # repeated in a later batch reuses its vector
+    fresh_rows: dict[bytes, tuple[int, int]] = {}
+    fresh_parts: list[np.ndarray] = []
+
+    def gathered() -> Iterator[np.ndarray]:
+        nonlocal encoded
+        for start in range(0, unchanged, CONVERT_BATCH_ROWS):
+            yield old[start:min(start + CONVERT_BATCH_ROWS, unchanged)]
+
+        for batch_keys, batch in chain([changed] if changed else [], batches):
+            keys.extend(batch_keys)
+            # dicts keep insertion order, so this is also the encode order
+            missing = {}
+            for key, text in zip(batch_keys, batch):
+                if key not in old_rows and key not in fresh_rows and key not in missing:
+                    missing[key] = text
+            if missing:
+                part = len(fresh_parts)
+                fresh_parts.append(encode_bulk(f"{path}.new{part}.npy", model, model_name,
+                                               list(missing.values()), encoder))
+                fresh_rows.update((key, (part, row)) for row, key in enumerate(missing))
+                encoded += len(missing)
+
+            # a new model's vectors may be wider or narrower than the saved ones,
+            # its keys never match those so nothing is copied from `old` then
+            width = fresh_parts[-1].shape[1] if fresh_parts else old.shape[1]
+            rows = np.empty((len(batch_keys), width), dtype=np.float32)
+            reused = np.array([key in old_rows for key in batch_keys], dtype=bool)
+            if reused.any():
+                rows[reused] = old[[old_rows[key] for key, hit in zip(batch_keys, reused) if hit]]
+            # (rows, encoded rows) to copy from each encoded batch
+            by_part: dict[int, tuple[list[int], list[int]]] = {}
+            for row, (key, hit) in enumerate(zip(batch_keys, reused)):
+                if not hit:
+                    part, fresh_row = fresh_rows[key]
+                    targets, sources = by_part.setdefault(part, ([], []))
+                    targets.append(row)
+                    sources.append(fresh_row)
+            for part, (targets, sources) in by_part.items():
+                rows[targets] = fresh_parts[part][sources]
+            yield rows
+
+    # without keys the rows are re-encoded next time, never paired with the wrong text
+    if os.path.exists(keys_path(path)):
+        os.remove(keys_path(path))
+    try:
+        embeddings = save_embedding_batches(path, gathered(), storage)
+    finally:
+        parts = len(fresh_parts)
+        fresh_parts.clear()
+        for part in range(parts):
+            os.remove(f"{path}.new{part}.npy")
+    if storage != "int8" and os.path.exists(scales_path(path)):
+        os.remove(scales_path(path))
+
+    tmp_keys_path = f"{keys_path(path)}.tmp.npy"
+    np.save(tmp_keys_path, np.frombuffer(b"".join(keys), dtype=np.uint8).reshape(-1, TEXT_KEY_BYTES))
+    os.replace(tmp_keys_path, keys_path(path))
+    return embeddings, encoded
+
+
+def quantize_rows(vectors: np.ndarray, storage: str) -> tuple[np.ndarray, np.ndarray | None]:
+    """Rows in `storage`'s dtype, plus the float32 scale of every row for int8
+    (row ~ values * scale, the largest component mapping to +-127)."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if storage != "int8":
+        return np.ascontiguousarray(vectors, dtype=STORAGE_DTYPES[storage]), None
+
+    scales = np.abs(vectors).max(axis=1, initial=0) / 127
+    values = np.divide(vectors, scales[:, None], out=np.zeros_like(vectors), where=scales[:, None] > 0)
+    return np.rint(values).astype(np.int8), scales.astype(np.float32)
+
+
+def load_embeddings(path: str, storage: str = EMBEDDING_STORAGE) -> "np.ndarray | EmbeddingMatrix":
+    """Memory-map the embeddings at `path`, rewriting them in `storage` first
+    if they were saved in another one (no re-encoding). float32 comes back as
+    a plain memmap, the compact storages wrapped in an EmbeddingMatrix."""
+    values = np.load(path, mmap_mode="r")
+    stored = STORAGE_NAMES[values.dtype]
+    scales = np.load(scales_path(path), mmap_mode="r") if stored == "int8" else None
+
+    if stored != storage:
+        current = EmbeddingMatrix(values, scales)
+        batches = (current[start:start + CONVERT_BATCH_ROWS]
+                   for start in range(0, len(current), CONVERT_BATCH_ROWS))
+        saved = save_embedding_batches(path, batches, storage)
+        if stored == "int8":
+            os.remove(scales_path(path))
+        return saved
+
+    return values if storage == "float32" else EmbeddingMatrix(values, scales)
+
+
+class EmbeddingMatrix:
+    """Read-only embedding rows in a compact dtype, float16 or int8 with a
+    per-row scale, usually memory-mapped so every process shares the page
+    cache. Indexing returns float32 rows and `matrix @ query` is computed
+    SCORE_BLOCK_ROWS rows at a time, so the whole matrix is never upcast."""
+
+    def __init__(self, values: np.ndarray, scales: np.ndarray | None = None) -> None:
+        self.values = values
+        self.scales = scales
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return self.values.shape
+
+    @property
+    def nbytes(self) -> int:
+        return self.values.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def __getitem__(self, key) -> np.ndarray:
+        rows = self.values[key].astype(np.float32)
+        if self.scales is not None:
+            rows *= np.asarray(self.scales[key], dtype=np.float32)[..., None]
+        return rows
+
+    def __matmul__(self, query: np.ndarray) -> np.ndarray:
+        query = np.asarray(query, dtype=np.float32)
+        if self.values.dtype == np.float16:
+            # undo the widened rows' 2**-112 on the query: scaling the scores
+            # afterwards leaves the products subnormal, which is slow
+            query = query * HALF_EXPONENT_SCALE
+        scores = np.empty(len(self.values), dtype=np.float32)
+        # both block buffers are reused, fresh multi-MB temporaries cost more
+        # in page faults than the arithmetic
+        block_rows = min(SCORE_BLOCK_ROWS, len(scores))
+        upcast = np.empty((block_rows, self.values.shape[1]), dtype=np.float32)
+        signs = np.empty_like(upcast, dtype=np.uint32)
+        for start in range(0, len(scores), block_rows):
+            block = self.values[start:start + block_rows]
+            rows = upcast[:len(block)]
+            if block.dtype == np.float16:
+                _float16_to_float32(block, rows, signs[:len(block)])
+            else:
+                np.copyto(rows, block)
+            np.matmul(rows, query, out=scores[start:start + len(block)])
+
+        if self.scales is not None:
+            # (scale * values) . query == scale * (values . query)
+            scores *= self.scales
+        return scores
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        rows = self[:]
+        return rows if dtype is None else rows.astype(dtype)
+
+
+def _float16_to_float32(half: np.ndarray, out: np.ndarray, signs: np.ndarray) -> None:
+    """`half` * 2**-112 into `out` with integer ops; on 100k x 384 rows numpy's
+    own float16 cast alone took longer than scoring with this (100 vs 63 ms,
+    it depends on the CPU's float16 support). Moving the exponent and mantissa bits
+    into float32 position gives the value scaled by 2**-112, subnormals
+    included (inf / nan are not kept, embeddings have none)."""
+    bits = out.view(np.uint32)
+    np.copyto(bits, half.view(np.uint16))
+    np.bitwise_and(bits, 0x8000, out=signs)
+    np.left_shift(signs, 16, out=signs)
+    np.bitwise_and(bits, 0x7FFF, out=bits)
+    np.left_shift(bits, 13, out=bits)
+    np.bitwise_or(bits, signs, out=bits)
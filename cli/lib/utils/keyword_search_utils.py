@@ -1,34 +1,31 @@
+from itertools import batched
 import re
 
+from lib.boolean_query import any_of
 from lib.inverted_index import InvertedIndex
-from lib.utils.constants import BM25_B, BM25_K1, DEFAULT_SEARCH_LIMIT
+from lib.utils.constants import BM25_B, BM25_K1, DEFAULT_SEARCH_LIMIT, INDEX_BATCH_SIZE
 
-from lib.utils.search_utils import stop_words_remover, tokenizer
+from lib.utils.search_utils import get_analyzer, iter_movies
 
 
 def search_command(query: str, limit: int = DEFAULT_SEARCH_LIMIT) -> list[dict]:
     idx = InvertedIndex()
     idx.load()
 
-    if len(idx.docmap) == 0 or len(idx.index) == 0:
+    if len(idx.docmap) == 0:
         raise ValueError("no index built yet!")
 
-    query_tokens = tokenizer(query)
-    query_tokens = stop_words_remover(query_tokens)
+    query_tokens = get_analyzer().analyze(query)
 
-    matching_doc_ids = set()
-    for token in query_tokens:
-        if token in idx.index:
-            matching_doc_ids.update(idx.index[token])
+    # union of the query terms, merged lazily in doc id order
+    return [idx.docmap[doc_id] for doc_id in idx.match(any_of(query_tokens), limit)]
 
-    result = []
-    for id in sorted(matching_doc_ids):
-        if id in idx.docmap:
-            result.append(idx.docmap[id])
-            if len(result) >= limit:
-                break
 
-    return result
+def boolean_search_command(query: str, limit: int = DEFAULT_SEARCH_LIMIT) -> list[dict]:
+    idx = InvertedIndex()
+    idx.load()
+
+    return idx.boolean_search(query, limit)
 
 
 def tf_command(doc_id: int, term: str) -> int:
@@ -65,8 +62,52 @@ def bm25_tf_command(doc_id: int, term, k1=BM25_K1, b=BM25_B):
     return idx.get_bm25_tf(doc_id, term, k1, b)
 
 
-def bm25search(query: str, limit=5):
+def bm25search(query: str, limit=5, proximity: bool = False):
+    idx = InvertedIndex()
+    idx.load()
+
+    results = idx.bm25_search(query, limit, proximity=proximity)
+    idx.save_query_cache()
+    return results
+
+
+def bm25f_search_command(query: str, limit: int = DEFAULT_SEARCH_LIMIT,
+                         field_weights: dict[str, float] | None = None) -> list[dict]:
+    idx = InvertedIndex()
+    idx.load()
+
+    results = idx.bm25f_search(query, limit, field_weights)
+    idx.save_query_cache()
+    return results
+
+
+def autocomplete_command(prefix: str, limit: int = DEFAULT_SEARCH_LIMIT) -> dict[str, list[tuple[str, int]]]:
+    idx = InvertedIndex()
+    idx.load()
+
+    return idx.autocomplete(prefix, limit)
+
+
+def query_cache_stats_command() -> dict:
+    idx = InvertedIndex()
+    idx.load()
+
+    return idx.query_cache.stats()
+
+
+def upsert_command(path: str) -> int:
     idx = InvertedIndex()
     idx.load()
 
-    return idx.bm25_search(query, limit)
+    count = 0
+    for movies in batched(iter_movies(path), INDEX_BATCH_SIZE):
+        idx.upsert_documents(list(movies))
+        count += len(movies)
+
+    return count
+
+
+def delete_command(doc_id: int) -> None:
+    idx = InvertedIndex()
+    idx.load()
+    idx.delete_document(doc_id)
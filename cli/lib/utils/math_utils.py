@@ -1,5 +1,9 @@
+import math
+
 import numpy as np
 
+from lib.utils.constants import BM25_B, BM25_K1
+
 
 def cosine_similarity(vec1, vec2):
     dot_product = np.dot(vec1, vec2)
@@ -12,5 +16,49 @@ def cosine_similarity(vec1, vec2):
     return dot_product / (norm1 * norm2)
 
 
+def normalize_rows(vectors) -> np.ndarray:
+    """float32 copy with every row scaled to unit L2 norm (zero rows stay
+    zero), so cosine similarity against it is a plain dot product."""
+    vectors = np.array(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    np.divide(vectors, norms, out=vectors, where=norms > 0)
+    return vectors
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Positions of the k highest scores, best first (lowest position among
+    ties), partitioning instead of sorting every score."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+
+    candidates = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+    return candidates[np.lexsort((candidates, -scores[candidates]))]
+
+
 def rrf_score(rank, k=60):
     return 1 / (k + rank)
+
+
+def bm25_idf(doc_freq: int, doc_count: int) -> float:
+    return math.log((doc_count - doc_freq + 0.5) / (doc_freq + 0.5) + 1)
+
+
+def bm25_tf(tf: int, doc_length: int, avg_doc_length: float, k1: float = BM25_K1, b: float = BM25_B) -> float:
+    length_norm = 1 - b + b * (doc_length / avg_doc_length)
+
+    return (tf * (k1 + 1)) / (tf + k1 * length_norm)
+
+
+def bm25f_tf(field_tfs: list[int], field_lengths: list[int], avg_field_lengths: list[float],
+             field_weights: list[float], field_bs: list[float], k1: float = BM25_K1) -> float:
+    """BM25F: every field's tf is length normalized with its own b and average
+    length and weighted, and only their sum is saturated with k1."""
+    pseudo_tf = 0.0
+    for tf, length, avg_length, weight, b in zip(field_tfs, field_lengths, avg_field_lengths,
+                                                 field_weights, field_bs):
+        if tf:
+            length_ratio = length / avg_length if avg_length else 0.0
+            pseudo_tf += weight * tf / (1 - b + b * length_ratio)
+
+    return (pseudo_tf * (k1 + 1)) / (pseudo_tf + k1)
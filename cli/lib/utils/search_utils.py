@@ -1,15 +1,107 @@
+from functools import cache
 import json
 import string
-from typing import Any
-from nltk.stem import PorterStemmer
+from typing import Any, Iterator
 
-from lib.utils.constants import DATA_PATH, DOCUMENT_PREVIEW_LIMIT, GOLDEN_DATASET_PATH, STOPWORDS_PATH
+from lib.analyzer import Analyzer
+from lib.utils.constants import (
+    CORPUS_READ_SIZE,
+    DATA_PATH,
+    DOCUMENT_PREVIEW_LIMIT,
+    GOLDEN_DATASET_PATH,
+    STOPWORDS_PATH,
+)
 
 
 def load_movies() -> list[dict]:
-    with open(DATA_PATH, "r") as f:
-        data = json.load(f)
-    return data["movies"]
+    return list(iter_movies())
+
+
+def iter_movies(path: str = DATA_PATH) -> Iterator[dict]:
+    """Yield movies one at a time without reading the whole catalog.
+
+    `.jsonl` files hold one movie per line; otherwise the file is the
+    {"movies": [...]} layout (or a bare list), decoded one element at a time.
+    """
+    with open(path, "r") as f:
+        if path.endswith(".jsonl"):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from _JsonArrayReader(f).items("movies")
+
+
+class _JsonArrayReader:
+    """Incremental reader for the elements of one top-level JSON array,
+    keeping at most a read chunk plus the element being decoded in memory."""
+
+    def __init__(self, f) -> None:
+        self.file = f
+        self.buffer = ""
+        self.position = 0
+        self.decoder = json.JSONDecoder()
+
+    def __fill(self) -> bool:
+        chunk = self.file.read(CORPUS_READ_SIZE)
+        if not chunk:
+            return False
+        self.buffer = self.buffer[self.position:] + chunk
+        self.position = 0
+        return True
+
+    def __peek(self) -> str:
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position].isspace():
+                self.position += 1
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self.__fill():
+                return ""
+
+    def __take(self, expected: str) -> str:
+        char = self.__peek()
+        if char not in expected:
+            raise ValueError(
+                f"Malformed JSON: expected one of {expected!r}, found {char!r}")
+        self.position += 1
+        return char
+
+    def __value(self) -> Any:
+        self.__peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+            except json.JSONDecodeError:
+                # the value runs past the end of the buffer
+                if not self.__fill():
+                    raise
+                continue
+            # a number cut off by the end of the buffer decodes as a shorter one
+            if not isinstance(value, (dict, list, str)) and \
+                    not self.buffer[end:].strip("0123456789.eE+-") and self.__fill():
+                continue
+            self.position = end
+            return value
+
+    def items(self, key: str) -> Iterator[Any]:
+        if self.__take("{[") == "{":
+            while True:
+                name = self.__value()
+                self.__take(":")
+                if name == key:
+                    break
+                self.__value()
+                if self.__take(",}") == "}":
+                    raise ValueError(f"No '{key}' list in the JSON document")
+            self.__take("[")
+
+        if self.__peek() == "]":
+            return
+        while True:
+            yield self.__value()
+            if self.__take(",]") == "]":
+                return
 
 
 def load_golden_dataset() -> dict:
@@ -22,10 +114,18 @@ def load_stopwords() -> list[str]:
         return f.read().splitlines()
 
 
+PUNCTUATION_TABLE = str.maketrans("", "", string.punctuation)
+
+
+@cache
+def get_analyzer() -> Analyzer:
+    """Process-wide analyzer, so stopwords are read from disk only once."""
+    return Analyzer(load_stopwords())
+
+
 def processed_text(text: str) -> str:
     text = text.lower()
-    table = str.maketrans("", "", string.punctuation)
-    text = text.translate(table)
+    text = text.translate(PUNCTUATION_TABLE)
     return text
 
 
@@ -41,15 +141,7 @@ def tokenizer(text: str) -> list[str]:
 
 
 def stop_words_remover(tokens: list[str]) -> list[str]:
-    stopwords = load_stopwords()
-    stemmer = PorterStemmer()
-
-    valid_tokens = []
-    for token in tokens:
-        if token not in stopwords:
-            valid_tokens.append(stemmer.stem(token))
-
-    return valid_tokens
+    return get_analyzer().filter_and_stem(tokens)
 
 
 def format_search_result(
@@ -1,8 +1,9 @@
 
 import re
 import numpy as np
-from lib.utils.constants import DEFAULT_SEARCH_LIMIT
+from lib.utils.constants import DEFAULT_SEARCH_LIMIT, EMBEDDING_ENCODER, HNSW_EF_SEARCH, IVF_NPROBE, SEMANTIC_BACKEND
 from lib.utils.search_utils import format_search_result, load_movies
+from lib.query_embedding_cache import get_query_embedding_cache
 from lib.semantic_search import SemanticSearch
 
 
@@ -43,8 +44,14 @@ def embed_query_text(query):
     print(f"Shape: {embedding.shape}")
 
 
-def search(query: str, limit: int = DEFAULT_SEARCH_LIMIT) -> list:
-    semantic_model = SemanticSearch()
+def query_embedding_cache_stats() -> dict:
+    return get_query_embedding_cache().stats()
+
+
+def search(query: str, limit: int = DEFAULT_SEARCH_LIMIT, backend: str = SEMANTIC_BACKEND,
+           ef_search: int = HNSW_EF_SEARCH, nprobe: int = IVF_NPROBE, encoder: str = EMBEDDING_ENCODER) -> list:
+    semantic_model = SemanticSearch(
+        backend=backend, ef_search=ef_search, nprobe=nprobe, encoder=encoder)
 
     documents = load_movies()
 
@@ -112,8 +119,7 @@ def semantic_chunk_text(query, max_chunk_size, overlap):
     chunks = []
 
     if len(sentences) == 1 and not sentences[0].endswith(('.', '?', '!')):
-        chunked_sentences.append(sentences)
-        chunks.append(sentences)
+        chunks.append(sentences[0])
         return chunks
 
     for sentence in sentences:
@@ -2,9 +2,11 @@
 
 import argparse
 from lib.chunked_semantic_search import embed_chunks, search_chunked
-from lib.utils.constants import DOCUMENT_PREVIEW_LIMIT
+from lib.semantic_search import SEMANTIC_BACKENDS
+from lib.utils.constants import DOCUMENT_PREVIEW_LIMIT, EMBEDDING_ENCODER, HNSW_EF_SEARCH, IVF_NPROBE, SEMANTIC_BACKEND
+from lib.utils.embedding_utils import EMBEDDING_ENCODERS
 from lib.utils.search_utils import load_movies
-from lib.utils.semantic_search_utils import verify_model, search, semantic_chunk_text, embed_query_text, embed_text, verify_embeddings, chunk_text
+from lib.utils.semantic_search_utils import verify_model, search, semantic_chunk_text, embed_query_text, embed_text, verify_embeddings, chunk_text, query_embedding_cache_stats
 
 
 def main():
@@ -34,6 +36,18 @@ def main():
         "query", type=str, help="The search query to process")
     semantic_search_parser.add_argument(
         "--limit", "-l", type=int, default=5, help="Specify the maximum number of results to return (default: 5)")
+    semantic_search_parser.add_argument(
+        "--backend", choices=SEMANTIC_BACKENDS, default=SEMANTIC_BACKEND,
+        help=f"Exact scan, HNSW graph or IVF-PQ compressed search (default: {SEMANTIC_BACKEND})")
+    semantic_search_parser.add_argument(
+        "--ef-search", type=int, default=HNSW_EF_SEARCH,
+        help=f"HNSW search width, higher is slower but more accurate (default: {HNSW_EF_SEARCH})")
+    semantic_search_parser.add_argument(
+        "--nprobe", type=int, default=IVF_NPROBE,
+        help=f"IVF-PQ lists scanned per query, higher is slower but more accurate (default: {IVF_NPROBE})")
+    semantic_search_parser.add_argument(
+        "--encoder", choices=EMBEDDING_ENCODERS, default=EMBEDDING_ENCODER,
+        help=f"Run the model with PyTorch, ONNX Runtime or ONNX Runtime with int8 weights (default: {EMBEDDING_ENCODER})")
 
     chunk_parser = subparsers.add_parser(
         "chunk", help="Excute a chunked search")
@@ -70,6 +84,21 @@ def main():
 
     search_chunked_parser.add_argument(
         "--limit", "-l", type=int, default=5, help="Specify the maximum number of results to return (default: 5)")
+    search_chunked_parser.add_argument(
+        "--backend", choices=SEMANTIC_BACKENDS, default=SEMANTIC_BACKEND,
+        help=f"Exact scan, HNSW graph or IVF-PQ compressed search (default: {SEMANTIC_BACKEND})")
+    search_chunked_parser.add_argument(
+        "--ef-search", type=int, default=HNSW_EF_SEARCH,
+        help=f"HNSW search width, higher is slower but more accurate (default: {HNSW_EF_SEARCH})")
+    search_chunked_parser.add_argument(
+        "--nprobe", type=int, default=IVF_NPROBE,
+        help=f"IVF-PQ lists scanned per query, higher is slower but more accurate (default: {IVF_NPROBE})")
+    search_chunked_parser.add_argument(
+        "--encoder", choices=EMBEDDING_ENCODERS, default=EMBEDDING_ENCODER,
+        help=f"Run the model with PyTorch, ONNX Runtime or ONNX Runtime with int8 weights (default: {EMBEDDING_ENCODER})")
+
+    subparsers.add_parser(
+        "embedcachestats", help="Show hit rate and encode time saved by the query embedding cache")
 
     args = parser.parse_args()
 
@@ -90,7 +119,8 @@ def main():
             embed_query_text(args.query)
 
         case "search":
-            results = search(args.query, args.limit)
+            results = search(args.query, args.limit,
+                             args.backend, args.ef_search, args.nprobe, args.encoder)
             for i, res in enumerate(results):
                 print(
                     f"{i}. {res['title']} (score: {res['score']:.2f})")
@@ -111,7 +141,16 @@ def main():
             embed_chunks()
 
         case "search_chunked":
-            search_chunked(args.query, args.limit)
+            search_chunked(args.query, args.limit,
+                           args.backend, args.ef_search, args.nprobe, args.encoder)
+
+        case "embedcachestats":
+            stats = query_embedding_cache_stats()
+            print(f"Cached queries: {stats['entries']}")
+            print(f"Memory hits: {stats['hits']}  Disk hits: {stats['disk_hits']}  "
+                  f"Misses: {stats['misses']}  Hit rate: {stats['hit_rate']:.1%}")
+            print(f"Encode time: {stats['encode_seconds']:.2f}s spent, "
+                  f"~{stats['saved_seconds']:.2f}s saved")
 
         case _:
             parser.print_help()
@@ -0,0 +1,29 @@
+from itertools import islice
+
+import pytest
+
+import lib.inverted_index
+from lib.inverted_index import InvertedIndex
+from lib.utils.search_utils import iter_movies
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch) -> InvertedIndex:
+    movies = list(islice(iter_movies(), 50))
+    monkeypatch.setattr(lib.inverted_index, "CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(lib.inverted_index, "iter_movies", lambda: iter(movies))
+    index = InvertedIndex()
+    index.build()
+    return index
+
+
+@pytest.mark.parametrize("weight", [0.0, -1.0, float("nan")])
+def test_non_positive_field_weights_are_rejected(index, weight):
+    with pytest.raises(ValueError, match="title weight must be positive"):
+        index.bm25f_search("family", field_weights={"title": weight})
+
+
+def test_field_weights_override_the_defaults(index):
+    results = index.bm25f_search("family", field_weights={"title": 0.5, "description": 2.0})
+    assert results == sorted(results, key=lambda result: -result["score"])
+    assert results and all(result["score"] > 0 for result in results)
@@ -0,0 +1,56 @@
+import hashlib
+import os
+
+import numpy as np
+
+import lib.utils.embedding_utils
+from lib.utils.embedding_utils import update_embeddings
+
+
+class HashModel:
+    """Stand-in for a SentenceTransformer: deterministic vectors of `dimension`
+    derived from each text, counting every text it encodes."""
+
+    def __init__(self, dimension: int) -> None:
+        self.dimension = dimension
+        self.encoded: list[str] = []
+
+    def encode(self, texts: list[str], batch_size: int = 32) -> np.ndarray:
+        self.encoded.extend(texts)
+        return np.array([np.frombuffer(hashlib.sha512(text.encode()).digest(), dtype=np.uint8)[:self.dimension]
+                         for text in texts], dtype=np.float32) + 1
+
+
+def test_rebuild_with_a_different_dimension(tmp_path):
+    path = str(tmp_path / "embeddings.npy")
+    texts = [f"movie {i}" for i in range(10)]
+
+    embeddings, encoded = update_embeddings(path, HashModel(8), "small", texts, "float32")
+    assert embeddings.shape == (10, 8) and encoded == 10
+
+    model = HashModel(5)
+    embeddings, encoded = update_embeddings(path, model, "other", texts, "float32")
+    assert embeddings.shape == (10, 5) and encoded == 10
+    assert np.allclose(np.linalg.norm(embeddings, axis=1), 1)
+
+
+def test_identical_texts_are_encoded_once(tmp_path, monkeypatch):
+    monkeypatch.setattr(lib.utils.embedding_utils, "EMBEDDING_BUILD_BATCH_SIZE", 3)
+    path = str(tmp_path / "embeddings.npy")
+    texts = ["a", "b", "a", "c", "b", "d", "a", "d"]
+
+    model = HashModel(8)
+    embeddings, encoded = update_embeddings(path, model, "small", texts, "float32")
+    assert sorted(model.encoded) == ["a", "b", "c", "d"] and encoded == 4
+    for text in "abcd":
+        rows = embeddings[[i for i, other in enumerate(texts) if other == text]]
+        assert (rows == rows[0]).all()
+    assert sorted(os.listdir(tmp_path)) == ["embeddings.npy", "embeddings_keys.npy"]
+
+    # an edit in a later batch encodes only that text
+    model = HashModel(8)
+    texts[6] = "e"
+    previous = np.array(embeddings)
+    embeddings, encoded = update_embeddings(path, model, "small", texts, "float32")
+    assert model.encoded == ["e"] and encoded == 1
+    assert (np.delete(embeddings, 6, axis=0) == np.delete(previous, 6, axis=0)).all()
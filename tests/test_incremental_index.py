@@ -0,0 +1,75 @@
+from itertools import islice
+
+import pytest
+
+import lib.inverted_index
+from lib.inverted_index import InvertedIndex
+from lib.utils.search_utils import iter_movies
+
+
+BASE_MOVIES = 120
+
+QUERIES = [
+    "love", "war", "family", "murder mystery", "space alien", "high school",
+    "detective", "young woman", "small town", "revenge", "christmas", "robot",
+    "world war ii", "new york city", "bank robbery", "vampire", "zombie",
+    "secret agent", "dog", "king",
+]
+
+
+@pytest.fixture(scope="module")
+def catalog() -> list[dict]:
+    return list(islice(iter_movies(), BASE_MOVIES + 20))
+
+
+def build_index(cache_dir, movies: list[dict], monkeypatch) -> InvertedIndex:
+    # every path of the index, including new segments, is under CACHE_DIR
+    monkeypatch.setattr(lib.inverted_index, "CACHE_DIR", str(cache_dir))
+    monkeypatch.setattr(lib.inverted_index, "iter_movies", lambda: iter(movies))
+    index = InvertedIndex()
+    index.build()
+    index.save()
+    return index
+
+
+def rankings(index: InvertedIndex, queries: list[str]) -> list:
+    return [[[(result["id"], result["score"]) for result in search(query, limit=10)]
+             for query in queries]
+            for search in (index.bm25_search, index.bm25f_search)]
+
+
+def test_updates_rank_like_a_rebuild(catalog, tmp_path, monkeypatch):
+    base = catalog[:BASE_MOVIES]
+    index = build_index(tmp_path / "incremental", base, monkeypatch)
+
+    # one segment per call, enough of them for the merge policy to kick in
+    final = {movie["id"]: movie for movie in base}
+    for movie in catalog[BASE_MOVIES:]:
+        index.add_document(movie)
+        final[movie["id"]] = movie
+    for donor, movie in zip(catalog[-5:], base[10:15]):
+        updated = dict(movie, description=donor["description"])
+        index.update_document(updated)
+        final[movie["id"]] = updated
+    for doc_id in (base[0]["id"], base[50]["id"], catalog[BASE_MOVIES + 3]["id"]):
+        index.delete_document(doc_id)
+        del final[doc_id]
+
+    segment_count = 1 + len(catalog) - BASE_MOVIES + 5
+    index.wait_for_merges()
+    index.maybe_merge(background=False)
+    assert len(index.segments) < segment_count
+
+    queries = QUERIES + [movie["title"] for movie in final.values() if movie["id"] % 7 == 0]
+    incremental = rankings(index, queries)
+
+    rebuilt = build_index(tmp_path / "rebuilt", sorted(final.values(), key=lambda movie: movie["id"]),
+                          monkeypatch)
+    expected = rankings(rebuilt, queries)
+
+    for search, (got, want) in enumerate(zip(incremental, expected)):
+        for query, got_results, want_results in zip(queries, got, want):
+            assert [doc_id for doc_id, _ in got_results] == [doc_id for doc_id, _ in want_results], \
+                (search, query)
+            assert [score for _, score in got_results] == pytest.approx(
+                [score for _, score in want_results], abs=1e-3), (search, query)
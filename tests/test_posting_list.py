@@ -0,0 +1,141 @@
+import random
+
+import pytest
+
+from lib.index_segment import SEGMENT_VERSION, HEADER, IndexSegment, write_segment
+from lib.posting_list import (
+    LEADING_FIELDS,
+    PostingList,
+    PostingListEncoder,
+    decode_varints,
+    encode_varints,
+)
+from lib.utils.constants import INDEX_FIELDS, POSTING_BLOCK_SIZE
+
+
+def random_postings(count: int, seed: int = 0) -> dict:
+    """Postings spanning several blocks, with gaps and tfs of one to five varint bytes."""
+    rng = random.Random(seed)
+    doc_ids, doc_id = [], 0
+    for i in range(count):
+        doc_id += rng.choice([1, 2, 127, 128, 300, 20_000, 3_000_000]) if i else 0
+        doc_ids.append(doc_id)
+    tfs = [rng.choice([1, 1, 2, 127, 128, 1_000]) for _ in doc_ids]
+    positions = []
+    for tf in tfs:
+        positions.append(sorted(rng.sample(range(5 * tf + 200), tf)))
+    field_tfs = []
+    for tf in tfs:
+        for _ in range(LEADING_FIELDS):
+            field_tfs.append(rng.choice([0, 0, 0, 1, tf]))
+    return {"doc_ids": doc_ids, "tfs": tfs, "doc_lengths": [tf + 10 for tf in tfs],
+            "positions": positions, "field_tfs": field_tfs}
+
+
+def assert_postings_equal(postings: PostingList, expected: dict) -> None:
+    assert len(postings) == len(expected["doc_ids"])
+    assert list(postings) == list(zip(expected["doc_ids"], expected["tfs"]))
+    assert list(postings.with_positions()) == list(
+        zip(expected["doc_ids"], expected["tfs"], expected["positions"]))
+
+    field_tfs = []
+    for block in range(postings.block_count()):
+        doc_ids, _ = postings.decode_block(block)
+        for tfs in postings.decode_field_tfs(block, len(doc_ids)):
+            field_tfs.extend(tfs)
+    assert field_tfs == expected["field_tfs"]
+
+    for doc_id, tf, positions in zip(expected["doc_ids"], expected["tfs"], expected["positions"]):
+        assert postings.tf(doc_id) == tf
+        assert postings.doc_positions(doc_id) == positions
+    assert postings.tf(expected["doc_ids"][-1] + 1) == 0
+
+
+@pytest.mark.parametrize("value", [0, 1, 127, 128, 16_383, 16_384, 2 ** 21, 2 ** 32 - 1])
+def test_varint_round_trip(value):
+    data = bytearray()
+    encode_varints([value, 5], data)
+    assert decode_varints(bytes(data), 0, 2) == ([value, 5], len(data))
+
+
+@pytest.mark.parametrize("count", [1, POSTING_BLOCK_SIZE - 1, POSTING_BLOCK_SIZE,
+                                   POSTING_BLOCK_SIZE + 1, 3 * POSTING_BLOCK_SIZE + 7])
+def test_posting_list_round_trip(count):
+    expected = random_postings(count, seed=count)
+    postings = PostingList(**expected)
+
+    assert postings.block_count() == -(-count // POSTING_BLOCK_SIZE)
+    blocks = range(0, count, POSTING_BLOCK_SIZE)
+    assert list(postings.block_last_docs) == [
+        expected["doc_ids"][min(start + POSTING_BLOCK_SIZE, count) - 1] for start in blocks]
+    assert list(postings.block_max_tfs) == [
+        max(expected["tfs"][start:start + POSTING_BLOCK_SIZE]) for start in blocks]
+    assert_postings_equal(postings, expected)
+
+
+def test_one_byte_blocks_round_trip():
+    # every gap and tf below 128 takes the single byte fast path
+    doc_ids = list(range(1, 2 * POSTING_BLOCK_SIZE + 1))
+    postings = PostingList(doc_ids, [1] * len(doc_ids), [3] * len(doc_ids))
+    assert len(postings.data) == 2 * len(doc_ids)
+    assert list(postings) == [(doc_id, 1) for doc_id in doc_ids]
+
+
+def test_encoder_matches_block_encoding():
+    expected = random_postings(2 * POSTING_BLOCK_SIZE + 9, seed=1)
+    encoder = PostingListEncoder(with_positions=True, with_field_tfs=True)
+    for i, doc_id in enumerate(expected["doc_ids"]):
+        encoder.add(doc_id, expected["tfs"][i], expected["doc_lengths"][i], expected["positions"][i],
+                    expected["field_tfs"][i * LEADING_FIELDS:(i + 1) * LEADING_FIELDS])
+    streamed = encoder.finish()
+    built = PostingList(**expected)
+
+    assert streamed.doc_count == built.doc_count
+    for name in PostingList.__slots__[1:]:
+        assert bytes(getattr(streamed, name)) == bytes(getattr(built, name)), name
+
+
+def test_segment_round_trip(tmp_path):
+    terms = {term: random_postings(count, seed=i) for i, (term, count) in
+             enumerate([("alpha", 1), ("beta", POSTING_BLOCK_SIZE), ("gamma", 2 * POSTING_BLOCK_SIZE + 3)])}
+    doc_ids = sorted({doc_id for postings in terms.values() for doc_id in postings["doc_ids"]})
+    docmap = {doc_id: {"id": doc_id, "title": f"movie {doc_id}", "description": "é" * (doc_id % 5)}
+              for doc_id in doc_ids}
+    doc_length = {doc_id: doc_id % 1_000 + 1 for doc_id in doc_ids}
+    field_length = {doc_id: tuple(doc_id % (7 + field) for field in range(LEADING_FIELDS))
+                    for doc_id in doc_ids}
+
+    path = str(tmp_path / "segment_0.seg")
+    write_segment(path, {term: PostingList(**postings) for term, postings in terms.items()},
+                  docmap, doc_length, field_length)
+    segment = IndexSegment(path)
+
+    header = HEADER.unpack_from(segment.buffer)
+    assert header[1:4] == (SEGMENT_VERSION, POSTING_BLOCK_SIZE, len(INDEX_FIELDS))
+
+    assert segment.doc_count == len(doc_ids)
+    assert segment.total_doc_length == sum(doc_length.values())
+    assert list(segment.docmap) == doc_ids
+    assert dict(segment.docmap.items()) == docmap
+    assert dict(segment.doc_length.items()) == doc_length
+    assert dict(segment.field_length.items()) == field_length
+    assert segment.total_field_lengths == [sum(lengths[field] for lengths in field_length.values())
+                                           for field in range(LEADING_FIELDS)]
+
+    assert list(segment.postings) == sorted(terms)
+    for term, expected in terms.items():
+        assert_postings_equal(segment.postings[term], expected)
+    assert "delta" not in segment.postings
+    assert doc_ids[-1] + 1 not in segment.docmap
+
+
+def test_segment_rejects_other_versions(tmp_path):
+    path = str(tmp_path / "segment_0.seg")
+    write_segment(path, {"alpha": PostingList([1], [1], [1])}, {1: {"id": 1}}, {1: 1},
+                  {1: (1,) * LEADING_FIELDS})
+    with open(path, "r+b") as f:
+        f.seek(8)
+        f.write((SEGMENT_VERSION - 1).to_bytes(4, "little"))
+
+    with pytest.raises(ValueError, match="incompatible version"):
+        IndexSegment(path)